@@ -0,0 +1,65 @@
+"""Auto-scheduling solver runtime on a synthetic week.
+
+Usage:
+    python -m benchmarks.autoschedule_bench [--slots 1000] [--employees 300] [--seed 1]
+
+Slots are spread over 7 days between 08:00 and 22:00 and need 1-3 people.
+Every employee has free time on a few random days and a few existing
+shifts. Prints solve time, filled places and how evenly shifts were spread.
+"""
+import argparse
+import random
+import statistics
+import time
+from collections import Counter
+
+from bot.autoschedule import OpenSlot, solve
+
+DAY = 24 * 60
+
+
+def synthesize(slot_count: int, employee_count: int, seed: int):
+    rng = random.Random(seed)
+    slots = []
+    for slot_id in range(slot_count):
+        day = rng.randrange(7)
+        start = day * DAY + rng.randrange(8 * 60, 18 * 60, 30)
+        slots.append(OpenSlot(slot_id, (start, start + rng.choice((120, 180, 240))), rng.randint(1, 3)))
+
+    free_time, busy = {}, {}
+    for employee_id in range(employee_count):
+        for day in rng.sample(range(7), rng.randint(2, 6)):
+            start = day * DAY + rng.randrange(7 * 60, 14 * 60, 60)
+            free_time.setdefault(employee_id, []).append((start, start + rng.randrange(4 * 60, 12 * 60, 60)))
+        for _ in range(rng.randint(0, 2)):
+            start = rng.randrange(7) * DAY + rng.randrange(8 * 60, 20 * 60, 60)
+            busy.setdefault(employee_id, []).append((start, start + 120))
+    load = {employee_id: len(intervals) for employee_id, intervals in busy.items()}
+    return slots, free_time, busy, load
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--slots', type=int, default=1000)
+    parser.add_argument('--employees', type=int, default=300)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    slots, free_time, busy, load = synthesize(args.slots, args.employees, args.seed)
+    places = sum(slot.missing for slot in slots)
+
+    started = time.perf_counter()
+    plan = solve(slots, free_time, busy, load)
+    elapsed = time.perf_counter() - started
+
+    per_employee = Counter(assignment.employee_id for assignment in plan)
+    counts = [per_employee.get(employee_id, 0) for employee_id in free_time]
+    print(f"{len(slots)} slots ({places} places) x {len(free_time)} employees")
+    print(f"solve time      {elapsed * 1000:10.1f} ms")
+    print(f"filled places   {len(plan):10d} ({len(plan) / max(places, 1):.1%})")
+    print(f"shifts/employee {statistics.mean(counts):10.2f} mean, {max(counts)} max, "
+          f"{statistics.pstdev(counts):.2f} stdev")
+
+
+if __name__ == '__main__':
+    main()
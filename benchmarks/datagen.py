@@ -0,0 +1,297 @@
+"""Synthetic production-like data: employees, recurring events, shifts and free time.
+
+Usage:
+    python -m benchmarks.datagen --dsn postgresql://... [--employees 500] [--locations 60]
+                                 [--months 24] [--ahead-days 30] [--seed 1] [--reset]
+
+Generates a deterministic (per --seed) data set and bulk-loads it with
+binary COPY into a database created by Database.init_db:
+
+    employees    Russian names, a few admins; how often each one works
+                 follows a skewed (log-normal) distribution
+    events       every location (address and coordinates around one city)
+                 hosts 1-4 recurring events: weekdays, weekends or daily,
+                 3-12 hours, mostly 1-3 people with the occasional big one;
+                 plus a few one-off events per day
+    shifts       past slots are filled to --fill on average, upcoming ones
+                 less the further ahead they are; nobody gets overlapping
+                 shifts and full slots are closed
+    free time    for the next --ahead-days days, about a third of the team
+                 on any day, never overlapping the employee's own shifts
+
+Tables must be empty (--reset truncates them first). Rows are generated and
+copied a month at a time inside one transaction, with payroll and free-time
+bitmap triggers switched off and the bitmaps rebuilt at the end; millions of
+rows load in minutes. generate() and employees() are usable without a
+database.
+"""
+import argparse
+import asyncio
+import itertools
+import math
+import random
+import time
+from datetime import date, time as dtime, timedelta
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import asyncpg
+
+from bot.database import FREE_TIME_BITMAPS_BACKFILL_SQL
+from bot.payroll import next_month
+
+USER_ID_BASE = 100_000_000
+CITY_CENTER = (55.7558, 37.6173)
+# Spread of locations around the center, degrees (about 10 km)
+CITY_SPREAD = (0.09, 0.15)
+STREETS = (
+    "Тверская", "Арбат", "Ленинский проспект", "Профсоюзная", "Садовая-Кудринская",
+    "Новослободская", "Мясницкая", "Пятницкая", "Большая Якиманка", "Варшавское шоссе",
+    "Кутузовский проспект", "Проспект Мира", "Люблинская", "Дмитровское шоссе", "Щёлковское шоссе",
+)
+FIRST_NAMES = (
+    "Александр", "Мария", "Дмитрий", "Анна", "Иван", "Елена", "Сергей", "Ольга", "Андрей",
+    "Наталья", "Алексей", "Татьяна", "Михаил", "Екатерина", "Никита", "Дарья", "Артём", "Полина",
+)
+LAST_NAMES = (
+    "Иванов", "Смирнов", "Кузнецов", "Попов", "Васильев", "Петров", "Соколов", "Михайлов",
+    "Новиков", "Фёдоров", "Морозов", "Волков", "Алексеев", "Лебедев", "Семёнов", "Егоров",
+)
+# (weekdays, weight): weekday events dominate
+DAY_PATTERNS = (((0, 1, 2, 3, 4), 60), ((5, 6), 15), (tuple(range(7)), 25))
+DURATION_HOURS = (3, 4, 4, 5, 6, 6, 8, 8, 10, 12)
+REQUIRED_EMPLOYEES = (1, 2, 3, 4, 5, 8, 12)
+REQUIRED_WEIGHTS = (30, 30, 16, 10, 7, 5, 2)
+# One-off events per day, as a share of the recurring ones
+ONE_OFF_RATE = 0.05
+FREE_TIME_DAY_CHANCE = 0.35
+
+SLOT_COLUMNS = ('id', 'date', 'start_time', 'end_time', 'address', 'location_latitude',
+                'location_longitude', 'required_employees', 'is_open')
+SHIFT_COLUMNS = ('slot_id', 'employee_id', 'date', 'start_time', 'end_time')
+FREE_TIME_COLUMNS = ('employee_id', 'date', 'start_time', 'end_time')
+LOADED_TABLES = ('users', 'schedule_slots', 'shifts', 'free_time_slots')
+DERIVED_TABLES = ('free_time_bitmaps', 'payroll_periods', 'payroll_closed_periods')
+
+
+class DataSpec(NamedTuple):
+    employees: int = 500
+    admins: int = 3
+    locations: int = 60
+    start: Optional[date] = None  # default: months before the current month
+    months: int = 24
+    ahead_days: int = 30
+    fill: float = 0.9
+    seed: int = 1
+
+
+class Event(NamedTuple):
+    address: str
+    latitude: float
+    longitude: float
+    weekdays: Tuple[int, ...]
+    start: int  # minutes from midnight
+    end: int
+    required: int
+
+
+class MonthBatch(NamedTuple):
+    month: date
+    slots: List[tuple]
+    shifts: List[tuple]
+    free_time: List[tuple]
+
+
+def _minutes_to_time(value: int) -> dtime:
+    return dtime(value // 60, value % 60)
+
+
+def employees(spec: DataSpec) -> List[tuple]:
+    """(user_id, username, full_name, is_admin) rows; the first spec.admins are admins"""
+    rng = random.Random(spec.seed)
+    rows = []
+    for i in range(spec.employees + spec.admins):
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        if first.endswith('а') or first.endswith('я'):
+            last += 'а'
+        username = f"user{USER_ID_BASE + i}" if rng.random() < 0.8 else None
+        rows.append((USER_ID_BASE + i, username, f"{first} {last}", i < spec.admins))
+    return rows
+
+
+def _event(rng: random.Random, address: str, latitude: float, longitude: float,
+           weekdays: Tuple[int, ...]) -> Event:
+    start = int(rng.triangular(7, 18, 9)) * 60 + rng.choice((0, 0, 30))
+    end = min(start + rng.choice(DURATION_HOURS) * 60, 23 * 60 + 59)
+    required = rng.choices(REQUIRED_EMPLOYEES, weights=REQUIRED_WEIGHTS)[0]
+    return Event(address, latitude, longitude, weekdays, start, end, required)
+
+
+def events(spec: DataSpec) -> List[Event]:
+    """Recurring events, 1-4 per location"""
+    rng = random.Random(spec.seed + 1)
+    patterns, weights = zip(*DAY_PATTERNS)
+    result = []
+    for _ in range(spec.locations):
+        address = f"ул. {rng.choice(STREETS)}, д. {rng.randint(1, 120)}"
+        latitude = round(rng.gauss(CITY_CENTER[0], CITY_SPREAD[0]), 6)
+        longitude = round(rng.gauss(CITY_CENTER[1], CITY_SPREAD[1]), 6)
+        for _ in range(rng.choice((1, 2, 2, 3, 4))):
+            result.append(_event(rng, address, latitude, longitude, rng.choices(patterns, weights=weights)[0]))
+    return result
+
+
+def _fill_chance(spec: DataSpec, day: date, today: date) -> float:
+    if day <= today:
+        return spec.fill
+    # Upcoming slots get booked gradually
+    return spec.fill * max(0.1, 1 - (day - today).days / max(spec.ahead_days, 1))
+
+
+def generate(spec: DataSpec, today: Optional[date] = None) -> Iterator[MonthBatch]:
+    """Slots, shifts and free time one month at a time, from spec.start to today + spec.ahead_days.
+
+    Slot ids are numbered from 1 in date order; shift and free time rows
+    have no id (left to the sequences).
+    """
+    today = today or date.today()
+    start = spec.start
+    if start is None:
+        start = today.replace(day=1)
+        for _ in range(spec.months):
+            start = (start - timedelta(days=1)).replace(day=1)
+    last = today + timedelta(days=spec.ahead_days)
+
+    rng = random.Random(spec.seed + 2)
+    recurring = events(spec)
+    staff = [row[0] for row in employees(spec)[spec.admins:]]
+    # Some people work almost daily, most a few times a week
+    activity = [rng.lognormvariate(0, 0.8) for _ in staff]
+    cumulative = list(itertools.accumulate(activity))
+    slot_id = 0
+
+    month = start.replace(day=1)
+    day = start
+    while month <= last:
+        batch = MonthBatch(month, [], [], [])
+        following = next_month(month)
+        while day < following and day <= last:
+            todays = [event for event in recurring if day.weekday() in event.weekdays]
+            for _ in range(_poisson(rng, len(recurring) * ONE_OFF_RATE)):
+                template = rng.choice(recurring)
+                todays.append(_event(rng, template.address, template.latitude, template.longitude, ()))
+            todays.sort(key=lambda event: event.start)
+
+            chance = _fill_chance(spec, day, today)
+            busy: Dict[int, List[Tuple[int, int]]] = {}
+            for event in todays:
+                slot_id += 1
+                wanted = sum(rng.random() < chance for _ in range(event.required))
+                picked = set()
+                for _ in range(wanted * 4):
+                    if len(picked) == wanted:
+                        break
+                    employee = rng.choices(staff, cum_weights=cumulative)[0]
+                    if employee in picked or any(s < event.end and event.start < e for s, e in busy.get(employee, ())):
+                        continue
+                    picked.add(employee)
+                    busy.setdefault(employee, []).append((event.start, event.end))
+
+                start_time, end_time = _minutes_to_time(event.start), _minutes_to_time(event.end)
+                batch.slots.append((
+                    slot_id, day, start_time, end_time, event.address, event.latitude, event.longitude,
+                    event.required, len(picked) < event.required,
+                ))
+                batch.shifts.extend((slot_id, employee, day, start_time, end_time) for employee in picked)
+
+            if today < day:
+                for employee in staff:
+                    if rng.random() >= FREE_TIME_DAY_CHANCE:
+                        continue
+                    free_start = rng.randrange(7 * 60, 17 * 60, 30)
+                    free_end = min(free_start + rng.randrange(3 * 60, 10 * 60 + 1, 60), 23 * 60 + 30)
+                    # Booking a shift removes the free time it overlaps
+                    if any(s < free_end and free_start < e for s, e in busy.get(employee, ())):
+                        continue
+                    batch.free_time.append((employee, day, _minutes_to_time(free_start), _minutes_to_time(free_end)))
+            day += timedelta(days=1)
+        yield batch
+        month = following
+
+
+def _poisson(rng: random.Random, mean: float) -> int:
+    # Knuth's method; the means here are small
+    limit, k, p = math.exp(-mean), 0, rng.random()
+    while p > limit:
+        k += 1
+        p *= rng.random()
+    return k
+
+
+async def load(conn: asyncpg.Connection, spec: DataSpec, reset: bool = False,
+               today: Optional[date] = None) -> Dict[str, int]:
+    """Generate spec's data set and COPY it into the bot's tables, return row counts per table"""
+    counts = dict.fromkeys(LOADED_TABLES, 0)
+    async with conn.transaction():
+        await conn.execute("SET LOCAL bot.skip_payroll_invalidation = 'on'")
+        await conn.execute("SET LOCAL bot.skip_free_time_bitmaps = 'on'")
+        if reset:
+            await conn.execute(f"TRUNCATE {', '.join(LOADED_TABLES + DERIVED_TABLES)} CASCADE")
+        elif await conn.fetchval("SELECT EXISTS (SELECT 1 FROM users) OR EXISTS (SELECT 1 FROM schedule_slots)"):
+            raise RuntimeError("Tables are not empty, load into a fresh database or reset them")
+
+        users = employees(spec)
+        await conn.copy_records_to_table(
+            'users', records=users, columns=('user_id', 'username', 'full_name', 'is_admin')
+        )
+        counts['users'] = len(users)
+
+        for batch in generate(spec, today):
+            await conn.execute("SELECT ensure_month_partitions($1)", batch.month)
+            for table, rows, columns in (('schedule_slots', batch.slots, SLOT_COLUMNS),
+                                         ('shifts', batch.shifts, SHIFT_COLUMNS),
+                                         ('free_time_slots', batch.free_time, FREE_TIME_COLUMNS)):
+                if rows:
+                    await conn.copy_records_to_table(table, records=rows, columns=columns)
+                    counts[table] += len(rows)
+
+        await conn.execute("SELECT setval('schedule_slots_id_seq', GREATEST((SELECT MAX(id) FROM schedule_slots), 1))")
+        await conn.execute(FREE_TIME_BITMAPS_BACKFILL_SQL)
+    for table in LOADED_TABLES:
+        await conn.execute(f"ANALYZE {table}")
+    return counts
+
+
+async def run(args):
+    spec = DataSpec(
+        employees=args.employees, admins=args.admins, locations=args.locations, months=args.months,
+        ahead_days=args.ahead_days, fill=args.fill, seed=args.seed,
+    )
+    conn = await asyncpg.connect(args.dsn)
+    try:
+        started = time.perf_counter()
+        counts = await load(conn, spec, reset=args.reset)
+        elapsed = time.perf_counter() - started
+    finally:
+        await conn.close()
+    total = sum(counts.values())
+    print(", ".join(f"{table}: {rows}" for table, rows in counts.items()))
+    print(f"{total} rows in {elapsed:.1f} s ({total / elapsed:,.0f} rows/s)")
+
+
+def main():
+    defaults = DataSpec._field_defaults
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dsn', required=True, help="database already initialized by the bot")
+    parser.add_argument('--employees', type=int, default=defaults['employees'])
+    parser.add_argument('--admins', type=int, default=defaults['admins'])
+    parser.add_argument('--locations', type=int, default=defaults['locations'])
+    parser.add_argument('--months', type=int, default=defaults['months'], help="months of history")
+    parser.add_argument('--ahead-days', type=int, default=defaults['ahead_days'])
+    parser.add_argument('--fill', type=float, default=defaults['fill'], help="share of past places filled")
+    parser.add_argument('--seed', type=int, default=defaults['seed'])
+    parser.add_argument('--reset', action='store_true', help="truncate the bot's tables first")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
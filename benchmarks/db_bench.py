@@ -0,0 +1,345 @@
+"""Per-method Database benchmark at several data sizes, with baseline comparison.
+
+Usage:
+    python -m benchmarks.db_bench --dsn postgresql://... [--scales 1000,100000,1000000] [--runs 20]
+                                  [--output results.json] [--baseline baseline.json] [--threshold 20]
+
+For every scale (number of shifts) the schema is created from scratch by
+Database.init_db in a throwaway db_bench schema, seeded with generated
+employees, slots, shifts and free time, and every Database method the bot
+calls is timed through the real pool: reads with the arguments the handlers
+use, writes with a setup/teardown pair that leaves the data as it was.
+get_schedule_slots_by_range is timed in all four of its branches.
+
+Results (median, p95 and min per method and scale, plus the environment)
+are written as JSON to --output. Given --baseline, an earlier output file,
+every method whose median got more than --threshold percent slower is
+listed and the exit status is 1, so a run can gate a schema change. Pool,
+migration, backup and maintenance batch methods are not measured.
+"""
+import argparse
+import asyncio
+import json
+import math
+import platform
+import statistics
+import sys
+import time
+from datetime import date, datetime, time as dtime, timedelta
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional
+
+import asyncpg
+
+from bot.database import FREE_TIME_BITMAPS_BACKFILL_SQL, Database
+from benchmarks.load_test import percentile
+
+SCHEMA = 'db_bench'
+SCALES = '1000,100000,1000000'
+# Days of history the shifts are spread over (fewer for small scales)
+HISTORY_DAYS = 365
+# Days of seeded future (slots, shifts and free time after today)
+FUTURE_DAYS = 30
+# Slot start times within a day: 08:00, 11:00, 14:00, 17:00, three hours each
+SLOT_STARTS = 4
+MIN_EMPLOYEES = 10
+RATE = 500.0
+
+
+class Case(NamedTuple):
+    """A timed call; setup's result is passed to call, call's result to teardown"""
+    call: Callable[..., Awaitable]
+    setup: Optional[Callable[[], Awaitable]] = None
+    teardown: Optional[Callable[..., Awaitable]] = None
+
+
+def with_search_path(dsn: str, schema: str) -> str:
+    # asyncpg passes unknown DSN parameters to the server as settings
+    return f"{dsn}{'&' if '?' in dsn else '?'}search_path={schema},public"
+
+
+def layout(shifts: int) -> Dict[str, int]:
+    """Employees, days and slots per day for a data set of shifts shifts.
+
+    Every employee works one shift a day; each slot takes two of them and
+    every other slot has a third place left open.
+    """
+    employees = max(MIN_EMPLOYEES, math.ceil(shifts / HISTORY_DAYS))
+    return {
+        'shifts': shifts,
+        'employees': employees,
+        'days': math.ceil(shifts / employees),
+        'slots_per_day': math.ceil(employees / 2),
+    }
+
+
+def first_day(data: Dict[str, int], today: date) -> date:
+    """First seeded day: the data ends FUTURE_DAYS after today"""
+    return today + timedelta(days=FUTURE_DAYS - data['days'] + 1)
+
+
+async def seed(conn: asyncpg.Connection, data: Dict[str, int], first: date):
+    await conn.execute("SET bot.skip_payroll_invalidation = 'on'")
+    await conn.execute("SET bot.skip_free_time_bitmaps = 'on'")
+    await conn.execute("""
+        INSERT INTO users (user_id, username, full_name, is_admin)
+        SELECT g, 'bench' || g, 'Сотрудник ' || g, g > $1
+        FROM generate_series(1, $1 + 1) AS g
+    """, data['employees'])
+    last = first + timedelta(days=data['days'] - 1)
+    await conn.execute("""
+        SELECT ensure_month_partitions(m::date)
+        FROM generate_series(date_trunc('month', $1::date), $2::date, INTERVAL '1 month') AS m
+    """, first, last)
+    await conn.execute("""
+        INSERT INTO schedule_slots (id, date, start_time, end_time, address, required_employees, is_open)
+        SELECT g + 1, $1::date + g / $2,
+               TIME '08:00' + (g % $2 % $3) * INTERVAL '3 hours',
+               TIME '11:00' + (g % $2 % $3) * INTERVAL '3 hours',
+               'ул. Тестовая, д. ' || (g % 50), 2 + g % 2, g % 2 = 1
+        FROM generate_series(0, $4::int * $2 - 1) AS g
+    """, first, data['slots_per_day'], SLOT_STARTS, data['days'])
+    await conn.execute("SELECT setval('schedule_slots_id_seq', (SELECT MAX(id) FROM schedule_slots))")
+    # Employee e of day d takes place e % 2 of the day's slot e / 2
+    await conn.execute("""
+        INSERT INTO shifts (slot_id, employee_id, date, start_time, end_time)
+        SELECT s.id, 1 + e, s.date, s.start_time, s.end_time
+        FROM schedule_slots s,
+        LATERAL (SELECT (s.id - 1) % $1 * 2 + k AS e FROM generate_series(0, 1) AS k) AS place
+        WHERE place.e < $2 AND (s.id - 1) / $1 * $2 + place.e < $3
+    """, data['slots_per_day'], data['employees'], data['shifts'])
+    # Free time on every other upcoming day, outside shift hours
+    await conn.execute("""
+        INSERT INTO free_time_slots (employee_id, date, start_time, end_time)
+        SELECT e, CURRENT_DATE + d, TIME '20:00', TIME '23:00'
+        FROM generate_series(1, $1) AS e, generate_series(1, $2, 2) AS d
+    """, data['employees'], FUTURE_DAYS)
+    await conn.execute(FREE_TIME_BITMAPS_BACKFILL_SQL)
+    await conn.execute("ANALYZE")
+
+
+def build_cases(db: Database, data: Dict[str, int], today: date) -> Dict[str, Case]:
+    employee = 1
+    admin = data['employees'] + 1
+    tomorrow = today + timedelta(days=1)
+    week = (tomorrow, tomorrow + timedelta(days=6))
+    # Last (closed) month, the usual payroll period
+    last_month_end = today.replace(day=1) - timedelta(days=1)
+    month = (last_month_end.replace(day=1), last_month_end)
+    new_user = 10 ** 12
+
+    async def tomorrow_slot():
+        slots = await db.get_schedule_slots_by_date(tomorrow)
+        return slots[0]['id'], tomorrow
+
+    async def slot_open_status():
+        slot = await db.get_slot_by_id(*await tomorrow_slot())
+        return slot['id'], slot['date'], slot['is_open']
+
+    async def added_user():
+        await db.add_user(new_user, 'bench_new', "Новый")
+        return (new_user,)
+
+    async def bench_slot():
+        # Late evening, clear of seeded shifts; free time is moved out of the way by assign_shift
+        slot_id = await db.add_schedule_slot(tomorrow, dtime(23, 30), dtime(23, 45), "Бенчмарк", required_employees=1)
+        return slot_id, tomorrow
+
+    async def drop_slot(_, slot_id: int, slot_date: date):
+        await db.delete_schedule_slot(slot_id, slot_date)
+
+    async def new_free_time():
+        await db.add_free_time_slot(employee, tomorrow, dtime(6), dtime(7))
+        free = await db.get_employee_free_time(employee, tomorrow, tomorrow)
+        return next(row['id'] for row in free if row['start_time'] == dtime(6)), employee
+
+    async def drop_free_time(*_):
+        for row in await db.get_employee_free_time(employee, tomorrow, tomorrow):
+            if row['start_time'] == dtime(6):
+                await db.delete_free_time_slot(row['id'], employee)
+
+    async def consume(stream):
+        return [row async for row in stream]
+
+    async def fresh_availability():
+        # Time the query behind the in-memory cache, not a cache hit
+        db._free_time_changed()
+        return ()
+
+    return {
+        'is_admin': Case(lambda: db.is_admin(admin)),
+        'get_user_by_id': Case(lambda: db.get_user_by_id(employee)),
+        'get_user_display_name': Case(lambda: db.get_user_display_name(employee)),
+        'get_all_users': Case(db.get_all_users),
+        'get_all_employees': Case(db.get_all_employees),
+        'get_all_users_for_editing': Case(db.get_all_users_for_editing),
+        'get_schedule_slots_by_date': Case(lambda: db.get_schedule_slots_by_date(tomorrow)),
+        'get_schedule_slots_by_range[all]': Case(lambda: db.get_schedule_slots_by_range(*week)),
+        'get_schedule_slots_by_range[employee]': Case(
+            lambda: db.get_schedule_slots_by_range(*week, employee_id=employee)),
+        'get_schedule_slots_by_range[open]': Case(lambda: db.get_schedule_slots_by_range(*week, only_open=True)),
+        'get_schedule_slots_by_range[open, exclude]': Case(
+            lambda: db.get_schedule_slots_by_range(*week, only_open=True, exclude_employee_id=employee)),
+        'get_slot_by_id': Case(db.get_slot_by_id, setup=tomorrow_slot),
+        'get_slot_assigned_count': Case(db.get_slot_assigned_count, setup=tomorrow_slot),
+        'get_available_employees_for_slot': Case(
+            db.get_available_employees_for_slot, setup=tomorrow_slot),
+        'get_employees_with_free_time': Case(lambda: db.get_employees_with_free_time(tomorrow, dtime(20), dtime(22))),
+        'get_day_availability': Case(lambda: db.get_day_availability(tomorrow)),
+        'get_employee_shifts': Case(lambda: db.get_employee_shifts(employee, *month)),
+        'get_employee_free_time': Case(lambda: db.get_employee_free_time(employee, *week)),
+        'get_free_time_bitmaps': Case(lambda: db.get_free_time_bitmaps(*week)),
+        'get_team_availability': Case(lambda: db.get_team_availability(*week), setup=fresh_availability),
+        'get_autoschedule_data': Case(lambda: db.get_autoschedule_data(*week)),
+        'get_salary_summary': Case(lambda: db.get_salary_summary(employee, *month)),
+        'calculate_salary': Case(lambda: db.calculate_salary(employee, *month, RATE)),
+        'get_payroll': Case(lambda: db.get_payroll(*month, RATE)),
+        'stream_schedule': Case(lambda: consume(db.stream_schedule(*week))),
+        'stream_shifts': Case(lambda: consume(db.stream_shifts(*month))),
+        'stream_payroll': Case(lambda: consume(db.stream_payroll(*month, RATE))),
+        'add_user': Case(lambda: db.add_user(new_user, 'bench_new', "Новый"),
+                         teardown=lambda _: db.remove_user(new_user)),
+        'remove_user': Case(db.remove_user, setup=added_user),
+        'update_employee_name': Case(lambda: db.update_employee_name(employee, "Сотрудник 1")),
+        'set_admin_status': Case(lambda: db.set_admin_status(employee, False)),
+        'initialize_admins': Case(lambda: db.initialize_admins([admin])),
+        'add_schedule_slot': Case(
+            lambda: db.add_schedule_slot(tomorrow, dtime(23, 30), dtime(23, 45), "Бенчмарк"),
+            teardown=lambda slot_id: db.delete_schedule_slot(slot_id, tomorrow)),
+        'delete_schedule_slot': Case(db.delete_schedule_slot, setup=bench_slot),
+        'update_slot_open_status': Case(db.update_slot_open_status, setup=slot_open_status),
+        'assign_shift': Case(lambda slot_id, slot_date: db.assign_shift(slot_id, slot_date, employee), setup=bench_slot,
+                             teardown=drop_slot),
+        'assign_shifts_bulk': Case(lambda slot_id, slot_date: db.assign_shifts_bulk([(slot_id, slot_date, employee)]),
+                                   setup=bench_slot, teardown=drop_slot),
+        'add_free_time_slot': Case(lambda: db.add_free_time_slot(employee, tomorrow, dtime(6), dtime(7)),
+                                   teardown=drop_free_time),
+        'add_free_time_slots': Case(
+            lambda: db.add_free_time_slots(employee, tomorrow, [(dtime(6), dtime(7))]), teardown=drop_free_time),
+        'delete_free_time_slot': Case(db.delete_free_time_slot, setup=new_free_time),
+        'remove_overlapping_free_time': Case(
+            lambda: db.remove_overlapping_free_time(employee, tomorrow, dtime(6), dtime(7))),
+    }
+
+
+async def time_case(case: Case, runs: int) -> Dict[str, float]:
+    timings = []
+    # The first call warms the pool's prepared statements and is not counted
+    for n in range(runs + 1):
+        args = await case.setup() if case.setup else ()
+        started = time.perf_counter()
+        result = await case.call(*args)
+        elapsed = (time.perf_counter() - started) * 1000
+        if case.teardown:
+            await case.teardown(result, *args)
+        if n:
+            timings.append(elapsed)
+    return {
+        'median_ms': round(statistics.median(timings), 3),
+        'p95_ms': round(percentile(timings, 95), 3),
+        'min_ms': round(min(timings), 3),
+    }
+
+
+async def run_scale(dsn: str, shifts: int, runs: int, only: Optional[List[str]]) -> Dict:
+    data = layout(shifts)
+    today = date.today()
+    conn = await asyncpg.connect(dsn)
+    await conn.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+    await conn.execute(f"CREATE SCHEMA {SCHEMA}")
+    await conn.close()
+
+    dsn = with_search_path(dsn, SCHEMA)
+    db = Database(db_url=dsn)
+    await db.init_pool()
+    try:
+        started = time.perf_counter()
+        conn = await asyncpg.connect(dsn)
+        try:
+            await seed(conn, data, first_day(data, today))
+        finally:
+            await conn.close()
+        seeded = time.perf_counter() - started
+        print(f"\n{shifts} shifts: {data['employees']} employees, {data['days']} days, "
+              f"{data['days'] * data['slots_per_day']} slots, seeded in {seeded:.1f} s")
+
+        results = {}
+        for name, case in build_cases(db, data, today).items():
+            if only and not any(pattern in name for pattern in only):
+                continue
+            results[name] = await time_case(case, runs)
+            print(f"  {name:44} {results[name]['median_ms']:9.2f} ms  p95 {results[name]['p95_ms']:9.2f} ms")
+        return {'data': data, 'seed_s': round(seeded, 1), 'methods': results}
+    finally:
+        await db.close_pool()
+
+
+def compare(results: Dict, baseline: Dict, threshold: float) -> List[str]:
+    """Methods whose median is more than threshold percent above the baseline's"""
+    regressions = []
+    for scale, current in results['scales'].items():
+        previous = baseline.get('scales', {}).get(scale)
+        if previous is None:
+            continue
+        for name, timing in current['methods'].items():
+            before = previous['methods'].get(name)
+            if before is None or before['median_ms'] <= 0:
+                continue
+            change = (timing['median_ms'] / before['median_ms'] - 1) * 100
+            if change > threshold:
+                regressions.append(
+                    f"{scale:>8} {name:44} {before['median_ms']:9.2f} -> {timing['median_ms']:9.2f} ms (+{change:.0f}%)"
+                )
+    return regressions
+
+
+async def run(args) -> int:
+    results = {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'machine': platform.node(),
+        'runs': args.runs,
+        'scales': {},
+    }
+    conn = await asyncpg.connect(args.dsn)
+    results['postgres'] = await conn.fetchval("SHOW server_version")
+    await conn.close()
+    try:
+        for scale in (int(value) for value in args.scales.split(',')):
+            results['scales'][str(scale)] = await run_scale(args.dsn, scale, args.runs, args.only)
+    finally:
+        if not args.keep:
+            conn = await asyncpg.connect(args.dsn)
+            await conn.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+            await conn.close()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"\nResults written to {args.output}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regressions over {args.threshold:.0f}% against {args.baseline}:")
+            print("\n".join(regressions))
+            return 1
+        print(f"\nNo regressions over {args.threshold:.0f}% against {args.baseline}")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dsn', required=True)
+    parser.add_argument('--scales', default=SCALES, help="comma-separated shift counts")
+    parser.add_argument('--runs', type=int, default=20, help="timed calls per method")
+    parser.add_argument('--only', action='append', help="time only methods containing this text (repeatable)")
+    parser.add_argument('--output', help="write results as JSON")
+    parser.add_argument('--baseline', help="earlier --output file to compare against")
+    parser.add_argument('--threshold', type=float, default=20, help="allowed median slowdown, percent")
+    parser.add_argument('--keep', action='store_true', help=f"keep the {SCHEMA} schema of the last scale")
+    sys.exit(asyncio.run(run(parser.parse_args())))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+"""End-to-end reply latency and send throughput against the fake Bot API.
+
+Usage:
+    python -m benchmarks.e2e_latency polling   --dsn postgresql://... [--users 20] [--requests 10] [--latency 40]
+    python -m benchmarks.e2e_latency webhook   --dsn postgresql://... [...]
+    python -m benchmarks.e2e_latency broadcast [--messages 1000] [--concurrency 50] [--send-limit 30]
+
+Starts benchmarks.fake_bot_api in-process and the bot from
+main.build_application talking to it over real HTTP. In polling and webhook
+mode every virtual user sends /start, waits for the bot's sendMessage and
+sends the next one; the time from the update being queued to the reply
+reaching the API is reported as percentiles. Webhook mode needs
+python-telegram-bot[webhooks]. Broadcast mode sends --messages messages to
+distinct chats as fast as --concurrency allows and reports throughput and
+how many hit flood control (429).
+"""
+import argparse
+import asyncio
+import logging
+import statistics
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+from telegram import Update
+from telegram.error import RetryAfter
+
+from benchmarks.fake_bot_api import FakeBotAPI
+from benchmarks.load_test import percentile
+from bot.database import Database
+from main import build_application
+
+USER_ID_BASE = 9_200_000_000
+WEBHOOK_PORT = 8444
+
+
+def start_update(user_id: int, message_id: int) -> Dict:
+    user = {'id': user_id, 'is_bot': False, 'first_name': f"E2E{user_id % 100000}"}
+    return {'message': {
+        'message_id': message_id, 'date': int(time.time()),
+        'chat': {'id': user_id, 'type': 'private'}, 'from': user,
+        'text': '/start', 'entities': [{'type': 'bot_command', 'offset': 0, 'length': 6}],
+    }}
+
+
+async def measure_replies(api: FakeBotAPI, users: int, requests: int) -> List[float]:
+    """Each user sends requests /start updates one after another; return reply latencies in ms"""
+    waiting: Dict[str, asyncio.Future] = {}
+
+    def on_call(record: Dict):
+        future = waiting.pop(str(record['chat_id']), None)
+        if future is not None and record['method'] == 'sendMessage' and not future.done():
+            future.set_result(record['at'])
+
+    api.on_call = on_call
+    latencies: List[float] = []
+
+    async def user(index: int):
+        user_id = USER_ID_BASE + index
+        for n in range(requests):
+            future = asyncio.get_running_loop().create_future()
+            waiting[str(user_id)] = future
+            pushed = api.push_update(start_update(user_id, n + 1))
+            replied_at = await asyncio.wait_for(future, 30)
+            latencies.append((replied_at - pushed['_pushed_at']) * 1000)
+
+    await asyncio.gather(*(user(i) for i in range(users)))
+    api.on_call = None
+    return latencies
+
+
+async def broadcast(application, messages: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    outcome = defaultdict(int)
+
+    async def send(n: int):
+        async with semaphore:
+            try:
+                await application.bot.send_message(chat_id=USER_ID_BASE + n, text=f"Рассылка #{n}")
+                outcome['sent'] += 1
+            except RetryAfter:
+                outcome['429'] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(send(n) for n in range(messages)))
+    return outcome, time.perf_counter() - started
+
+
+async def run(args):
+    api = FakeBotAPI(args.latency, args.jitter, args.flood_rate, args.send_limit)
+    port = await api.start('127.0.0.1', 0)
+    db = Database(db_url=args.dsn) if args.dsn else None
+    if db is not None:
+        await db.init_pool()
+    application = build_application(db, '0:e2e', [], api_url=f"http://127.0.0.1:{port}")
+    try:
+        await application.initialize()
+        if args.mode == 'broadcast':
+            outcome, elapsed = await broadcast(application, args.messages, args.concurrency)
+            print(f"broadcast of {args.messages} messages in {elapsed:.2f} s: "
+                  f"{outcome['sent'] / elapsed:.1f} sent/s, {outcome['sent']} sent, {outcome['429']} got 429")
+            return
+
+        await application.start()
+        if args.mode == 'webhook':
+            await application.updater.start_webhook(
+                listen='127.0.0.1', port=args.webhook_port, url_path='hook',
+                webhook_url=f"http://127.0.0.1:{args.webhook_port}/hook", allowed_updates=Update.ALL_TYPES
+            )
+        else:
+            await application.updater.start_polling(poll_interval=0, timeout=10, allowed_updates=Update.ALL_TYPES)
+        try:
+            started = time.perf_counter()
+            latencies = await measure_replies(api, args.users, args.requests)
+            elapsed = time.perf_counter() - started
+        finally:
+            await application.updater.stop()
+            await application.stop()
+        print(f"{args.mode}: {len(latencies)} replies in {elapsed:.2f} s ({len(latencies) / elapsed:.1f}/s), "
+              f"API latency {args.latency} ms")
+        print(f"  p50 {percentile(latencies, 50):.1f} ms  p95 {percentile(latencies, 95):.1f} ms  "
+              f"p99 {percentile(latencies, 99):.1f} ms  mean {statistics.mean(latencies):.1f} ms")
+    finally:
+        await application.shutdown()
+        await api.stop()
+        if db is not None:
+            for i in range(args.users):
+                await db.remove_user(USER_ID_BASE + i)
+            await db.close_pool()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('mode', choices=('polling', 'webhook', 'broadcast'))
+    parser.add_argument('--dsn', help="scratch database, required for polling and webhook")
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--requests', type=int, default=10, help="/start updates per user")
+    parser.add_argument('--messages', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=40, help="fake API latency, ms")
+    parser.add_argument('--jitter', type=float, default=10)
+    parser.add_argument('--flood-rate', type=float, default=0)
+    parser.add_argument('--send-limit', type=float, default=0, help="outgoing messages per second, 0 = no limit")
+    parser.add_argument('--webhook-port', type=int, default=WEBHOOK_PORT)
+    args = parser.parse_args()
+    if args.mode != 'broadcast' and not args.dsn:
+        parser.error("--dsn is required for polling and webhook modes")
+    logging.getLogger().setLevel(logging.WARNING)
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,369 @@
+"""Local stand-in for the Telegram Bot API, for offline end-to-end benchmarks.
+
+Usage:
+    python -m benchmarks.fake_bot_api [--port 8081] [--latency 40] [--jitter 10]
+                                      [--flood-rate 0.0] [--send-limit 30] [--record calls.jsonl]
+
+Point the bot at it with TELEGRAM_API_URL=http://127.0.0.1:8081 (see
+.env.example). Implemented methods: getMe, getUpdates (long polling),
+setWebhook, deleteWebhook, getWebhookInfo, sendMessage, editMessageText,
+editMessageReplyMarkup, answerCallbackQuery, getChat, sendDocument and
+deleteMessage; anything else answers 404 like the real API.
+
+Every call waits --latency ms (+- --jitter) before answering. Outgoing
+messages (send*/edit*) are limited to --send-limit per second overall
+(Telegram allows about 30) and optionally --chat-limit per chat, answering
+429 with retry_after when over; --flood-rate additionally fails that share
+of them with 429 at random. All calls are recorded, and written to --record
+as JSON lines on exit.
+
+Updates are fed in through control endpoints, then delivered by getUpdates
+or POSTed to the webhook when one is set:
+
+    POST /control/updates   JSON update or list of updates (update_id optional)
+    GET  /control/calls     recorded calls as JSON
+    POST /control/reset     clear recorded calls and pending updates
+
+Only the standard library (plus httpx, already required by
+python-telegram-bot, for webhook delivery) is used.
+"""
+import argparse
+import asyncio
+import email.parser
+import email.policy
+import itertools
+import json
+import logging
+import random
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'Fake API', 'username': 'fake_api_bot',
+            'can_join_groups': False, 'can_read_all_group_messages': False, 'supports_inline_queries': False}
+# Methods that count as outgoing messages for flood control
+SEND_METHODS = ('sendMessage', 'editMessageText', 'editMessageReplyMarkup', 'sendDocument')
+MAX_BODY = 50 * 1024 * 1024
+
+
+class FloodControl:
+    """Token buckets: one for all outgoing messages, one per chat"""
+
+    def __init__(self, global_rate: float, chat_rate: float = 0.0):
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self._buckets: Dict[object, Tuple[float, float]] = {}
+
+    def _take(self, key, rate: float, now: float) -> float:
+        """Take one token, return 0 or the seconds until one is available"""
+        tokens, updated = self._buckets.get(key, (rate, now))
+        tokens = min(rate, tokens + (now - updated) * rate)
+        if tokens < 1:
+            self._buckets[key] = (tokens, now)
+            return (1 - tokens) / rate
+        self._buckets[key] = (tokens - 1, now)
+        return 0.0
+
+    def retry_after(self, chat_id) -> float:
+        now = time.monotonic()
+        if self.global_rate > 0:
+            wait = self._take(None, self.global_rate, now)
+            if wait:
+                return wait
+        if self.chat_rate > 0 and chat_id is not None:
+            return self._take(('chat', str(chat_id)), self.chat_rate, now)
+        return 0.0
+
+
+class FakeBotAPI:
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, flood_rate: float = 0.0,
+                 send_limit: float = 30.0, chat_limit: float = 0.0, seed: Optional[int] = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.flood_rate = flood_rate
+        self.flood = FloodControl(send_limit, chat_limit)
+        self.rng = random.Random(seed)
+        self.calls: List[Dict] = []
+        self.pending: Deque[Dict] = deque()
+        self.webhook: Optional[Dict] = None
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._new_updates = asyncio.Event()
+        self._webhook_client: Optional[httpx.AsyncClient] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        # Called with every recorded call, e.g. to wait for a reply in a benchmark
+        self.on_call: Optional[Callable[[Dict], None]] = None
+
+    # ---- update feed ----
+
+    def push_update(self, update: Dict) -> Dict:
+        update = {'update_id': next(self._update_ids), **update}
+        update['_pushed_at'] = time.time()
+        if self.webhook:
+            asyncio.ensure_future(self._deliver(update))
+        else:
+            self.pending.append(update)
+            self._new_updates.set()
+        return update
+
+    async def _deliver(self, update: Dict):
+        headers = {}
+        if self.webhook.get('secret_token'):
+            headers['X-Telegram-Bot-Api-Secret-Token'] = self.webhook['secret_token']
+        body = {k: v for k, v in update.items() if not k.startswith('_')}
+        try:
+            await self._webhook_client.post(self.webhook['url'], json=body, headers=headers)
+        except httpx.HTTPError as e:
+            logger.warning(f"Webhook delivery of update {update['update_id']} failed: {e}")
+
+    async def _get_updates(self, params: Dict) -> List[Dict]:
+        offset = int(params.get('offset') or 0)
+        limit = int(params.get('limit') or 100)
+        timeout = float(params.get('timeout') or 0)
+        # Confirm (drop) everything before offset, as the real API does
+        while self.pending and self.pending[0]['update_id'] < offset:
+            self.pending.popleft()
+        if not self.pending and timeout > 0:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return [
+            {k: v for k, v in update.items() if not k.startswith('_')}
+            for update in itertools.islice(self.pending, limit)
+        ]
+
+    # ---- Bot API methods ----
+
+    def _message(self, params: Dict, text_key: str = 'text') -> Dict:
+        chat_id = params.get('chat_id')
+        return {
+            'message_id': int(params.get('message_id') or next(self._message_ids)),
+            'date': int(time.time()),
+            'chat': {'id': int(chat_id) if str(chat_id).lstrip('-').isdigit() else chat_id, 'type': 'private'},
+            'from': BOT_USER,
+            'text': params.get(text_key) or '',
+        }
+
+    async def call(self, method: str, params: Dict) -> Tuple[int, Dict]:
+        """Handle one Bot API method call, return (HTTP status, JSON body)"""
+        delay = self.latency + (self.rng.uniform(-self.jitter, self.jitter) if self.jitter else 0)
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+
+        if method in SEND_METHODS:
+            retry_after = self.flood.retry_after(params.get('chat_id'))
+            if not retry_after and self.flood_rate and self.rng.random() < self.flood_rate:
+                retry_after = 1
+            if retry_after:
+                seconds = max(1, round(retry_after))
+                return 429, {'ok': False, 'error_code': 429,
+                             'description': f"Too Many Requests: retry after {seconds}",
+                             'parameters': {'retry_after': seconds}}
+
+        if method == 'getMe':
+            result = BOT_USER
+        elif method == 'getUpdates':
+            if self.webhook:
+                return 409, {'ok': False, 'error_code': 409,
+                             'description': "Conflict: can't use getUpdates method while webhook is active"}
+            result = await self._get_updates(params)
+        elif method == 'setWebhook':
+            self.webhook = {'url': params['url'], 'secret_token': params.get('secret_token')}
+            if self._webhook_client is None:
+                self._webhook_client = httpx.AsyncClient(timeout=10)
+            # Updates queued for polling go to the new webhook
+            while self.pending:
+                asyncio.ensure_future(self._deliver(self.pending.popleft()))
+            result = True
+        elif method == 'deleteWebhook':
+            self.webhook = None
+            result = True
+        elif method == 'getWebhookInfo':
+            result = {'url': self.webhook['url'] if self.webhook else '', 'has_custom_certificate': False,
+                      'pending_update_count': len(self.pending)}
+        elif method in ('sendMessage', 'editMessageText'):
+            result = self._message(params)
+        elif method == 'editMessageReplyMarkup':
+            result = self._message(params)
+        elif method == 'sendDocument':
+            result = self._message(params, text_key='caption')
+            result['document'] = {'file_id': f"doc{result['message_id']}", 'file_unique_id': f"u{result['message_id']}",
+                                  'file_name': params.get('_filename') or 'document'}
+        elif method == 'getChat':
+            chat_id = params.get('chat_id')
+            result = {'id': int(chat_id), 'type': 'private', 'first_name': f"User {chat_id}"}
+        elif method in ('answerCallbackQuery', 'deleteMessage', 'setMyCommands'):
+            result = True
+        else:
+            return 404, {'ok': False, 'error_code': 404, 'description': "Not Found: method not found"}
+        return 200, {'ok': True, 'result': result}
+
+    # ---- HTTP ----
+
+    @staticmethod
+    def _parse_body(content_type: str, body: bytes) -> Dict:
+        if not body:
+            return {}
+        if content_type.startswith('application/json'):
+            return json.loads(body)
+        if content_type.startswith('multipart/form-data'):
+            message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+                f"Content-Type: {content_type}\r\n\r\n".encode() + body
+            )
+            params = {}
+            for part in message.iter_parts():
+                name = part.get_param('name', header='content-disposition')
+                if part.get_filename():
+                    params['_filename'] = part.get_filename()
+                    params[name] = f"<{len(part.get_payload(decode=True) or b'')} bytes>"
+                else:
+                    params[name] = part.get_content().strip() if part.get_content_maintype() == 'text' \
+                        else (part.get_payload(decode=True) or b'').decode()
+            return params
+        return dict(parse_qsl(body.decode()))
+
+    async def _read_request(self, reader: asyncio.StreamReader):
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        method, target, _ = request_line.decode('latin-1').split(' ', 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            body = b''
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    await reader.readline()
+                    break
+                body += await reader.readexactly(size)
+                await reader.readline()
+        else:
+            length = int(headers.get('content-length') or 0)
+            if length > MAX_BODY:
+                raise ValueError("Request body too large")
+            body = await reader.readexactly(length) if length else b''
+        return method, target, headers, body
+
+    async def _route(self, http_method: str, target: str, headers: Dict, body: bytes) -> Tuple[int, Dict]:
+        url = urlsplit(target)
+        path = url.path
+        if path == '/control/updates' and http_method == 'POST':
+            updates = json.loads(body)
+            pushed = [self.push_update(update) for update in (updates if isinstance(updates, list) else [updates])]
+            return 200, {'ok': True, 'result': [update['update_id'] for update in pushed]}
+        if path == '/control/calls':
+            return 200, {'ok': True, 'result': self.calls}
+        if path == '/control/reset' and http_method == 'POST':
+            self.calls.clear()
+            self.pending.clear()
+            return 200, {'ok': True, 'result': True}
+
+        params = dict(parse_qsl(url.query))
+        params.update(self._parse_body(headers.get('content-type', ''), body))
+        parts = path.strip('/').split('/')
+        if len(parts) != 2 or not parts[0].startswith('bot'):
+            return 404, {'ok': False, 'error_code': 404, 'description': "Not Found"}
+        started = time.time()
+        status, response = await self.call(parts[1], params)
+        record = {
+            'at': started, 'method': parts[1], 'status': status,
+            'ms': round((time.time() - started) * 1000, 3),
+            'chat_id': params.get('chat_id'), 'params': {k: v for k, v in params.items() if k != '_filename'},
+        }
+        self.calls.append(record)
+        if self.on_call is not None:
+            self.on_call(record)
+        return status, response
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                http_method, target, headers, body = request
+                try:
+                    status, response = await self._route(http_method, target, headers, body)
+                except (ValueError, KeyError) as e:
+                    status, response = 400, {'ok': False, 'error_code': 400, 'description': f"Bad Request: {e}"}
+                payload = json.dumps(response, ensure_ascii=False).encode()
+                writer.write(
+                    f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                    f"Content-Type: application/json\r\nContent-Length: {len(payload)}\r\n"
+                    f"Connection: keep-alive\r\n\r\n".encode() + payload
+                )
+                await writer.drain()
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except asyncio.CancelledError:
+            # Shutdown while a getUpdates long poll is still waiting
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host: str = '127.0.0.1', port: int = 8081):
+        self._server = await asyncio.start_server(self._handle_connection, host, port)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        if self._webhook_client is not None:
+            await self._webhook_client.aclose()
+            self._webhook_client = None
+
+    def write_calls(self, path: str):
+        with open(path, 'w') as f:
+            for call in self.calls:
+                f.write(json.dumps(call, ensure_ascii=False) + '\n')
+
+
+async def serve(args):
+    api = FakeBotAPI(args.latency, args.jitter, args.flood_rate, args.send_limit, args.chat_limit, args.seed)
+    port = await api.start(args.host, args.port)
+    print(f"Fake Bot API on http://{args.host}:{port} (TELEGRAM_API_URL=http://{args.host}:{port})")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await api.stop()
+        if args.record:
+            api.write_calls(args.record)
+            print(f"{len(api.calls)} calls written to {args.record}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0, help="ms added to every call")
+    parser.add_argument('--jitter', type=float, default=0, help="random +- ms on top of --latency")
+    parser.add_argument('--flood-rate', type=float, default=0, help="share of outgoing messages failed with 429")
+    parser.add_argument('--send-limit', type=float, default=30, help="outgoing messages per second, 0 = no limit")
+    parser.add_argument('--chat-limit', type=float, default=0, help="outgoing messages per second per chat, 0 = no limit")
+    parser.add_argument('--record', help="write recorded calls to this JSON lines file on exit")
+    parser.add_argument('--seed', type=int)
+    try:
+        asyncio.run(serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,268 @@
+"""Load test: synthetic Telegram updates through the real Application and BotHandlers.
+
+Usage:
+    python -m benchmarks.load_test --dsn postgresql://... [--concurrency 1,5,20,50] [--duration 20]
+
+Builds the bot with main.build_application against the given database and
+replaces the Bot API with an in-process stub, so every handler, conversation
+state and query runs for real while nothing is sent to Telegram. Each
+virtual user (an employee, or an admin for the report flow) repeatedly plays
+one of the flows below, one update at a time, and the time from the first
+update to the end of the last one is recorded.
+
+    start       /start
+    booking     "3. Доступные слоты" -> date -> slot
+    free_time   "4. Указать свободное время" -> add -> date -> "10:00 14:00"
+    salary      "1. Моя зарплата" -> this month
+    report      "3. Отчет" -> everyone -> this month -> rate
+
+Seeds its own users and slots (ids from 9000000000 up) into the database
+and removes them afterwards; use a scratch database, not production.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import random
+import statistics
+import time
+from collections import Counter, defaultdict
+from datetime import date, time as dtime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from telegram import Update
+from telegram.request import BaseRequest, RequestData
+
+from bot.database import Database
+from main import build_application
+
+USER_ID_BASE = 9_000_000_000
+ADMIN_ID_BASE = 9_100_000_000
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'Load test', 'username': 'load_test_bot'}
+SLOT_DAYS = 14
+SLOT_HOURS = range(8, 20)
+FLOWS = ('start', 'booking', 'free_time', 'salary', 'report')
+# Share of each flow in the mix
+FLOW_WEIGHTS = (2, 3, 3, 2, 1)
+
+
+class StubBotAPI(BaseRequest):
+    """Answers Bot API calls in-process with minimal valid payloads.
+
+    latency (seconds) is added to every call to imitate the network round
+    trip to api.telegram.org.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls: Counter = Counter()
+        self._message_ids = itertools.count(1_000_000)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def _message(self, params: Dict) -> Dict:
+        chat_id = params.get('chat_id', 0)
+        return {
+            'message_id': params.get('message_id') or next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': BOT_USER,
+            'text': params.get('text') or params.get('caption') or '',
+        }
+
+    async def do_request(self, url: str, method: str, request_data: Optional[RequestData] = None,
+                         read_timeout=None, write_timeout=None, connect_timeout=None,
+                         pool_timeout=None) -> Tuple[int, bytes]:
+        endpoint = url.rsplit('/', 1)[-1]
+        self.calls[endpoint] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        params = request_data.parameters if request_data else {}
+        if endpoint == 'getMe':
+            result = {**BOT_USER, 'can_join_groups': False, 'can_read_all_group_messages': False,
+                      'supports_inline_queries': False}
+        elif endpoint.startswith(('send', 'edit')):
+            result = self._message(params)
+        else:
+            result = True
+        return 200, json.dumps({'ok': True, 'result': result}).encode()
+
+
+class VirtualUser:
+    """One Telegram user playing flows through application.process_update"""
+
+    update_ids = itertools.count(1)
+
+    def __init__(self, application, user_id: int, slot_ids: List[int], rng: random.Random):
+        self.application = application
+        self.user = {'id': user_id, 'is_bot': False, 'first_name': f"Load{user_id % 100000}"}
+        self.chat = {'id': user_id, 'type': 'private'}
+        self.slot_ids = slot_ids
+        self.rng = rng
+        self.bookings = 0
+        self.message_ids = itertools.count(1)
+
+    async def _send(self, payload: Dict):
+        update = Update.de_json({'update_id': next(self.update_ids), **payload}, self.application.bot)
+        await self.application.process_update(update)
+
+    async def text(self, text: str):
+        message = {
+            'message_id': next(self.message_ids), 'date': int(time.time()),
+            'chat': self.chat, 'from': self.user, 'text': text,
+        }
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        await self._send({'message': message})
+
+    async def tap(self, data: str):
+        message = {
+            'message_id': next(self.message_ids), 'date': int(time.time()),
+            'chat': self.chat, 'from': BOT_USER, 'text': '...',
+        }
+        await self._send({'callback_query': {
+            'id': str(next(self.update_ids)), 'from': self.user, 'chat_instance': str(self.user['id']),
+            'message': message, 'data': data,
+        }})
+
+    async def run(self, flow: str):
+        today = date.today()
+        month_start = today.replace(day=1)
+        month_end = (month_start + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+        if flow == 'start':
+            await self.text('/start')
+        elif flow == 'booking':
+            # Slots are walked in order so each booking is normally a new one
+            slot_index = self.bookings % len(self.slot_ids)
+            self.bookings += 1
+            day = today + timedelta(days=1 + slot_index // len(SLOT_HOURS))
+            await self.text('3. Доступные слоты')
+            await self.tap(f"date_{day}")
+            await self.tap(f"slot_{self.slot_ids[slot_index]}")
+        elif flow == 'free_time':
+            day = today + timedelta(days=self.rng.randrange(1, SLOT_DAYS))
+            start = self.rng.randrange(8, 18)
+            await self.text('4. Указать свободное время')
+            await self.tap('add_free_time')
+            await self.tap(f"date_{day}")
+            await self.text(f"{start:02d}:00 {start + 4:02d}:00")
+        elif flow == 'salary':
+            await self.text('1. Моя зарплата')
+            await self.tap(f"period_{month_start}_{month_end}")
+        elif flow == 'report':
+            await self.text('3. Отчет')
+            await self.tap('emp_all')
+            await self.tap(f"period_{month_start}_{month_end}")
+            await self.text('500')
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def seed(db: Database, users: int, admins: int) -> Dict[int, date]:
+    """Seed users and admins, return the slots created as {id: date}"""
+    for i in range(users):
+        await db.add_user(USER_ID_BASE + i, f"load{i}", f"Нагрузка {i}")
+    for i in range(admins):
+        await db.add_user(ADMIN_ID_BASE + i, f"load_admin{i}", f"Админ {i}", is_admin=True)
+    slots = {}
+    for day_offset in range(1, SLOT_DAYS + 1):
+        day = date.today() + timedelta(days=day_offset)
+        for hour in SLOT_HOURS:
+            slot_id = await db.add_schedule_slot(
+                day, dtime(hour), dtime(hour + 1), address="Нагрузочный тест", required_employees=users
+            )
+            slots[slot_id] = day
+    return slots
+
+
+async def cleanup(db: Database, users: int, admins: int, slots: Dict[int, date]):
+    for slot_id, slot_date in slots.items():
+        await db.delete_schedule_slot(slot_id, slot_date)
+    for i in range(users):
+        await db.remove_user(USER_ID_BASE + i)
+    for i in range(admins):
+        # remove_user refuses admins
+        await db.set_admin_status(ADMIN_ID_BASE + i, False)
+        await db.remove_user(ADMIN_ID_BASE + i)
+
+
+async def run_level(application, concurrency: int, duration: float, slot_ids: List[int], seed_value: int):
+    """Run concurrency virtual users for duration seconds, return ({flow: [latency]}, errors)"""
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    errors: Counter = Counter()
+    deadline = time.perf_counter() + duration
+
+    async def worker(index: int):
+        rng = random.Random(seed_value * 1000 + index)
+        employee = VirtualUser(application, USER_ID_BASE + index, slot_ids, rng)
+        admin = VirtualUser(application, ADMIN_ID_BASE + index, slot_ids, rng)
+        while time.perf_counter() < deadline:
+            flow = rng.choices(FLOWS, weights=FLOW_WEIGHTS)[0]
+            started = time.perf_counter()
+            try:
+                await (admin if flow == 'report' else employee).run(flow)
+            except Exception as e:
+                errors[f"{flow}: {type(e).__name__}"] += 1
+                continue
+            latencies[flow].append((time.perf_counter() - started) * 1000)
+
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    return latencies, errors
+
+
+async def run(args):
+    levels = [int(level) for level in args.concurrency.split(',')]
+    users = max(levels)
+    db = Database(db_url=args.dsn)
+    await db.init_pool()
+    stub = StubBotAPI(latency=args.api_latency / 1000)
+    admin_ids = [ADMIN_ID_BASE + i for i in range(users)]
+    application = build_application(db, '0:load-test', admin_ids, request=stub)
+    slots = await seed(db, users, users)
+    slot_ids = list(slots)
+    try:
+        await application.initialize()
+        print(f"{len(slot_ids)} slots, {users} employees/admins, Bot API latency {args.api_latency} ms")
+        for level in levels:
+            latencies, errors = await run_level(application, level, args.duration, slot_ids, args.seed)
+            completed = sum(len(values) for values in latencies.values())
+            print(f"\nconcurrency {level}: {completed / args.duration:8.1f} flows/s")
+            print(f"  {'flow':10} {'count':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'mean ms':>9}")
+            for flow in FLOWS:
+                values = latencies.get(flow)
+                if values:
+                    print(f"  {flow:10} {len(values):7d} {percentile(values, 50):9.1f} {percentile(values, 95):9.1f} "
+                          f"{percentile(values, 99):9.1f} {statistics.mean(values):9.1f}")
+            for error, count in errors.most_common():
+                print(f"  error {error}: {count}")
+        print(f"\nBot API calls: {dict(stub.calls.most_common())}")
+    finally:
+        await application.shutdown()
+        await cleanup(db, users, users, slots)
+        await db.close_pool()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dsn', required=True)
+    parser.add_argument('--concurrency', default='1,5,20,50', help="comma-separated virtual user counts")
+    parser.add_argument('--duration', type=float, default=20, help="seconds per concurrency level")
+    parser.add_argument('--api-latency', type=float, default=0, help="simulated Bot API round trip, ms")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    # Handler logging would dominate the measurement
+    logging.getLogger().setLevel(logging.WARNING)
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+"""Range queries on plain vs monthly partitioned slot/shift tables.
+
+Usage:
+    python -m benchmarks.partition_pruning --dsn postgresql://... [--years 5] [--slots-per-day 40] [--runs 20]
+
+Builds the same multi-year data set twice in throwaway schemas: once as plain
+tables with a date index, once partitioned by month the way init_db creates
+schedule_slots and shifts. Then times the date range queries behind
+get_schedule_slots_by_range and get_employee_shifts for a week and a month,
+and prints how many partitions the plan touched. The schemas are dropped at
+the end.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from datetime import date, timedelta
+
+import asyncpg
+
+SCHEMAS = ('bench_heap', 'bench_partitioned')
+
+HEAP_DDL = """
+    CREATE TABLE schedule_slots (
+        id INTEGER PRIMARY KEY, date DATE NOT NULL, start_time TIME NOT NULL, end_time TIME NOT NULL,
+        address TEXT, required_employees INTEGER, is_open BOOLEAN
+    );
+    CREATE TABLE shifts (
+        id INTEGER PRIMARY KEY, slot_id INTEGER REFERENCES schedule_slots (id) ON DELETE CASCADE,
+        employee_id BIGINT, date DATE NOT NULL, start_time TIME NOT NULL, end_time TIME NOT NULL
+    );
+    CREATE INDEX ON schedule_slots (date);
+    CREATE INDEX ON shifts (employee_id, date);
+    CREATE INDEX ON shifts (slot_id, date);
+"""
+
+PARTITIONED_DDL = """
+    CREATE TABLE schedule_slots (
+        id INTEGER NOT NULL, date DATE NOT NULL, start_time TIME NOT NULL, end_time TIME NOT NULL,
+        address TEXT, required_employees INTEGER, is_open BOOLEAN,
+        PRIMARY KEY (id, date)
+    ) PARTITION BY RANGE (date);
+    CREATE TABLE shifts (
+        id INTEGER NOT NULL, slot_id INTEGER, employee_id BIGINT, date DATE NOT NULL,
+        start_time TIME NOT NULL, end_time TIME NOT NULL,
+        PRIMARY KEY (id, date),
+        FOREIGN KEY (slot_id, date) REFERENCES schedule_slots (id, date) ON DELETE CASCADE
+    ) PARTITION BY RANGE (date);
+    CREATE INDEX ON schedule_slots (date);
+    CREATE INDEX ON shifts (employee_id, date);
+    CREATE INDEX ON shifts (slot_id, date);
+"""
+
+QUERIES = {
+    'slots by range': """
+        SELECT s.*, sh.employee_id
+        FROM schedule_slots s
+        LEFT JOIN shifts sh ON sh.slot_id = s.id AND sh.date = s.date
+        WHERE s.date BETWEEN $1 AND $2
+        ORDER BY s.date, s.start_time
+    """,
+    'employee shifts': """
+        SELECT * FROM shifts
+        WHERE employee_id = 7 AND date BETWEEN $1 AND $2
+        ORDER BY date, start_time
+    """,
+}
+
+
+async def build(conn: asyncpg.Connection, schema: str, first: date, last: date, slots_per_day: int):
+    await conn.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+    await conn.execute(f"CREATE SCHEMA {schema}")
+    await conn.execute(f"SET search_path = {schema}")
+    await conn.execute(HEAP_DDL if schema == 'bench_heap' else PARTITIONED_DDL)
+    if schema == 'bench_partitioned':
+        month = first.replace(day=1)
+        while month <= last:
+            following = (month + timedelta(days=32)).replace(day=1)
+            suffix = f"p{month.year:04d}_{month.month:02d}"
+            for table in ('schedule_slots', 'shifts'):
+                await conn.execute(
+                    f"CREATE TABLE {table}_{suffix} PARTITION OF {table} "
+                    f"FOR VALUES FROM ('{month}') TO ('{following}')"
+                )
+            month = following
+
+    await conn.execute("""
+        INSERT INTO schedule_slots (id, date, start_time, end_time, address, required_employees, is_open)
+        SELECT g, $1::date + (g / $3), TIME '08:00' + (g % 12) * INTERVAL '1 hour',
+               TIME '12:00' + (g % 10) * INTERVAL '1 hour', 'ул. Тестовая, д. ' || (g % 50), 2, g % 3 = 0
+        FROM generate_series(0, ($2::date - $1::date + 1) * $3 - 1) AS g
+    """, first, last, slots_per_day)
+    await conn.execute("""
+        INSERT INTO shifts (id, slot_id, employee_id, date, start_time, end_time)
+        SELECT id, id, id % 200, date, start_time, end_time FROM schedule_slots WHERE NOT is_open
+    """)
+    await conn.execute("ANALYZE schedule_slots")
+    await conn.execute("ANALYZE shifts")
+
+
+async def measure(conn: asyncpg.Connection, schema: str, query: str, start: date, end: date, runs: int):
+    await conn.execute(f"SET search_path = {schema}")
+    plan = await conn.fetchval(f"EXPLAIN (FORMAT JSON) {query}", start, end)
+    await conn.fetch(query, start, end)  # warm up
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        await conn.fetch(query, start, end)
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings), plan.count('"Relation Name"')
+
+
+async def run(args):
+    conn = await asyncpg.connect(args.dsn)
+    try:
+        last = date.today().replace(month=12, day=31)
+        first = date(last.year - args.years + 1, 1, 1)
+        for schema in SCHEMAS:
+            started = time.perf_counter()
+            await build(conn, schema, first, last, args.slots_per_day)
+            print(f"{schema:18} built in {time.perf_counter() - started:6.1f} s")
+
+        month = date(last.year, 6, 1)
+        windows = {
+            'week': (month, month + timedelta(days=6)),
+            'month': (month, (month + timedelta(days=32)).replace(day=1) - timedelta(days=1)),
+        }
+        print(f"{(last - first).days + 1} days x {args.slots_per_day} slots, median of {args.runs} runs")
+        for name, query in QUERIES.items():
+            for window, (start, end) in windows.items():
+                results = [await measure(conn, schema, query, start, end, args.runs) for schema in SCHEMAS]
+                print(f"{name:16} {window:6} " + "  ".join(
+                    f"{schema}: {ms:8.2f} ms ({relations} rel)" for schema, (ms, relations) in zip(SCHEMAS, results)
+                ))
+    finally:
+        for schema in SCHEMAS:
+            await conn.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+        await conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dsn', required=True)
+    parser.add_argument('--years', type=int, default=5)
+    parser.add_argument('--slots-per-day', type=int, default=40)
+    parser.add_argument('--runs', type=int, default=20)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
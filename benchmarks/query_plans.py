@@ -0,0 +1,279 @@
+"""Query-plan regression check for the SQL in bot/database.py.
+
+Usage:
+    python -m benchmarks.query_plans --dsn postgresql://... [--shifts 1000000] [--verbose]
+
+Creates the schema with Database.init_db in a throwaway query_plans schema,
+seeds it like benchmarks.db_bench at the given scale, and calls every
+Database method of db_bench with a query logger on the pool, so each SQL
+statement the methods run is captured with its real arguments. Every
+captured statement then goes through EXPLAIN (FORMAT JSON).
+
+Statements of the hot methods (open slots, employee shifts, overlap checks
+against shifts and free time) must not:
+
+    - read schedule_slots, shifts or free_time_slots (or their partitions)
+      with a Seq Scan
+    - run a Nested Loop whose inner side is not an index lookup
+
+Partitions that are empty after seeding (months ahead of the data) are
+exempt: the planner reads an empty table whole, whatever the indexes.
+
+Statements of the methods in PRUNED_METHODS address slots and shifts by
+date and must read at most MAX_PARTITIONS monthly partitions of each table;
+a lookup by id alone probes every month.
+
+and the methods in EXPECTED_INDEXES must use one of the named indexes (or
+their partition indexes). Violations are listed and the exit status is 1.
+--verbose prints the scans of every statement, hot or not.
+"""
+import argparse
+import asyncio
+import json
+import sys
+from collections import defaultdict
+from datetime import date
+from typing import Dict, Iterator, List, Set, Tuple
+
+import asyncpg
+
+from benchmarks.db_bench import build_cases, first_day, layout, seed, with_search_path
+from bot.database import Database
+
+SCHEMA = 'query_plans'
+LARGE_TABLES = ('schedule_slots', 'shifts', 'free_time_slots')
+HOT_METHODS = (
+    'get_schedule_slots_by_range[open]',
+    'get_schedule_slots_by_range[open, exclude]',
+    'get_schedule_slots_by_range[employee]',
+    'get_schedule_slots_by_date',
+    'get_employee_shifts',
+    'get_slot_assigned_count',
+    'assign_shift',
+    'assign_shifts_bulk',
+    'remove_overlapping_free_time',
+    'get_employees_with_free_time',
+    'get_day_availability',
+)
+PARTITIONED_TABLES = ('schedule_slots', 'shifts')
+PRUNED_METHODS = (
+    'get_slot_by_id',
+    'get_slot_assigned_count',
+    'get_available_employees_for_slot',
+    'delete_schedule_slot',
+    'update_slot_open_status',
+    'assign_shift',
+    'assign_shifts_bulk',
+)
+# Overlap checks look a day either side of a slot, into the next or previous month
+MAX_PARTITIONS = 2
+# LIKE patterns of index names
+EXPECTED_INDEXES = {
+    'get_schedule_slots_by_range[open]': ('schedule_slots_date_idx',),
+    'get_schedule_slots_by_date': ('schedule_slots_date_idx',),
+    # The overlap constraint's gist index leads with employee_id too; for a
+    # whole-month range the planner rightly finds it as cheap as the btree
+    'get_employee_shifts': ('shifts_employee_date_idx', 'shifts%_no_overlap'),
+    'get_slot_assigned_count': ('shifts_slot_id_idx',),
+}
+INDEX_SCANS = ('Index Scan', 'Index Only Scan', 'Bitmap Heap Scan', 'Bitmap Index Scan')
+# Nodes that pass their child's rows through unchanged
+PASS_THROUGH = ('Memoize', 'Materialize', 'Append', 'Result', 'Sort', 'Limit')
+# Rows produced by the statement itself (parameter arrays, CTEs over them), not read from a table
+IN_QUERY_SCANS = ('Function Scan', 'Values Scan', 'CTE Scan')
+EXPLAINABLE = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH')
+
+
+def walk(node: Dict) -> Iterator[Dict]:
+    yield node
+    for child in node.get('Plans', ()):
+        yield from walk(child)
+
+
+def is_large(relation: str, empty: Set[str] = frozenset()) -> bool:
+    if relation in empty:
+        return False
+    return any(relation == table or relation.startswith(f"{table}_p") for table in LARGE_TABLES)
+
+
+def index_driven(node: Dict, empty: Set[str] = frozenset()) -> bool:
+    if node['Node Type'] in INDEX_SCANS or node['Node Type'] in IN_QUERY_SCANS:
+        return True
+    if node['Node Type'] in PASS_THROUGH and node.get('Plans'):
+        return all(index_driven(child, empty) for child in node['Plans'])
+    # Small tables (users) and empty partitions may be read whole
+    return node['Node Type'] == 'Seq Scan' and not is_large(node.get('Relation Name', ''), empty)
+
+
+def violations(plan: Dict, empty: Set[str] = frozenset()) -> List[str]:
+    """Problems in a plan; empty holds relations known to have no rows"""
+    found = []
+    for node in walk(plan):
+        relation = node.get('Relation Name', '')
+        if node['Node Type'] == 'Seq Scan' and is_large(relation, empty):
+            found.append(f"Seq Scan on {relation}")
+        if node['Node Type'] == 'Nested Loop':
+            inner = next((child for child in node['Plans'] if child.get('Parent Relationship') == 'Inner'), None)
+            if inner is not None and not index_driven(inner, empty):
+                found.append(f"Nested Loop over {inner['Node Type']} {inner.get('Relation Name', '')}".rstrip())
+    return found
+
+
+def partitions_read(plan: Dict) -> Dict[str, Set[str]]:
+    """Monthly partitions each partitioned table is read from, after plan-time pruning"""
+    read = defaultdict(set)
+    for node in walk(plan):
+        relation = node.get('Relation Name', '')
+        for table in PARTITIONED_TABLES:
+            if relation.startswith(f"{table}_p"):
+                read[table].add(relation)
+    return read
+
+
+def unpruned(plan: Dict) -> List[str]:
+    return [
+        f"{table} read from {len(partitions)} partitions"
+        for table, partitions in sorted(partitions_read(plan).items()) if len(partitions) > MAX_PARTITIONS
+    ]
+
+
+def scans(plan: Dict) -> List[str]:
+    return sorted({
+        f"{node['Node Type']} {node.get('Index Name') or node['Relation Name']}"
+        for node in walk(plan) if 'Relation Name' in node
+    })
+
+
+async def empty_relations(conn: asyncpg.Connection) -> Set[str]:
+    """Tables of the current schema that ANALYZE found empty"""
+    rows = await conn.fetch("""
+        SELECT relname FROM pg_class
+        WHERE relkind = 'r' AND reltuples = 0 AND relnamespace = current_schema()::regnamespace
+    """)
+    return {row['relname'] for row in rows}
+
+
+async def index_family(conn: asyncpg.Connection, patterns: Tuple[str, ...]) -> Set[str]:
+    """Indexes of the current schema matching the patterns and the partition indexes attached to them"""
+    rows = await conn.fetch("""
+        WITH matched AS (
+            SELECT oid, relname FROM pg_class
+            WHERE relkind IN ('i', 'I') AND relnamespace = current_schema()::regnamespace
+            AND relname LIKE ANY($1::text[])
+        )
+        SELECT relname FROM matched
+        UNION
+        SELECT c.relname FROM matched m JOIN pg_inherits i ON i.inhparent = m.oid JOIN pg_class c ON c.oid = i.inhrelid
+    """, list(patterns))
+    return {row['relname'] for row in rows}
+
+
+class Recorder:
+    """Query logger collecting {sql: {'args': ..., 'methods': {...}}} while a method is set"""
+
+    def __init__(self):
+        self.method = None
+        self.statements: Dict[str, Dict] = {}
+
+    def __call__(self, record):
+        if self.method is None or record.exception is not None:
+            return
+        entry = self.statements.setdefault(record.query, {'args': record.args, 'methods': set()})
+        entry['methods'].add(self.method)
+
+    async def run_cases(self, cases: Dict):
+        for name, case in cases.items():
+            args = await case.setup() if case.setup else ()
+            self.method = name
+            try:
+                result = await case.call(*args)
+            finally:
+                self.method = None
+            if case.teardown:
+                await case.teardown(result, *args)
+
+
+async def explain(conn: asyncpg.Connection, statements: Dict[str, Dict], verbose: bool) -> List[str]:
+    """EXPLAIN every statement, print the problem ones (all with verbose), return the failures"""
+    expected = {method: await index_family(conn, patterns) for method, patterns in EXPECTED_INDEXES.items()}
+    empty = await empty_relations(conn)
+    used_indexes = defaultdict(set)
+    failures = []
+    explained = 0
+    for sql, entry in statements.items():
+        if not sql.lstrip().upper().startswith(EXPLAINABLE):
+            continue
+        try:
+            result = await conn.fetchval(f"EXPLAIN (FORMAT JSON) {sql}", *entry['args'])
+        except asyncpg.PostgresError:
+            # Multi-statement or utility commands
+            continue
+        plan = json.loads(result)[0]['Plan']
+        explained += 1
+        methods = sorted(entry['methods'])
+        for method in methods:
+            used_indexes[method].update(node['Index Name'] for node in walk(plan) if 'Index Name' in node)
+        problems = violations(plan, empty) if any(method in HOT_METHODS for method in methods) else []
+        if any(method in PRUNED_METHODS for method in methods):
+            problems += unpruned(plan)
+        if verbose or problems:
+            print(f"\n{'FAIL' if problems else 'ok  '} {', '.join(methods)}\n     {' '.join(sql.split())[:100]}")
+            for line in scans(plan):
+                print(f"       {line}")
+        failures.extend(f"{', '.join(methods)}: {problem}" for problem in problems)
+
+    for method, family in expected.items():
+        if method in used_indexes and not used_indexes[method] & family:
+            failures.append(f"{method}: {' or '.join(EXPECTED_INDEXES[method])} is not used")
+    print(f"\n{explained} statements explained from {len(statements)} captured")
+    return failures
+
+
+async def run(args) -> int:
+    conn = await asyncpg.connect(args.dsn)
+    await conn.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+    await conn.execute(f"CREATE SCHEMA {SCHEMA}")
+    await conn.close()
+
+    dsn = with_search_path(args.dsn, SCHEMA)
+    data = layout(args.shifts)
+    today = date.today()
+    recorder = Recorder()
+    db = Database(db_url=dsn)
+    db.add_query_logger(recorder)
+    await db.init_pool()
+    try:
+        conn = await asyncpg.connect(dsn)
+        try:
+            await seed(conn, data, first_day(data, today))
+            print(f"Seeded {args.shifts} shifts ({data['employees']} employees, {data['days']} days)")
+            await recorder.run_cases(build_cases(db, data, today))
+            failures = await explain(conn, recorder.statements, args.verbose)
+        finally:
+            await conn.close()
+    finally:
+        await db.close_pool()
+        if not args.keep:
+            conn = await asyncpg.connect(args.dsn)
+            await conn.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+            await conn.close()
+
+    if failures:
+        print(f"\n{len(failures)} plan regressions:")
+        print("\n".join(f"  {failure}" for failure in failures))
+        return 1
+    print("No plan regressions in hot queries")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dsn', required=True)
+    parser.add_argument('--shifts', type=int, default=1_000_000, help="data size, as in db_bench")
+    parser.add_argument('--verbose', action='store_true', help="print the scans of every statement")
+    parser.add_argument('--keep', action='store_true', help=f"keep the {SCHEMA} schema")
+    sys.exit(asyncio.run(run(parser.parse_args())))
+
+
+if __name__ == '__main__':
+    main()
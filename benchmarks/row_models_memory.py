@@ -0,0 +1,98 @@
+"""Memory used by different row representations for a 100k-row slot range.
+
+Usage:
+    python -m benchmarks.row_models_memory [--rows 100000] [--dsn postgresql://...]
+
+Without --dsn the source rows are synthesized in-process (plain mappings stand
+in for asyncpg Records). With --dsn a real result set with the shape of
+get_schedule_slots_by_range is fetched from Postgres via generate_series, so
+the Record overhead itself is measured too.
+"""
+import argparse
+import asyncio
+import gc
+import tracemalloc
+from datetime import date, time, timedelta
+
+from bot.models import Slot
+
+COLUMNS = (
+    'id', 'date', 'start_time', 'end_time', 'address', 'location_latitude',
+    'location_longitude', 'required_employees', 'is_open', 'employee_id', 'full_name'
+)
+
+RANGE_QUERY = """
+    SELECT g AS id,
+           DATE '2025-01-01' + (g % 365) AS date,
+           TIME '09:00' AS start_time,
+           TIME '18:00' AS end_time,
+           'ул. Геолокации, д. ' || (g % 100) AS address,
+           NULL::REAL AS location_latitude,
+           NULL::REAL AS location_longitude,
+           1 + g % 4 AS required_employees,
+           TRUE AS is_open,
+           NULL::BIGINT AS employee_id,
+           NULL::VARCHAR AS full_name
+    FROM generate_series(1, $1) AS g
+"""
+
+
+def synthesize_rows(count: int):
+    base = date(2025, 1, 1)
+    return [
+        dict(zip(COLUMNS, (
+            i, base + timedelta(days=i % 365), time(9, 0), time(18, 0),
+            f"ул. Геолокации, д. {i % 100}", None, None, 1 + i % 4, True, None, None
+        )))
+        for i in range(count)
+    ]
+
+
+def measure(label: str, build):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    size = after - before
+    print(f"{label:<28} {size / 1024 / 1024:8.2f} MiB  ({size / max(len(result), 1):6.1f} B/row)")
+    return result
+
+
+async def fetch_records(dsn: str, count: int):
+    import asyncpg
+    conn = await asyncpg.connect(dsn)
+    try:
+        gc.collect()
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        rows = await conn.fetch(RANGE_QUERY, count)
+        after = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        size = after - before
+        print(f"{'asyncpg Records (fetch)':<28} {size / 1024 / 1024:8.2f} MiB  ({size / len(rows):6.1f} B/row)")
+        return rows
+    finally:
+        await conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--dsn', help="Postgres URL; fetch real Records instead of synthesizing rows")
+    args = parser.parse_args()
+
+    if args.dsn:
+        rows = asyncio.run(fetch_records(args.dsn, args.rows))
+    else:
+        rows = synthesize_rows(args.rows)
+
+    print(f"Extra memory on top of {len(rows)} source rows:")
+    measure("dict(row) copies", lambda: [dict(row) for row in rows])
+    measure("Slot.from_record", lambda: [Slot.from_record(row) for row in rows])
+    measure("zero-copy (raw=True)", lambda: list(rows))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+import json
+import logging
+import os
+import tempfile
+from datetime import date
+from typing import Dict, List, Optional
+
+import asyncpg
+
+from .database import SHIFT_SECONDS_SQL
+from .payroll import month_start, next_month
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet export is optional
+    pa = None
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = '_manifest.json'
+# A month's COPY output stays in memory up to this size, then spills to disk
+SPOOL_MAX_SIZE = 16 * 1024 * 1024
+
+# Live and archived shifts with their slot and employee, one month per COPY
+SHIFT_HISTORY_QUERY = f"""
+    SELECT sh.id AS shift_id, sh.slot_id, sh.employee_id, u.full_name AS employee_name,
+           sh.date, sh.start_time, sh.end_time,
+           {SHIFT_SECONDS_SQL}::float8 / 3600 AS hours,
+           s.address, s.required_employees
+    FROM (
+        SELECT id, slot_id, employee_id, date, start_time, end_time FROM shifts
+        UNION ALL
+        SELECT id, slot_id, employee_id, date, start_time, end_time FROM shifts_archive
+    ) sh
+    LEFT JOIN (
+        SELECT id, date, address, required_employees FROM schedule_slots
+        UNION ALL
+        SELECT id, date, address, required_employees FROM schedule_slots_archive
+    ) s ON s.id = sh.slot_id AND s.date = sh.date
+    LEFT JOIN users u ON u.user_id = sh.employee_id
+    WHERE sh.date >= '{{start}}' AND sh.date < '{{end}}'
+    ORDER BY sh.date, sh.start_time, sh.id
+"""
+
+
+def _schema():
+    return pa.schema([
+        ('shift_id', pa.int32()),
+        ('slot_id', pa.int32()),
+        ('employee_id', pa.int64()),
+        ('employee_name', pa.string()),
+        ('date', pa.date32()),
+        ('start_time', pa.time32('s')),
+        ('end_time', pa.time32('s')),
+        ('hours', pa.float64()),
+        ('address', pa.string()),
+        ('required_employees', pa.int32()),
+    ])
+
+
+def _load_manifest(out_dir: str) -> Dict:
+    try:
+        with open(os.path.join(out_dir, MANIFEST_NAME)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'months': {}}
+
+
+def _save_manifest(out_dir: str, manifest: Dict):
+    path = os.path.join(out_dir, MANIFEST_NAME)
+    with open(f"{path}.partial", 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(f"{path}.partial", path)
+
+
+async def _history_months(conn: asyncpg.Connection) -> List[date]:
+    rows = await conn.fetch("""
+        SELECT DISTINCT date_trunc('month', date)::date AS month FROM shifts
+        UNION
+        SELECT DISTINCT date_trunc('month', date)::date FROM shifts_archive
+        ORDER BY 1
+    """)
+    return [row['month'] for row in rows]
+
+
+async def _export_month(conn: asyncpg.Connection, month: date, out_dir: str) -> int:
+    """Write one month of shift history to month=YYYY-MM/shifts.parquet, return its rows.
+
+    Postgres renders the month as CSV via COPY and Arrow's C++ CSV reader
+    parses it straight into typed columns, so no Python object is created
+    per row or per value.
+    """
+    schema = _schema()
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as spool:
+        query = SHIFT_HISTORY_QUERY.format(start=month, end=next_month(month))
+        await conn.copy_from_query(query, output=spool, format='csv', header=True)
+        spool.seek(0)
+        table = pa_csv.read_csv(
+            spool,
+            convert_options=pa_csv.ConvertOptions(column_types=schema, strings_can_be_null=True),
+        ).select(schema.names).cast(schema)
+
+    directory = os.path.join(out_dir, f"month={month:%Y-%m}")
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, 'shifts.parquet')
+    pq.write_table(table, f"{path}.partial", compression='zstd')
+    os.replace(f"{path}.partial", path)
+    return table.num_rows
+
+
+async def export_shift_history(conn: asyncpg.Connection, out_dir: str, full: bool = False,
+                               today: Optional[date] = None) -> Dict[str, int]:
+    """Export shift history as Parquet files partitioned by month (hive style).
+
+    Only closed months (before the current one) are written. Incremental by
+    default: months listed in out_dir's manifest are skipped, so repeated
+    runs only append new months; full=True rewrites everything. Should run
+    in a repeatable read transaction. Returns {month: rows} of what was
+    written.
+    """
+    if pa is None:
+        raise RuntimeError("Parquet export requires pyarrow")
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = {'months': {}} if full else _load_manifest(out_dir)
+    current = month_start(today or date.today())
+
+    written = {}
+    for month in await _history_months(conn):
+        key = f"{month:%Y-%m}"
+        if month >= current or key in manifest['months']:
+            continue
+        rows = await _export_month(conn, month, out_dir)
+        manifest['months'][key] = rows
+        # Saved per month so an interrupted run resumes where it stopped
+        _save_manifest(out_dir, manifest)
+        written[key] = rows
+        logger.info(f"Exported {rows} shifts for {key}")
+    return written
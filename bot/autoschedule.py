@@ -0,0 +1,262 @@
+import heapq
+from collections import deque
+from datetime import datetime
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from .availability import Interval, merge_intervals, range_to_interval
+
+# Cost of the n-th shift given to one employee is n * LOAD_COST, so the
+# cheapest plan spreads shifts evenly across employees
+LOAD_COST = 10
+
+_INF = float('inf')
+
+
+class OpenSlot(NamedTuple):
+    slot_id: int
+    interval: Interval
+    missing: int
+
+
+class Assignment(NamedTuple):
+    slot_id: int
+    employee_id: int
+
+
+class _FlowGraph:
+    """Residual graph in flat arrays; edge i and i ^ 1 are a forward/backward pair"""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.adjacency: List[List[int]] = [[] for _ in range(size)]
+        self.to: List[int] = []
+        self.cap: List[int] = []
+        self.cost: List[int] = []
+
+    def add_edge(self, u: int, v: int, cap: int, cost: int) -> int:
+        index = len(self.to)
+        self.adjacency[u].append(index)
+        self.to.append(v)
+        self.cap.append(cap)
+        self.cost.append(cost)
+        self.adjacency[v].append(index + 1)
+        self.to.append(u)
+        self.cap.append(0)
+        self.cost.append(-cost)
+        return index
+
+    def min_cost_max_flow(self, source: int, sink: int) -> int:
+        """Primal-dual min-cost max-flow.
+
+        Each phase runs Dijkstra on reduced costs to update node potentials,
+        then pushes a blocking flow (Dinic-style) through the zero reduced
+        cost edges. Phases are bounded by the number of distinct path costs,
+        which stays small because costs only come from employee load levels.
+        """
+        to, cap, cost, adjacency = self.to, self.cap, self.cost, self.adjacency
+        potential = [0] * self.size
+        total = 0
+        while True:
+            dist = [_INF] * self.size
+            dist[source] = 0
+            heap = [(0, source)]
+            while heap:
+                d, u = heapq.heappop(heap)
+                if d > dist[u]:
+                    continue
+                pu = potential[u]
+                for e in adjacency[u]:
+                    if cap[e]:
+                        v = to[e]
+                        nd = d + cost[e] + pu - potential[v]
+                        if nd < dist[v]:
+                            dist[v] = nd
+                            heapq.heappush(heap, (nd, v))
+            if dist[sink] == _INF:
+                return total
+            limit = dist[sink]
+            for v in range(self.size):
+                potential[v] += min(dist[v], limit)
+            total += self._blocking_flow(source, sink, potential)
+
+    def _blocking_flow(self, source: int, sink: int, potential: List[int]) -> int:
+        to, cap, cost, adjacency = self.to, self.cap, self.cost, self.adjacency
+
+        def admissible(e: int, u: int) -> bool:
+            return cap[e] > 0 and cost[e] + potential[u] - potential[to[e]] == 0
+
+        pushed = 0
+        while True:
+            level = [-1] * self.size
+            level[source] = 0
+            queue = deque([source])
+            while queue:
+                u = queue.popleft()
+                for e in adjacency[u]:
+                    v = to[e]
+                    if level[v] < 0 and admissible(e, u):
+                        level[v] = level[u] + 1
+                        queue.append(v)
+            if level[sink] < 0:
+                return pushed
+
+            position = [0] * self.size
+            while True:
+                # Iterative DFS for one augmenting path along increasing levels
+                path: List[int] = []
+                u = source
+                while u != sink:
+                    edges = adjacency[u]
+                    while position[u] < len(edges):
+                        e = edges[position[u]]
+                        v = to[e]
+                        if level[v] == level[u] + 1 and admissible(e, u):
+                            break
+                        position[u] += 1
+                    else:
+                        if u == source:
+                            break
+                        # Dead end: drop it and step back
+                        level[u] = -1
+                        e = path.pop()
+                        u = to[e ^ 1]
+                        position[u] += 1
+                        continue
+                    path.append(e)
+                    u = to[e]
+                if u != sink:
+                    break
+                amount = min(cap[e] for e in path)
+                for e in path:
+                    cap[e] -= amount
+                    cap[e ^ 1] += amount
+                pushed += amount
+
+
+def _covers(free: Sequence[Interval], interval: Interval) -> bool:
+    start, end = interval
+    return any(f_start <= start and end <= f_end for f_start, f_end in free)
+
+
+def _overlaps(intervals: Iterable[Interval], interval: Interval) -> bool:
+    start, end = interval
+    return any(s < end and start < e for s, e in intervals)
+
+
+def solve(
+    slots: Sequence[OpenSlot],
+    free_time: Dict[int, List[Interval]],
+    busy: Dict[int, List[Interval]],
+    load: Optional[Dict[int, int]] = None,
+) -> List[Assignment]:
+    """Assign employees to open slots, filling as many places as possible.
+
+    An employee is eligible for a slot when one of their free-time intervals
+    covers it completely and none of their existing shifts overlaps it. The
+    flow network is source -> slot (capacity = missing places) -> employee's
+    overlap group -> employee -> sink, where an overlap group holds eligible
+    slots of one employee that overlap in a chain and takes at most one of
+    them. Employee -> sink arcs have increasing costs starting from their
+    current load. Places still empty afterwards (possible when a chain blocked
+    a compatible pair) are filled greedily with the least loaded employees.
+    """
+    load = dict(load or {})
+    free = {employee_id: merge_intervals(intervals) for employee_id, intervals in free_time.items()}
+    busy = {employee_id: merge_intervals(intervals) for employee_id, intervals in busy.items()}
+    slots = [slot for slot in slots if slot.missing > 0]
+
+    eligible: Dict[int, List[int]] = {}
+    for index, slot in enumerate(slots):
+        for employee_id, intervals in free.items():
+            if _covers(intervals, slot.interval) and not _overlaps(busy.get(employee_id, ()), slot.interval):
+                eligible.setdefault(employee_id, []).append(index)
+
+    # Node layout: source, sink, slots, employees, then overlap groups
+    source, sink = 0, 1
+    employee_ids = sorted(eligible)
+    employee_node = {employee_id: 2 + len(slots) + i for i, employee_id in enumerate(employee_ids)}
+    groups: List[Tuple[int, List[int]]] = []
+    for employee_id in employee_ids:
+        indexes = sorted(eligible[employee_id], key=lambda i: slots[i].interval)
+        group_end = None
+        for i in indexes:
+            start, end = slots[i].interval
+            if group_end is None or start >= group_end:
+                groups.append((employee_id, []))
+                group_end = end
+            else:
+                group_end = max(group_end, end)
+            groups[-1][1].append(i)
+
+    graph = _FlowGraph(2 + len(slots) + len(employee_ids) + len(groups))
+    for i, slot in enumerate(slots):
+        graph.add_edge(source, 2 + i, slot.missing, 0)
+
+    assignment_edges: List[Tuple[int, int, int]] = []
+    group_counts: Dict[int, int] = {}
+    for g, (employee_id, indexes) in enumerate(groups):
+        group_node = 2 + len(slots) + len(employee_ids) + g
+        for i in indexes:
+            edge = graph.add_edge(2 + i, group_node, 1, 0)
+            assignment_edges.append((edge, i, employee_id))
+        graph.add_edge(group_node, employee_node[employee_id], 1, 0)
+        group_counts[employee_id] = group_counts.get(employee_id, 0) + 1
+
+    for employee_id in employee_ids:
+        current = load.get(employee_id, 0)
+        for n in range(group_counts[employee_id]):
+            graph.add_edge(employee_node[employee_id], sink, 1, (current + n + 1) * LOAD_COST)
+
+    graph.min_cost_max_flow(source, sink)
+
+    result: List[Assignment] = []
+    filled = [0] * len(slots)
+    taken: Dict[int, List[Interval]] = {}
+    for edge, i, employee_id in assignment_edges:
+        if graph.cap[edge] == 0:
+            result.append(Assignment(slots[i].slot_id, employee_id))
+            filled[i] += 1
+            taken.setdefault(employee_id, []).append(slots[i].interval)
+            load[employee_id] = load.get(employee_id, 0) + 1
+
+    # Greedy pass over places the group relaxation left empty
+    eligible_sets = {employee_id: set(indexes) for employee_id, indexes in eligible.items()}
+    for i, slot in sorted(enumerate(slots), key=lambda item: item[1].interval):
+        if filled[i] >= slot.missing:
+            continue
+        assigned = {a.employee_id for a in result if a.slot_id == slot.slot_id}
+        for employee_id in sorted(eligible, key=lambda e: (load.get(e, 0), e)):
+            if filled[i] >= slot.missing:
+                break
+            if employee_id in assigned or i not in eligible_sets[employee_id]:
+                continue
+            if _overlaps(taken.get(employee_id, ()), slot.interval):
+                continue
+            result.append(Assignment(slot.slot_id, employee_id))
+            filled[i] += 1
+            taken.setdefault(employee_id, []).append(slot.interval)
+            load[employee_id] = load.get(employee_id, 0) + 1
+
+    return result
+
+
+def plan_from_records(slot_rows, shift_rows, free_rows, base: datetime) -> List[Assignment]:
+    """Build solver input from Database.get_autoschedule_data rows and solve"""
+    slots = []
+    for row in slot_rows:
+        interval = range_to_interval(row['period'], base)
+        if interval:
+            slots.append(OpenSlot(row['id'], interval, row['missing']))
+    busy: Dict[int, List[Interval]] = {}
+    load: Dict[int, int] = {}
+    for row in shift_rows:
+        interval = range_to_interval(row['period'], base)
+        if interval:
+            busy.setdefault(row['employee_id'], []).append(interval)
+            load[row['employee_id']] = load.get(row['employee_id'], 0) + 1
+    free_time: Dict[int, List[Interval]] = {}
+    for row in free_rows:
+        interval = range_to_interval(row['period'], base)
+        if interval:
+            free_time.setdefault(row['employee_id'], []).append(interval)
+    return solve(slots, free_time, busy, load)
@@ -0,0 +1,115 @@
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+# Intervals are half-open [start, end) in minutes from the start of the day;
+# times past midnight continue above 1440
+Interval = Tuple[int, int]
+
+
+class Candidate(NamedTuple):
+    """Employee who can take a slot, with how much of it their free time covers"""
+    employee_id: int
+    name: str
+    covered_minutes: int
+    coverage: float
+    shifts_that_day: int
+
+    @property
+    def fully_free(self) -> bool:
+        return self.coverage >= 1.0
+
+
+def range_to_interval(period, base: datetime) -> Optional[Interval]:
+    """Convert an asyncpg tsrange into minutes relative to base"""
+    if period is None or period.isempty or period.lower is None or period.upper is None:
+        return None
+    start = int((period.lower - base).total_seconds() // 60)
+    end = int((period.upper - base).total_seconds() // 60)
+    return (start, end) if end > start else None
+
+
+def merge_intervals(intervals: Iterable[Interval]) -> List[Interval]:
+    """Merge overlapping and touching intervals"""
+    merged: List[Interval] = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+# Event kinds at equal times: ends are processed before starts so that
+# touching intervals never count as overlapping
+_END, _START = 0, 1
+_SLOT, _SHIFT, _FREE = 0, 1, 2
+
+
+def compute_availability(
+    slots: Dict[int, Interval],
+    shifts: Dict[int, List[Interval]],
+    free_time: Dict[int, List[Interval]],
+    employees: Dict[int, str],
+) -> Dict[int, List[Candidate]]:
+    """Rank employees for every slot in one sweep over the sorted intervals.
+
+    slots maps slot_id to its interval; shifts and free_time map employee_id
+    to intervals; employees maps employee_id to display name. An employee is
+    a candidate for a slot unless one of their shifts overlaps it. Candidates
+    are ranked by how much of the slot their free time covers, then by fewer
+    shifts that day, then by name.
+    """
+    events = []
+    for slot_id, (start, end) in slots.items():
+        events.append((start, _START, _SLOT, slot_id))
+        events.append((end, _END, _SLOT, slot_id))
+    for employee_id, intervals in shifts.items():
+        for start, end in merge_intervals(intervals):
+            events.append((start, _START, _SHIFT, employee_id))
+            events.append((end, _END, _SHIFT, employee_id))
+    for employee_id, intervals in free_time.items():
+        for start, end in merge_intervals(intervals):
+            events.append((start, _START, _FREE, employee_id))
+            events.append((end, _END, _FREE, employee_id))
+    events.sort()
+
+    active: Tuple[Set[int], Set[int], Set[int]] = (set(), set(), set())
+    busy: Dict[int, Set[int]] = defaultdict(set)
+    covered: Dict[int, Dict[int, int]] = defaultdict(lambda: defaultdict(int))
+
+    for i, (at, kind, source, key) in enumerate(events):
+        if kind == _START:
+            active[source].add(key)
+        else:
+            active[source].discard(key)
+        # Attribute the segment up to the next event to everything active in it
+        if i + 1 == len(events) or not active[_SLOT]:
+            continue
+        length = events[i + 1][0] - at
+        if length <= 0:
+            continue
+        for slot_id in active[_SLOT]:
+            busy[slot_id].update(active[_SHIFT])
+            slot_covered = covered[slot_id]
+            for employee_id in active[_FREE]:
+                slot_covered[employee_id] += length
+
+    shift_counts = {employee_id: len(intervals) for employee_id, intervals in shifts.items()}
+    matrix: Dict[int, List[Candidate]] = {}
+    for slot_id, (start, end) in slots.items():
+        length = end - start
+        candidates = []
+        for employee_id, name in employees.items():
+            if employee_id in busy[slot_id]:
+                continue
+            minutes = covered[slot_id].get(employee_id, 0)
+            candidates.append(Candidate(
+                employee_id, name, minutes,
+                minutes / length if length > 0 else 0.0,
+                shift_counts.get(employee_id, 0),
+            ))
+        candidates.sort(key=lambda c: (-c.coverage, c.shifts_that_day, c.name.lower(), c.employee_id))
+        matrix[slot_id] = candidates
+    return matrix
@@ -0,0 +1,163 @@
+import hashlib
+import io
+import json
+import logging
+import os
+import tarfile
+import tempfile
+from datetime import datetime
+from typing import Dict, List
+
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+# Tables in load order (referenced tables first). Derived data (free-time
+# bitmaps, payroll snapshots) is rebuilt after a restore instead of dumped
+BACKUP_TABLES = (
+    'users', 'schedule_slots', 'shifts', 'free_time_slots',
+    'schedule_slots_archive', 'shifts_archive',
+)
+DERIVED_TABLES = ('free_time_bitmaps', 'payroll_periods', 'payroll_closed_periods')
+# Live tables whose id sequence must stay above ids kept in the archive
+SEQUENCE_TABLES = {
+    'schedule_slots': 'schedule_slots_archive',
+    'shifts': 'shifts_archive',
+    'free_time_slots': None,
+}
+FORMAT_VERSION = 1
+MANIFEST_NAME = 'manifest.json'
+CHUNK_SIZE = 64 * 1024
+
+
+async def table_columns(conn: asyncpg.Connection, table: str) -> List[str]:
+    """Stored (non-generated) columns of a table in ordinal order"""
+    rows = await conn.fetch("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = $1 AND is_generated = 'NEVER'
+        ORDER BY ordinal_position
+    """, table)
+    return [row['column_name'] for row in rows]
+
+
+async def write_backup(conn: asyncpg.Connection, path: str) -> Dict:
+    """Dump BACKUP_TABLES with binary COPY into a tar.gz archive at path.
+
+    Should run in a repeatable read transaction so all tables come from one
+    snapshot. Each table is copied to a temporary file while its SHA-256 is
+    computed, then added to the archive after a manifest.json holding the
+    columns, row count, size and checksum of every table. The archive is
+    written next to path and renamed into place when complete.
+    """
+    manifest = {
+        'version': FORMAT_VERSION,
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'tables': {},
+        'slot_months': [
+            row['month'].isoformat() for row in await conn.fetch(
+                "SELECT DISTINCT date_trunc('month', date)::date AS month FROM schedule_slots ORDER BY 1"
+            )
+        ],
+    }
+    with tempfile.TemporaryDirectory() as workdir:
+        for table in BACKUP_TABLES:
+            columns = await table_columns(conn, table)
+            digest = hashlib.sha256()
+            with open(os.path.join(workdir, table), 'wb') as out:
+                async def sink(chunk: bytes):
+                    out.write(chunk)
+                    digest.update(chunk)
+
+                # COPY (SELECT ...) because partitioned tables cannot be copied from directly
+                column_list = ', '.join(f'"{column}"' for column in columns)
+                status = await conn.copy_from_query(
+                    f"SELECT {column_list} FROM {table}", output=sink, format='binary'
+                )
+                size = out.tell()
+            manifest['tables'][table] = {
+                'columns': columns,
+                'rows': int(status.split()[-1]),
+                'bytes': size,
+                'sha256': digest.hexdigest(),
+            }
+            logger.info(f"Dumped {table}: {manifest['tables'][table]['rows']} rows")
+
+        partial = f"{path}.partial"
+        with tarfile.open(partial, 'w:gz') as archive:
+            data = json.dumps(manifest, indent=2).encode()
+            info = tarfile.TarInfo(MANIFEST_NAME)
+            info.size = len(data)
+            info.mtime = int(datetime.now().timestamp())
+            archive.addfile(info, io.BytesIO(data))
+            for table in BACKUP_TABLES:
+                archive.add(os.path.join(workdir, table), arcname=f"{table}.copy")
+        os.replace(partial, path)
+    return manifest
+
+
+async def restore_backup(conn: asyncpg.Connection, path: str) -> Dict:
+    """Replace the contents of BACKUP_TABLES with a write_backup archive.
+
+    Must run inside a transaction: any checksum or row count mismatch raises
+    ValueError and the caller's rollback leaves the database untouched. The
+    archive is read as a stream, each member going straight into binary
+    COPY, so tables are never held in memory. Derived tables are emptied and
+    left for the caller to rebuild.
+    """
+    with tarfile.open(path, 'r|gz') as archive:
+        members = iter(archive)
+        first = next(members, None)
+        if first is None or first.name != MANIFEST_NAME:
+            raise ValueError(f"{path} is not a backup archive: {MANIFEST_NAME} is missing")
+        manifest = json.load(archive.extractfile(first))
+        if manifest.get('version') != FORMAT_VERSION:
+            raise ValueError(f"Unsupported backup format version: {manifest.get('version')}")
+
+        await conn.execute("SET LOCAL bot.skip_payroll_invalidation = 'on'")
+        await conn.execute("SET LOCAL bot.skip_free_time_bitmaps = 'on'")
+        await conn.execute(f"TRUNCATE {', '.join(BACKUP_TABLES + DERIVED_TABLES)} CASCADE")
+        await conn.execute(
+            "SELECT ensure_month_partitions(m) FROM unnest($1::date[]) AS m",
+            [datetime.fromisoformat(month).date() for month in manifest['slot_months']]
+        )
+
+        restored = set()
+        for member in members:
+            table = member.name[:-len('.copy')] if member.name.endswith('.copy') else None
+            expected = manifest['tables'].get(table)
+            if expected is None or table not in BACKUP_TABLES:
+                raise ValueError(f"Unexpected archive member: {member.name}")
+
+            digest = hashlib.sha256()
+            stream = archive.extractfile(member)
+
+            async def chunks():
+                while True:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        return
+                    digest.update(chunk)
+                    yield chunk
+
+            status = await conn.copy_to_table(table, source=chunks(), columns=expected['columns'], format='binary')
+            rows = int(status.split()[-1])
+            if digest.hexdigest() != expected['sha256']:
+                raise ValueError(f"Checksum mismatch for {table}, the archive is damaged")
+            if rows != expected['rows']:
+                raise ValueError(f"{table}: restored {rows} rows, manifest says {expected['rows']}")
+            restored.add(table)
+            logger.info(f"Restored {table}: {rows} rows")
+
+    missing = set(manifest['tables']) - restored
+    if missing:
+        raise ValueError(f"Archive is truncated, missing tables: {', '.join(sorted(missing))}")
+
+    for table, archive_table in SEQUENCE_TABLES.items():
+        ids = f"SELECT id FROM {table}"
+        if archive_table:
+            ids += f" UNION ALL SELECT id FROM {archive_table}"
+        await conn.execute(f"""
+            SELECT setval(pg_get_serial_sequence('{table}', 'id'), COALESCE(MAX(id), 0) + 1, false)
+            FROM ({ids}) AS ids
+        """)
+    return manifest
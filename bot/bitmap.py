@@ -0,0 +1,124 @@
+from datetime import date, time
+from typing import Dict, Iterable, List, Optional, Sequence
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional; plain ints are used without it
+    np = None
+
+# A day is 96 quarters of an hour; bit 0 (the leftmost bit of the Postgres
+# BIT(96) value, the MSB here) is 00:00-00:15
+QUARTER_MINUTES = 15
+QUARTERS = 24 * 60 // QUARTER_MINUTES
+BITMAP_BYTES = QUARTERS // 8
+FULL_DAY = (1 << QUARTERS) - 1
+
+
+def minutes_mask(start_minute: int, end_minute: int) -> int:
+    """Mask of the quarters touched by [start_minute, end_minute) within one day"""
+    start_minute = max(0, start_minute)
+    end_minute = min(24 * 60, end_minute)
+    if end_minute <= start_minute:
+        return 0
+    first = start_minute // QUARTER_MINUTES
+    last = -(-end_minute // QUARTER_MINUTES)  # ceil
+    width = last - first
+    return ((1 << width) - 1) << (QUARTERS - last)
+
+
+def time_mask(start_time: time, end_time: time) -> int:
+    """Mask for a time range on one day; an end not after the start runs to midnight"""
+    start = start_time.hour * 60 + start_time.minute
+    end = end_time.hour * 60 + end_time.minute
+    if end <= start:
+        end = 24 * 60
+    return minutes_mask(start, end)
+
+
+def quarter_bit(quarter: int) -> int:
+    return 1 << (QUARTERS - 1 - quarter)
+
+
+def popcount(value: int) -> int:
+    return bin(value).count('1')
+
+
+class DayBitmaps:
+    """Free-time bitmaps of many employees for one day.
+
+    With NumPy the bitmaps are a (n, 12) uint8 matrix and every query is a
+    vectorized bitwise operation over all employees; without it they are a
+    list of Python ints.
+    """
+
+    def __init__(self, employee_ids: Sequence[int], bitmaps: Sequence[int]):
+        self.employee_ids = list(employee_ids)
+        self._ints = list(bitmaps)
+        self._by_employee = dict(zip(self.employee_ids, self._ints))
+        if np is not None and self._ints:
+            raw = b''.join(bits.to_bytes(BITMAP_BYTES, 'big') for bits in self._ints)
+            self._matrix = np.frombuffer(raw, dtype=np.uint8).reshape(len(self._ints), BITMAP_BYTES)
+        else:
+            self._matrix = None
+
+    @classmethod
+    def from_rows(cls, rows: Iterable) -> 'DayBitmaps':
+        """Build from (employee_id, bits) rows, bits being an asyncpg BitString"""
+        employee_ids, bitmaps = [], []
+        for row in rows:
+            employee_ids.append(row['employee_id'])
+            bitmaps.append(row['bits'].to_int())
+        return cls(employee_ids, bitmaps)
+
+    def __len__(self) -> int:
+        return len(self.employee_ids)
+
+    def bitmap(self, employee_id: int) -> int:
+        return self._by_employee.get(employee_id, 0)
+
+    @staticmethod
+    def _mask_row(mask: int):
+        return np.frombuffer(mask.to_bytes(BITMAP_BYTES, 'big'), dtype=np.uint8)
+
+    def free_for(self, mask: int) -> List[int]:
+        """Employees free during every quarter of mask"""
+        if not mask:
+            return list(self.employee_ids)
+        if self._matrix is not None:
+            row = self._mask_row(mask)
+            hits = ((self._matrix & row) == row).all(axis=1)
+            return [self.employee_ids[i] for i in np.flatnonzero(hits)]
+        return [e for e, bits in zip(self.employee_ids, self._ints) if bits & mask == mask]
+
+    def coverage(self, mask: int) -> Dict[int, float]:
+        """Share of mask's quarters each employee is free for"""
+        total = popcount(mask)
+        if not total:
+            return {employee_id: 0.0 for employee_id in self.employee_ids}
+        if self._matrix is not None:
+            counts = np.unpackbits(self._matrix & self._mask_row(mask), axis=1).sum(axis=1)
+            return {e: int(count) / total for e, count in zip(self.employee_ids, counts)}
+        return {e: popcount(bits & mask) / total for e, bits in zip(self.employee_ids, self._ints)}
+
+    def common(self, employee_ids: Optional[Iterable[int]] = None) -> int:
+        """Quarters when all given employees (default: everyone) are free"""
+        selected = set(self.employee_ids if employee_ids is None else employee_ids)
+        result = FULL_DAY
+        for e, bits in zip(self.employee_ids, self._ints):
+            if e in selected:
+                result &= bits
+        return result if selected else 0
+
+    def free_counts(self) -> List[int]:
+        """Number of free employees for each of the 96 quarters"""
+        if self._matrix is not None:
+            return [int(count) for count in np.unpackbits(self._matrix, axis=1).sum(axis=0)]
+        return [sum(1 for bits in self._ints if bits & quarter_bit(q)) for q in range(QUARTERS)]
+
+
+def group_by_day(rows: Iterable) -> Dict[date, DayBitmaps]:
+    """Split (employee_id, date, bits) rows into per-day DayBitmaps"""
+    days: Dict[date, list] = {}
+    for row in rows:
+        days.setdefault(row['date'], []).append(row)
+    return {day: DayBitmaps.from_rows(day_rows) for day, day_rows in days.items()}
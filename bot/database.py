@@ -1,8 +1,108 @@
 import os
+import re
 import asyncpg
-from datetime import datetime, date
-from typing import List, Optional, Tuple, Dict
+from datetime import date, datetime, time
+from typing import AsyncIterator, Awaitable, Callable, List, Optional, Tuple, Dict
 import asyncio
+from .singleflight import SingleFlight, coalesced
+from .models import User, Slot, Shift, FreeTime
+from .payroll import next_month, split_period
+from .availability import Candidate, compute_availability, merge_intervals, range_to_interval
+from .bitmap import DayBitmaps, group_by_day
+from .backup import restore_backup, write_backup
+from .slowlog import SlowQueryLog
+
+# Serializes shift assignments per employee (in id order, so batches can't
+# deadlock); overlap checks then see every committed shift of the employee
+EMPLOYEE_LOCK_SQL = "SELECT pg_advisory_xact_lock(e) FROM unnest($1::bigint[]) AS e ORDER BY e"
+
+# Shift assignments lock their slot rows before EMPLOYEE_LOCK_SQL; a conflict
+# with other writers is retried this many times before giving up
+CONFLICT_ATTEMPTS = 3
+CONFLICT_ERRORS = (asyncpg.exceptions.DeadlockDetectedError, asyncpg.exceptions.SerializationError)
+
+# Shift length in seconds computed by Postgres; shifts ending before they
+# start are treated as running past midnight. Equal start and end times
+# are rejected on input (see check_time_range), so they never mean 24 hours
+SHIFT_SECONDS_SQL = """
+    EXTRACT(EPOCH FROM (
+        CASE WHEN sh.end_time > sh.start_time
+             THEN sh.end_time - sh.start_time
+             ELSE sh.end_time - sh.start_time + INTERVAL '24 hours'
+        END
+    ))
+"""
+
+
+def check_time_range(start_time: time, end_time: time):
+    """An end before the start runs past midnight; equal times are an error"""
+    if end_time == start_time:
+        raise ValueError("Время окончания должно отличаться от времени начала")
+
+
+def period_sql(day: str, start: str, end: str) -> str:
+    """SQL tsrange for a date and start/end times; an end not after the start means the next day"""
+    return (
+        f"tsrange({day}::date + {start}::time, "
+        f"CASE WHEN {end}::time > {start}::time THEN {day}::date + {end}::time "
+        f"ELSE {day}::date + 1 + {end}::time END)"
+    )
+
+
+# Shifts still in the live table plus archived ones, for payroll totals
+SHIFT_HISTORY_SQL = """(
+    SELECT employee_id, date, start_time, end_time FROM shifts
+    UNION ALL
+    SELECT employee_id, date, start_time, end_time FROM shifts_archive
+)"""
+
+# Per-employee payroll over the totals CTE of Database._payroll_totals_query; $6 is the rate
+PAYROLL_SELECT_SQL = """
+    SELECT u.user_id, u.full_name, u.username,
+           COALESCE(SUM(t.shift_count), 0)::bigint AS shift_count,
+           COALESCE(SUM(t.seconds), 0)::float8 / 3600 AS hours,
+           COALESCE(SUM(t.seconds), 0)::float8 / 3600 * $6 AS pay
+    FROM users u
+    LEFT JOIN totals t ON t.employee_id = u.user_id
+    GROUP BY u.user_id, u.full_name, u.username, u.is_admin
+    HAVING u.is_admin IS NOT TRUE OR COALESCE(SUM(t.shift_count), 0) > 0
+    ORDER BY COALESCE(NULLIF(u.full_name, ''), u.username, CAST(u.user_id AS TEXT))
+"""
+
+# Generated "period" column shared by slots, shifts and free time
+PERIOD_COLUMN_SQL = period_sql('date', 'start_time', 'end_time')
+
+# Fills an empty free_time_bitmaps table from free_time_slots
+FREE_TIME_BITMAPS_BACKFILL_SQL = """
+    INSERT INTO free_time_bitmaps (employee_id, date, bits)
+    SELECT k.employee_id, k.day, free_time_bitmap(k.employee_id, k.day)
+    FROM (
+        SELECT DISTINCT ft.employee_id, d::date AS day
+        FROM free_time_slots ft,
+        generate_series(lower(ft.period)::date,
+                        (upper(ft.period) - INTERVAL '1 microsecond')::date,
+                        INTERVAL '1 day') AS d
+    ) AS k
+    WHERE NOT EXISTS (SELECT 1 FROM free_time_bitmaps)
+    AND free_time_bitmap(k.employee_id, k.day) <> B'0'::BIT(96)
+    ON CONFLICT DO NOTHING
+"""
+
+# Date ranges of team availability kept in memory
+TEAM_AVAILABILITY_CACHE_SIZE = 16
+
+# Monthly partitions of schedule_slots/shifts created in advance
+PARTITION_MONTHS_AHEAD = 3
+# Columns copied when slots and shifts change tables (migration, archive)
+SLOT_COLUMNS = (
+    "id, date, start_time, end_time, address, location_latitude, "
+    "location_longitude, required_employees, is_open, created_at"
+)
+SHIFT_COLUMNS = "id, slot_id, employee_id, date, start_time, end_time, created_at"
+PARTITION_NAME_RE = re.compile(r'^(schedule_slots|shifts)_p(\d{4})_(\d{2})$')
+
+# Rows fetched per round trip when streaming exports through a cursor
+EXPORT_PREFETCH = 500
 
 
 class Database:
@@ -14,6 +114,17 @@ class Database:
             )
         self.db_url = db_url
         self._pool: Optional[asyncpg.Pool] = None
+        # Identical concurrent reads share one query
+        self._singleflight = SingleFlight()
+        # Bumped on every write to free time (or to the employees shown with
+        # it); cached team availability is valid only for the same version
+        self._free_time_version = 0
+        self._team_availability_cache: Dict[Tuple[date, date], Tuple[int, tuple]] = {}
+        # Months whose slot/shift partitions are known to exist
+        self._known_partitions = set()
+        # Installed on every pool connection (see add_query_logger)
+        self._query_loggers: List[Callable] = []
+        self.slow_queries: Optional[SlowQueryLog] = None
 
     async def init_pool(self):
         """Initialize connection pool"""
@@ -25,7 +136,9 @@ class Database:
             # Parse connection string for asyncpg
             # asyncpg uses postgresql:// but we need to convert from psycopg2 format
             try:
-                self._pool = await asyncpg.create_pool(self.db_url, min_size=1, max_size=10)
+                self._pool = await asyncpg.create_pool(
+                    self.db_url, min_size=1, max_size=10, init=self._init_connection
+                )
                 logger.info("Connection pool created successfully")
                 await self.init_db()
                 logger.info("Database initialization completed")
@@ -35,15 +148,215 @@ class Database:
 
     async def close_pool(self):
         """Close connection pool"""
+        if self.slow_queries is not None:
+            await self.slow_queries.close()
         if self._pool:
             await self._pool.close()
             self._pool = None
 
+    async def _init_connection(self, conn: asyncpg.Connection):
+        for callback in self._query_loggers:
+            conn.add_query_logger(callback)
+
+    def add_query_logger(self, callback: Callable):
+        """Call callback(LoggedQuery) after every query on the pool's connections.
+
+        Must be added before init_pool; see asyncpg's Connection.add_query_logger.
+        """
+        self._query_loggers.append(callback)
+
+    def enable_slow_query_log(self, threshold_ms: float, explain_sample: float = 0):
+        """Log statements slower than threshold_ms, EXPLAIN ANALYZE a sample of them (before init_pool)"""
+        self.slow_queries = SlowQueryLog(threshold_ms, explain=self._explain_analyze, explain_sample=explain_sample)
+        self.add_query_logger(self.slow_queries)
+
+    async def _explain_analyze(self, query: str, args: tuple) -> str:
+        """EXPLAIN ANALYZE a read query; the read-only transaction keeps writes from running"""
+        self._ensure_pool()
+        async with self._pool.acquire() as conn:
+            async with conn.transaction(readonly=True):
+                await conn.execute("SET LOCAL statement_timeout = '30s'")
+                rows = await conn.fetch(f"EXPLAIN (ANALYZE, BUFFERS) {query}", *args)
+        return '\n'.join(row[0] for row in rows)
+
+    def pool_stats(self) -> Dict[str, int]:
+        """Connections of the pool: open, idle and the configured maximum"""
+        if self._pool is None:
+            return {}
+        return {'open': self._pool.get_size(), 'idle': self._pool.get_idle_size(), 'max': self._pool.get_max_size()}
+
+    def coalescing_stats(self) -> Dict[str, Dict[str, int]]:
+        """Per-method read coalescing counters"""
+        return self._singleflight.stats()
+
+    def _free_time_changed(self):
+        self._free_time_version += 1
+
     def _ensure_pool(self):
         """Ensure connection pool is initialized"""
         if self._pool is None:
             raise RuntimeError("Database pool not initialized. Call init_pool() first.")
 
+    async def _create_schedule_slots_table(self, conn: asyncpg.Connection):
+        await conn.execute("CREATE SEQUENCE IF NOT EXISTS schedule_slots_id_seq AS INTEGER")
+        await conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS schedule_slots (
+                id INTEGER NOT NULL DEFAULT nextval('schedule_slots_id_seq'),
+                date DATE NOT NULL,
+                start_time TIME NOT NULL,
+                end_time TIME NOT NULL,
+                address TEXT,
+                location_latitude REAL,
+                location_longitude REAL,
+                required_employees INTEGER DEFAULT 1,
+                is_open BOOLEAN DEFAULT TRUE,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                period tsrange GENERATED ALWAYS AS ({PERIOD_COLUMN_SQL}) STORED,
+                PRIMARY KEY (id, date)
+            ) PARTITION BY RANGE (date)
+        """)
+        await conn.execute("ALTER SEQUENCE schedule_slots_id_seq OWNED BY schedule_slots.id")
+
+    async def _create_shifts_table(self, conn: asyncpg.Connection):
+        # A shift has its slot's date, so the pair references the slot partition
+        await conn.execute("CREATE SEQUENCE IF NOT EXISTS shifts_id_seq AS INTEGER")
+        await conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS shifts (
+                id INTEGER NOT NULL DEFAULT nextval('shifts_id_seq'),
+                slot_id INTEGER,
+                employee_id BIGINT REFERENCES users(user_id) ON DELETE CASCADE,
+                date DATE NOT NULL,
+                start_time TIME NOT NULL,
+                end_time TIME NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                period tsrange GENERATED ALWAYS AS ({PERIOD_COLUMN_SQL}) STORED,
+                PRIMARY KEY (id, date),
+                FOREIGN KEY (slot_id, date) REFERENCES schedule_slots (id, date) ON DELETE CASCADE
+            ) PARTITION BY RANGE (date)
+        """)
+        await conn.execute("ALTER SEQUENCE shifts_id_seq OWNED BY shifts.id")
+
+    async def _ensure_partitions_ahead(self, conn: asyncpg.Connection, start: Optional[date] = None):
+        """Create partitions from start's month (default: current) to PARTITION_MONTHS_AHEAD months ahead"""
+        await conn.execute("""
+            SELECT ensure_month_partitions(m::date)
+            FROM generate_series(date_trunc('month', COALESCE($1, CURRENT_DATE)),
+                                 date_trunc('month', CURRENT_DATE) + make_interval(months => $2),
+                                 INTERVAL '1 month') AS m
+        """, start, PARTITION_MONTHS_AHEAD)
+
+    async def _ensure_month_partition(self, conn: asyncpg.Connection, day: date):
+        """Make sure slots/shifts of day's month can be written"""
+        month = day.replace(day=1)
+        if month in self._known_partitions:
+            return
+        await conn.execute("SELECT ensure_month_partitions($1)", month)
+        self._known_partitions.add(month)
+
+    async def is_partitioned(self) -> bool:
+        self._ensure_pool()
+        async with self._pool.acquire() as conn:
+            return await conn.fetchval("SELECT relkind::text FROM pg_class WHERE oid = 'shifts'::regclass") == 'p'
+
+    async def ensure_partitions_ahead(self):
+        """Create upcoming monthly partitions (no-op for unpartitioned tables)"""
+        self._ensure_pool()
+        async with self._pool.acquire() as conn:
+            await self._ensure_partitions_ahead(conn)
+
+    async def migrate_to_partitions(self) -> bool:
+        """Move plain schedule_slots/shifts tables into monthly partitioned ones.
+
+        Runs in one transaction: the old tables and their indexes are renamed,
+        partitioned tables are created with partitions for every month that
+        has data, rows are copied keeping their ids and sequences, and the old
+        tables are dropped. Returns False if the tables are already partitioned.
+        """
+        import logging
+        logger = logging.getLogger(__name__)
+        self._ensure_pool()
+        async with self._pool.acquire() as conn:
+            async with conn.transaction():
+                kind = await conn.fetchval("SELECT relkind::text FROM pg_class WHERE oid = 'shifts'::regclass")
+                if kind == 'p':
+                    return False
+
+                await conn.execute("LOCK TABLE schedule_slots, shifts IN ACCESS EXCLUSIVE MODE")
+                await conn.execute("ALTER TABLE shifts RENAME TO shifts_unpartitioned")
+                await conn.execute("ALTER TABLE schedule_slots RENAME TO schedule_slots_unpartitioned")
+                # Index names are schema-wide; free them for the new tables
+                await conn.execute("""
+                    DO $$
+                    DECLARE
+                        r RECORD;
+                    BEGIN
+                        FOR r IN
+                            SELECT i.relname
+                            FROM pg_index x
+                            JOIN pg_class i ON i.oid = x.indexrelid
+                            WHERE x.indrelid IN ('shifts_unpartitioned'::regclass,
+                                                 'schedule_slots_unpartitioned'::regclass)
+                        LOOP
+                            EXECUTE format('ALTER INDEX %I RENAME TO %I', r.relname, left(r.relname, 45) || '_unpartitioned');
+                        END LOOP;
+                    END $$;
+                """)
+
+                await self._create_schedule_slots_table(conn)
+                await self._create_shifts_table(conn)
+                first_day = await conn.fetchval("SELECT MIN(date) FROM schedule_slots_unpartitioned")
+                await self._ensure_partitions_ahead(conn, first_day)
+                # Shifts may be dated outside their slot's range only if data is broken;
+                # cover them too so the FK reports the real problem
+                await conn.execute("""
+                    SELECT ensure_month_partitions(d)
+                    FROM (SELECT DISTINCT date_trunc('month', date)::date AS d FROM shifts_unpartitioned) AS months
+                """)
+
+                # Totals do not change, keep the closed payroll months
+                await conn.execute("SET LOCAL bot.skip_payroll_invalidation = 'on'")
+                slots = await conn.execute(f"""
+                    INSERT INTO schedule_slots ({SLOT_COLUMNS})
+                    SELECT {SLOT_COLUMNS} FROM schedule_slots_unpartitioned
+                """)
+                shifts = await conn.execute(f"""
+                    INSERT INTO shifts ({SHIFT_COLUMNS})
+                    SELECT {SHIFT_COLUMNS} FROM shifts_unpartitioned
+                """)
+                await conn.execute("DROP TABLE shifts_unpartitioned")
+                await conn.execute("DROP TABLE schedule_slots_unpartitioned")
+                logger.info(f"Partitioned {slots.split()[-1]} slots and {shifts.split()[-1]} shifts")
+        self._known_partitions.clear()
+        # Recreate triggers and indexes on the new tables
+        await self.init_db()
+        return True
+
+    async def backup(self, path: str) -> Dict:
+        """Write a backup archive of all tables from one consistent snapshot, return its manifest"""
+        self._ensure_pool()
+        async with self._pool.acquire() as conn:
+            async with conn.transaction(isolation='repeatable_read', readonly=True):
+                return await write_backup(conn, path)
+
+    async def restore(self, path: str) -> Dict:
+        """Replace all data with a backup archive in one transaction, return its manifest"""
+        self._ensure_pool()
+        async with self._pool.acquire() as conn:
+            async with conn.transaction():
+                manifest = await restore_backup(conn, path)
+                await conn.execute(FREE_TIME_BITMAPS_BACKFILL_SQL)
+        self._known_partitions.clear()
+        self._free_time_changed()
+        return manifest
+
+    async def export_shift_history(self, out_dir: str, full: bool = False) -> Dict[str, int]:
+        """Export closed months of shift history to Parquet (see analytics.export_shift_history)"""
+        from .analytics import export_shift_history
+        self._ensure_pool()
+        async with self._pool.acquire() as conn:
+            async with conn.transaction(isolation='repeatable_read', readonly=True):
+                return await export_shift_history(conn, out_dir, full=full)
+
     async def init_db(self):
         """Initialize database schema"""
         import logging
@@ -65,22 +378,18 @@ class Database:
                 """)
                 logger.info("Users table created/verified")
                 
+                # Needed by the shift exclusion constraints
+                await conn.execute("CREATE EXTENSION IF NOT EXISTS btree_gist")
+                
                 logger.info("Creating schedule_slots table...")
-                # Schedule slots (template schedule)
-                await conn.execute("""
-                    CREATE TABLE IF NOT EXISTS schedule_slots (
-                        id SERIAL PRIMARY KEY,
-                        date DATE NOT NULL,
-                        start_time TIME NOT NULL,
-                        end_time TIME NOT NULL,
-                        address TEXT,
-                        location_latitude REAL,
-                        location_longitude REAL,
-                        required_employees INTEGER DEFAULT 1,
-                        is_open BOOLEAN DEFAULT TRUE,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                """)
+                # Schedule slots (template schedule), partitioned by month.
+                # Databases created before partitioning keep their plain table
+                # until "python main.py migrate-partitions" is run
+                await self._create_schedule_slots_table(conn)
+                # Day and date range lookups, already in display order
+                await conn.execute(
+                    "CREATE INDEX IF NOT EXISTS schedule_slots_date_idx ON schedule_slots (date, start_time)"
+                )
                 logger.info("Schedule_slots table created/verified")
                 
                 logger.info("Adding columns to schedule_slots if needed...")
@@ -99,11 +408,19 @@ class Database:
                 logger.info("Columns added/verified")
                 
                 logger.info("Creating shifts table...")
-                # Shifts (assigned employees to slots)
+                # Shifts (assigned employees to slots), partitioned like slots
+                await self._create_shifts_table(conn)
+                # Slot deletes cascade through this lookup
+                await conn.execute("CREATE INDEX IF NOT EXISTS shifts_slot_id_idx ON shifts (slot_id, date)")
+                # An employee's shifts in a period (schedule, salary)
+                await conn.execute("CREATE INDEX IF NOT EXISTS shifts_employee_date_idx ON shifts (employee_id, date)")
+                logger.info("Shifts table created/verified")
+                
+                logger.info("Creating free_time_slots table...")
+                # Free time slots (employee availability)
                 await conn.execute("""
-                    CREATE TABLE IF NOT EXISTS shifts (
+                    CREATE TABLE IF NOT EXISTS free_time_slots (
                         id SERIAL PRIMARY KEY,
-                        slot_id INTEGER REFERENCES schedule_slots(id) ON DELETE CASCADE,
                         employee_id BIGINT REFERENCES users(user_id) ON DELETE CASCADE,
                         date DATE NOT NULL,
                         start_time TIME NOT NULL,
@@ -111,21 +428,244 @@ class Database:
                         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                     )
                 """)
-                logger.info("Shifts table created/verified")
-                
-                logger.info("Creating free_time_slots table...")
-                # Free time slots (employee availability)
+                logger.info("Free_time_slots table created/verified")
+
+                logger.info("Adding period ranges and overlap constraints...")
+                # Time ranges for index-assisted overlap (&&) lookups
+                for table in ('schedule_slots', 'shifts', 'free_time_slots'):
+                    await conn.execute(f"""
+                        ALTER TABLE {table} ADD COLUMN IF NOT EXISTS period tsrange
+                        GENERATED ALWAYS AS ({PERIOD_COLUMN_SQL}) STORED
+                    """)
                 await conn.execute("""
-                    CREATE TABLE IF NOT EXISTS free_time_slots (
-                        id SERIAL PRIMARY KEY,
+                    CREATE INDEX IF NOT EXISTS free_time_slots_period_idx
+                    ON free_time_slots USING gist (employee_id, period)
+                """)
+                # No employee can hold two overlapping shifts; the constraint's
+                # index also serves the shift overlap lookups. Partitioned
+                # shifts get it per partition (see ensure_month_partitions),
+                # which misses an overnight shift overlapping the next month:
+                # assignments also check the neighbouring days under
+                # EMPLOYEE_LOCK_SQL
+                await conn.execute("""
+                    DO $$
+                    BEGIN
+                        IF NOT EXISTS (
+                            SELECT 1 FROM pg_constraint WHERE conname = 'shifts_no_overlap'
+                        ) AND (SELECT relkind FROM pg_class WHERE oid = 'shifts'::regclass) = 'r' THEN
+                            ALTER TABLE shifts ADD CONSTRAINT shifts_no_overlap
+                            EXCLUDE USING gist (employee_id WITH =, period WITH &&);
+                        END IF;
+                    EXCEPTION
+                        WHEN exclusion_violation THEN
+                            RAISE WARNING 'shifts_no_overlap not added: existing shifts overlap';
+                    END $$;
+                """)
+                logger.info("Period ranges and overlap constraints created/verified")
+
+                logger.info("Creating monthly partitions...")
+                # Creates the month's slot and shift partitions if missing;
+                # does nothing for unpartitioned tables
+                await conn.execute("""
+                    CREATE OR REPLACE FUNCTION ensure_month_partitions(day DATE) RETURNS void AS $$
+                    DECLARE
+                        m DATE := date_trunc('month', day)::date;
+                        suffix TEXT := to_char(date_trunc('month', day), 'YYYY_MM');
+                        -- Partitions go next to their parents, whatever else is on the search_path
+                        schema TEXT;
+                    BEGIN
+                        IF (SELECT relkind FROM pg_class WHERE oid = 'shifts'::regclass) <> 'p' THEN
+                            RETURN;
+                        END IF;
+                        SELECT n.nspname INTO schema
+                        FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+                        WHERE c.oid = 'shifts'::regclass;
+                        IF to_regclass(format('%I.%I', schema, 'schedule_slots_p' || suffix)) IS NULL THEN
+                            EXECUTE format(
+                                'CREATE TABLE %I.%I PARTITION OF %I.schedule_slots FOR VALUES FROM (%L) TO (%L)',
+                                schema, 'schedule_slots_p' || suffix, schema, m, (m + INTERVAL '1 month')::date);
+                        END IF;
+                        IF to_regclass(format('%I.%I', schema, 'shifts_p' || suffix)) IS NULL THEN
+                            EXECUTE format(
+                                'CREATE TABLE %I.%I PARTITION OF %I.shifts FOR VALUES FROM (%L) TO (%L)',
+                                schema, 'shifts_p' || suffix, schema, m, (m + INTERVAL '1 month')::date);
+                            EXECUTE format(
+                                'ALTER TABLE %I.%I ADD CONSTRAINT %I EXCLUDE USING gist (employee_id WITH =, period WITH &&)',
+                                schema, 'shifts_p' || suffix, 'shifts_p' || suffix || '_no_overlap');
+                        END IF;
+                    EXCEPTION
+                        -- Created concurrently by another session
+                        WHEN duplicate_table OR unique_violation THEN NULL;
+                    END;
+                    $$ LANGUAGE plpgsql
+                """)
+                await self._ensure_partitions_ahead(conn)
+                if await conn.fetchval("SELECT relkind::text FROM pg_class WHERE oid = 'shifts'::regclass") != 'p':
+                    logger.warning("schedule_slots and shifts are not partitioned, "
+                                   "run 'python main.py migrate-partitions' to convert them")
+                logger.info("Monthly partitions created/verified")
+
+                logger.info("Creating free_time_bitmaps table...")
+                # Per employee and day: 96 bits, one per 15 minutes fully
+                # covered by free time (bit 0 is 00:00-00:15)
+                await conn.execute("""
+                    CREATE TABLE IF NOT EXISTS free_time_bitmaps (
+                        employee_id BIGINT REFERENCES users(user_id) ON DELETE CASCADE,
+                        date DATE NOT NULL,
+                        bits BIT(96) NOT NULL,
+                        PRIMARY KEY (employee_id, date)
+                    )
+                """)
+                await conn.execute("""
+                    CREATE OR REPLACE FUNCTION free_time_bitmap(emp BIGINT, day DATE) RETURNS BIT(96) AS $$
+                        SELECT string_agg(
+                            CASE WHEN EXISTS (
+                                SELECT 1 FROM free_time_slots ft
+                                WHERE ft.employee_id = emp
+                                AND ft.period @> tsrange(day + q * INTERVAL '15 minutes',
+                                                         day + (q + 1) * INTERVAL '15 minutes')
+                            ) THEN '1' ELSE '0' END, '' ORDER BY q
+                        )::BIT(96)
+                        FROM generate_series(0, 95) AS q
+                    $$ LANGUAGE sql STABLE
+                """)
+                await conn.execute("""
+                    CREATE OR REPLACE FUNCTION refresh_free_time_bitmaps() RETURNS trigger AS $$
+                    DECLARE
+                        r RECORD;
+                        b BIT(96);
+                    BEGIN
+                        IF COALESCE(current_setting('bot.skip_free_time_bitmaps', true), '') = 'on' THEN
+                            RETURN NULL;
+                        END IF;
+                        FOR r IN
+                            SELECT DISTINCT c.employee_id, d::date AS day
+                            FROM (
+                                SELECT OLD.employee_id, OLD.period WHERE TG_OP IN ('UPDATE', 'DELETE')
+                                UNION ALL
+                                SELECT NEW.employee_id, NEW.period WHERE TG_OP IN ('INSERT', 'UPDATE')
+                            ) AS c(employee_id, period),
+                            generate_series(lower(c.period)::date,
+                                            (upper(c.period) - INTERVAL '1 microsecond')::date,
+                                            INTERVAL '1 day') AS d
+                        LOOP
+                            b := free_time_bitmap(r.employee_id, r.day);
+                            IF b = B'0'::BIT(96) THEN
+                                DELETE FROM free_time_bitmaps
+                                WHERE employee_id = r.employee_id AND date = r.day;
+                            ELSE
+                                INSERT INTO free_time_bitmaps (employee_id, date, bits)
+                                VALUES (r.employee_id, r.day, b)
+                                ON CONFLICT (employee_id, date) DO UPDATE SET bits = EXCLUDED.bits;
+                            END IF;
+                        END LOOP;
+                        RETURN NULL;
+                    END;
+                    $$ LANGUAGE plpgsql
+                """)
+                await conn.execute("""
+                    CREATE OR REPLACE TRIGGER free_time_slots_refresh_bitmaps
+                    AFTER INSERT OR UPDATE OR DELETE ON free_time_slots
+                    FOR EACH ROW EXECUTE FUNCTION refresh_free_time_bitmaps()
+                """)
+                # Backfill databases that had free time before the bitmaps
+                await conn.execute(FREE_TIME_BITMAPS_BACKFILL_SQL)
+                logger.info("Free_time_bitmaps table created/verified")
+
+                logger.info("Creating payroll snapshot tables...")
+                # Payroll snapshots: closed months aggregated once per employee
+                await conn.execute("""
+                    CREATE TABLE IF NOT EXISTS payroll_closed_periods (
+                        period_start DATE PRIMARY KEY,
+                        computed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
+                await conn.execute("""
+                    CREATE TABLE IF NOT EXISTS payroll_periods (
                         employee_id BIGINT REFERENCES users(user_id) ON DELETE CASCADE,
+                        period_start DATE REFERENCES payroll_closed_periods(period_start) ON DELETE CASCADE,
+                        shift_count INTEGER NOT NULL,
+                        seconds DOUBLE PRECISION NOT NULL,
+                        PRIMARY KEY (employee_id, period_start)
+                    )
+                """)
+                # Held by a month's snapshot computation and by edits of its
+                # shifts until they commit, so neither misses the other
+                await conn.execute("""
+                    CREATE OR REPLACE FUNCTION lock_payroll_month(day DATE) RETURNS void AS $$
+                        SELECT pg_advisory_xact_lock(
+                            hashtext('payroll_closed_periods'),
+                            (EXTRACT(YEAR FROM day) * 12 + EXTRACT(MONTH FROM day))::int
+                        )
+                    $$ LANGUAGE sql
+                """)
+                # Any late edit of a shift in a closed month drops that month's
+                # snapshot; it is recomputed on the next read. Edits of the
+                # current month only lock on its last day (the app's clock
+                # may already be in the next month)
+                await conn.execute("""
+                    CREATE OR REPLACE FUNCTION invalidate_payroll_snapshot() RETURNS trigger AS $$
+                    BEGIN
+                        IF COALESCE(current_setting('bot.skip_payroll_invalidation', true), '') = 'on' THEN
+                            RETURN NULL;
+                        END IF;
+                        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                            IF OLD.date < date_trunc('month', CURRENT_DATE + 1) THEN
+                                PERFORM lock_payroll_month(OLD.date);
+                            END IF;
+                            DELETE FROM payroll_closed_periods
+                            WHERE period_start = date_trunc('month', OLD.date)::date;
+                        END IF;
+                        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                            IF NEW.date < date_trunc('month', CURRENT_DATE + 1) THEN
+                                PERFORM lock_payroll_month(NEW.date);
+                            END IF;
+                            DELETE FROM payroll_closed_periods
+                            WHERE period_start = date_trunc('month', NEW.date)::date;
+                        END IF;
+                        RETURN NULL;
+                    END;
+                    $$ LANGUAGE plpgsql
+                """)
+                await conn.execute("""
+                    CREATE OR REPLACE TRIGGER shifts_invalidate_payroll
+                    AFTER INSERT OR UPDATE OR DELETE ON shifts
+                    FOR EACH ROW EXECUTE FUNCTION invalidate_payroll_snapshot()
+                """)
+                logger.info("Payroll snapshot tables created/verified")
+
+                logger.info("Creating archive tables...")
+                # Old slots and shifts moved out of the live tables by maintenance
+                await conn.execute("""
+                    CREATE TABLE IF NOT EXISTS schedule_slots_archive (
+                        id INTEGER PRIMARY KEY,
                         date DATE NOT NULL,
                         start_time TIME NOT NULL,
                         end_time TIME NOT NULL,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                        address TEXT,
+                        location_latitude REAL,
+                        location_longitude REAL,
+                        required_employees INTEGER,
+                        is_open BOOLEAN,
+                        created_at TIMESTAMP,
+                        archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                     )
                 """)
-                logger.info("Free_time_slots table created/verified")
+                await conn.execute("""
+                    CREATE TABLE IF NOT EXISTS shifts_archive (
+                        id INTEGER PRIMARY KEY,
+                        slot_id INTEGER,
+                        employee_id BIGINT,
+                        date DATE NOT NULL,
+                        start_time TIME NOT NULL,
+                        end_time TIME NOT NULL,
+                        created_at TIMESTAMP,
+                        archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
+                await conn.execute("CREATE INDEX IF NOT EXISTS shifts_archive_date_idx ON shifts_archive (date)")
+                await conn.execute("CREATE INDEX IF NOT EXISTS free_time_slots_date_idx ON free_time_slots (date)")
+                logger.info("Archive tables created/verified")
                 logger.info("Database schema initialization completed successfully")
         except Exception as e:
             logger.error(f"Error initializing database schema: {e}", exc_info=True)
@@ -190,6 +730,8 @@ class Database:
                              full_name = EXCLUDED.full_name,
                              is_admin = EXCLUDED.is_admin
             """, user_id, username, full_name, is_admin)
+            # The team grid shows names and leaves admins out
+            self._free_time_changed()
 
     async def update_employee_name(self, user_id: int, full_name: str):
         """Update user's full name (works for both employees and admins)"""
@@ -200,9 +742,11 @@ class Database:
                 SET full_name = $1 
                 WHERE user_id = $2
             """, full_name, user_id)
+            self._free_time_changed()
             if result == "UPDATE 0":
                 raise ValueError("Пользователь не найден")
 
+    @coalesced
     async def get_all_users_for_editing(self) -> List[Tuple[int, str]]:
         """Get all users (employees and admins) for name editing"""
         self._ensure_pool()
@@ -236,12 +780,14 @@ class Database:
                 result.append((user_id, display_name))
             return result
 
+    @coalesced
     async def is_admin(self, user_id: int) -> bool:
         self._ensure_pool()
         async with self._pool.acquire() as conn:
             row = await conn.fetchrow("SELECT is_admin FROM users WHERE user_id = $1", user_id)
             return row and row['is_admin'] is True
 
+    @coalesced
     async def get_all_employees(self) -> List[Tuple[int, str]]:
         import logging
         import sys
@@ -295,7 +841,8 @@ class Database:
             logger.critical(final_msg)
             return result
 
-    async def get_all_users(self) -> List[Dict]:
+    @coalesced
+    async def get_all_users(self) -> List[User]:
         self._ensure_pool()
         async with self._pool.acquire() as conn:
             rows = await conn.fetch("""
@@ -303,9 +850,10 @@ class Database:
                 FROM users 
                 ORDER BY full_name, username
             """)
-            return [dict(row) for row in rows]
+            return [User.from_record(row) for row in rows]
 
-    async def get_user_by_id(self, user_id: int) -> Optional[Dict]:
+    @coalesced
+    async def get_user_by_id(self, user_id: int) -> Optional[User]:
         self._ensure_pool()
         async with self._pool.acquire() as conn:
             row = await conn.fetchrow("""
@@ -313,7 +861,7 @@ class Database:
                 FROM users 
                 WHERE user_id = $1
             """, user_id)
-            return dict(row) if row else None
+            return User.from_record(row) if row else None
 
     async def remove_user(self, user_id: int):
         """Remove user and all their shifts (CASCADE will handle shifts deletion)"""
@@ -338,6 +886,7 @@ class Database:
                 DELETE FROM users 
                 WHERE user_id = $1
             """, user_id)
+            self._free_time_changed()
             
             if result == "DELETE 0":
                 raise ValueError("Не удалось удалить пользователя")
@@ -350,58 +899,48 @@ class Database:
                 SET is_admin = $1 
                 WHERE user_id = $2
             """, is_admin, user_id)
+            self._free_time_changed()
             if result == "UPDATE 0":
                 raise ValueError("Пользователь не найден")
 
-    async def add_schedule_slot(self, date_str: str, start_time: str, end_time: str, 
+    async def add_schedule_slot(self, slot_date: date, start_time: time, end_time: time, 
                                 address: str = None, location_latitude: float = None, 
                                 location_longitude: float = None, required_employees: int = 1,
                                 is_open: bool = True) -> int:
+        check_time_range(start_time, end_time)
         self._ensure_pool()
-        # Convert strings to date and time objects for asyncpg
-        date_obj = datetime.strptime(date_str, "%Y-%m-%d").date()
-        # Parse time strings (format: HH:MM or HH:MM:SS)
-        try:
-            start_time_obj = datetime.strptime(start_time, "%H:%M").time()
-        except ValueError:
-            start_time_obj = datetime.strptime(start_time, "%H:%M:%S").time()
-        try:
-            end_time_obj = datetime.strptime(end_time, "%H:%M").time()
-        except ValueError:
-            end_time_obj = datetime.strptime(end_time, "%H:%M:%S").time()
-        
         async with self._pool.acquire() as conn:
+            await self._ensure_month_partition(conn, slot_date)
             row = await conn.fetchrow("""
                 INSERT INTO schedule_slots (date, start_time, end_time, address, location_latitude, location_longitude, required_employees, is_open)
                 VALUES ($1, $2, $3, $4, $5, $6, $7, $8)
                 RETURNING id
-            """, date_obj, start_time_obj, end_time_obj, address, location_latitude, location_longitude, required_employees, is_open)
+            """, slot_date, start_time, end_time, address, location_latitude, location_longitude, required_employees, is_open)
             return row['id']
 
-    async def delete_schedule_slot(self, slot_id: int):
+    async def delete_schedule_slot(self, slot_id: int, slot_date: date):
+        """Delete a slot; its date selects the partition"""
         self._ensure_pool()
         async with self._pool.acquire() as conn:
-            await conn.execute("DELETE FROM schedule_slots WHERE id = $1", slot_id)
+            await conn.execute("DELETE FROM schedule_slots WHERE id = $1 AND date = $2", slot_id, slot_date)
             # CASCADE will handle shifts deletion
 
-    async def get_schedule_slots_by_date(self, date_str: str) -> List[Dict]:
+    @coalesced
+    async def get_schedule_slots_by_date(self, slot_date: date) -> List[Slot]:
         self._ensure_pool()
-        # Convert string to date object for asyncpg
-        date_obj = datetime.strptime(date_str, "%Y-%m-%d").date()
         async with self._pool.acquire() as conn:
             rows = await conn.fetch("""
                 SELECT id, date, start_time, end_time, address, location_latitude, location_longitude, required_employees, is_open
                 FROM schedule_slots
                 WHERE date = $1
                 ORDER BY start_time
-            """, date_obj)
-            return [dict(row) for row in rows]
+            """, slot_date)
+            return [Slot.from_record(row) for row in rows]
 
-    async def get_schedule_slots_by_range(self, start_date: str, end_date: str, employee_id: Optional[int] = None, only_open: bool = False, exclude_employee_id: Optional[int] = None) -> List[Dict]:
+    @coalesced
+    async def get_schedule_slots_by_range(self, start_date: date, end_date: date, employee_id: Optional[int] = None, only_open: bool = False, exclude_employee_id: Optional[int] = None, raw: bool = False) -> List[Slot]:
+        """Get slots in a date range; raw=True returns the asyncpg Records as-is for read-only use"""
         self._ensure_pool()
-        # Convert strings to date objects for asyncpg
-        start_date_obj = datetime.strptime(start_date, "%Y-%m-%d").date()
-        end_date_obj = datetime.strptime(end_date, "%Y-%m-%d").date()
         async with self._pool.acquire() as conn:
             if employee_id:
                 rows = await conn.fetch("""
@@ -409,11 +948,12 @@ class Database:
                            s.location_latitude, s.location_longitude, s.required_employees, s.is_open,
                            sh.employee_id, u.full_name
                     FROM schedule_slots s
-                    LEFT JOIN shifts sh ON s.id = sh.slot_id AND sh.employee_id = $1
+                    LEFT JOIN shifts sh ON s.id = sh.slot_id AND sh.date = s.date AND sh.employee_id = $1
+                        AND sh.date BETWEEN $2 AND $3
                     LEFT JOIN users u ON sh.employee_id = u.user_id
                     WHERE s.date BETWEEN $2 AND $3
                     ORDER BY s.date, s.start_time
-                """, employee_id, start_date_obj, end_date_obj)
+                """, employee_id, start_date, end_date)
             else:
                 if only_open:
                     # Get open slots that have available space (not fully booked)
@@ -428,15 +968,16 @@ class Database:
                             AND (
                                 SELECT COUNT(*) 
                                 FROM shifts sh 
-                                WHERE sh.slot_id = s.id
+                                WHERE sh.slot_id = s.id AND sh.date = s.date AND sh.date BETWEEN $1 AND $2
                             ) < s.required_employees
                             AND NOT EXISTS (
                                 SELECT 1 
                                 FROM shifts sh 
-                                WHERE sh.slot_id = s.id AND sh.employee_id = $3
+                                WHERE sh.slot_id = s.id AND sh.date = s.date AND sh.employee_id = $3
+                                AND sh.date BETWEEN $1 AND $2
                             )
                             ORDER BY s.date, s.start_time
-                        """, start_date_obj, end_date_obj, exclude_employee_id)
+                        """, start_date, end_date, exclude_employee_id)
                     else:
                         rows = await conn.fetch("""
                             SELECT s.id, s.date, s.start_time, s.end_time, s.address,
@@ -447,45 +988,49 @@ class Database:
                             AND (
                                 SELECT COUNT(*) 
                                 FROM shifts sh 
-                                WHERE sh.slot_id = s.id
+                                WHERE sh.slot_id = s.id AND sh.date = s.date AND sh.date BETWEEN $1 AND $2
                             ) < s.required_employees
                             ORDER BY s.date, s.start_time
-                        """, start_date_obj, end_date_obj)
+                        """, start_date, end_date)
                 else:
                     rows = await conn.fetch("""
                         SELECT s.id, s.date, s.start_time, s.end_time, s.address,
                                s.location_latitude, s.location_longitude, s.required_employees, s.is_open,
                                sh.employee_id, u.full_name
                         FROM schedule_slots s
-                        LEFT JOIN shifts sh ON s.id = sh.slot_id
+                        LEFT JOIN shifts sh ON s.id = sh.slot_id AND sh.date = s.date AND sh.date BETWEEN $1 AND $2
                         LEFT JOIN users u ON sh.employee_id = u.user_id
                         WHERE s.date BETWEEN $1 AND $2
                         ORDER BY s.date, s.start_time
-                    """, start_date_obj, end_date_obj)
-            return [dict(row) for row in rows]
+                    """, start_date, end_date)
+            if raw:
+                return rows
+            return [Slot.from_record(row) for row in rows]
 
-    async def update_slot_open_status(self, slot_id: int, is_open: bool):
+    async def update_slot_open_status(self, slot_id: int, slot_date: date, is_open: bool):
         """Update slot open status"""
         self._ensure_pool()
         async with self._pool.acquire() as conn:
             await conn.execute("""
                 UPDATE schedule_slots 
                 SET is_open = $1 
-                WHERE id = $2
-            """, is_open, slot_id)
+                WHERE id = $2 AND date = $3
+            """, is_open, slot_id, slot_date)
     
-    async def get_slot_assigned_count(self, slot_id: int) -> int:
+    @coalesced
+    async def get_slot_assigned_count(self, slot_id: int, slot_date: date) -> int:
         """Get count of employees assigned to a slot"""
         self._ensure_pool()
         async with self._pool.acquire() as conn:
             row = await conn.fetchrow("""
                 SELECT COUNT(*) as count
                 FROM shifts
-                WHERE slot_id = $1
-            """, slot_id)
+                WHERE slot_id = $1 AND date = $2
+            """, slot_id, slot_date)
             return row['count'] if row else 0
     
-    async def get_slot_by_id(self, slot_id: int) -> Optional[Dict]:
+    @coalesced
+    async def get_slot_by_id(self, slot_id: int, slot_date: date) -> Optional[Slot]:
         """Get slot information by ID"""
         self._ensure_pool()
         async with self._pool.acquire() as conn:
@@ -493,9 +1038,9 @@ class Database:
                 SELECT id, date, start_time, end_time, address,
                        location_latitude, location_longitude, required_employees, is_open
                 FROM schedule_slots
-                WHERE id = $1
-            """, slot_id)
-            return dict(row) if row else None
+                WHERE id = $1 AND date = $2
+            """, slot_id, slot_date)
+            return Slot.from_record(row) if row else None
     
     async def get_user_display_name(self, user_id: int) -> str:
         """Get user display name"""
@@ -508,132 +1053,314 @@ class Database:
             return f"@{user['username']}"
         return f"User {user_id}"
     
-    async def assign_shift(self, slot_id: int, employee_id: int):
+    async def _in_transaction_retrying(self, work: Callable[[asyncpg.Connection], Awaitable]):
+        """Run work(conn) in a transaction, again after a deadlock or serialization failure"""
+        for attempt in range(1, CONFLICT_ATTEMPTS + 1):
+            try:
+                async with self._pool.acquire() as conn:
+                    async with conn.transaction():
+                        return await work(conn)
+            except CONFLICT_ERRORS:
+                if attempt == CONFLICT_ATTEMPTS:
+                    raise ValueError("Расписание одновременно изменили, попробуйте еще раз") from None
+
+    async def assign_shift(self, slot_id: int, slot_date: date, employee_id: int):
+        """Assign an employee to a slot; the slot's date selects its partition"""
         self._ensure_pool()
+
+        async def assign(conn: asyncpg.Connection):
+            # Lock the slot first, like assign_shifts_bulk, so the two can't
+            # deadlock and concurrent assignments can't overfill it
+            slot = await conn.fetchrow("""
+                SELECT date, start_time, end_time, required_employees, period
+                FROM schedule_slots 
+                WHERE id = $1 AND date = $2
+                FOR UPDATE
+            """, slot_id, slot_date)
+            if not slot:
+                return
+
+            await conn.execute(EMPLOYEE_LOCK_SQL, [employee_id])
+            # Check if employee already has a shift at this time
+            existing = await conn.fetchrow("""
+                SELECT id FROM shifts
+                WHERE employee_id = $1 AND period && $2
+                AND date BETWEEN $3::date - 1 AND $3::date + 1
+            """, employee_id, slot['period'], slot['date'])
+            
+            if existing:
+                raise ValueError("Employee already has a shift at this time")
+            
+            # Check if slot is already fully booked
+            assigned_count = await conn.fetchval("""
+                SELECT COUNT(*) 
+                FROM shifts 
+                WHERE slot_id = $1 AND date = $2
+            """, slot_id, slot['date'])
+            
+            required = slot['required_employees']
+            if assigned_count >= required:
+                raise ValueError(f"Слот уже полностью заполнен. Требуется {required} сотрудник(ов), уже назначено {assigned_count}.")
+            
+            try:
+                await conn.execute("""
+                    INSERT INTO shifts (slot_id, employee_id, date, start_time, end_time)
+                    VALUES ($1, $2, $3, $4, $5)
+                """, slot_id, employee_id, slot['date'], slot['start_time'], slot['end_time'])
+            except asyncpg.exceptions.ExclusionViolationError:
+                # A concurrent assignment won the race
+                raise ValueError("Employee already has a shift at this time") from None
+            
+            # Remove overlapping free time slots for this employee
+            await conn.execute("""
+                DELETE FROM free_time_slots
+                WHERE employee_id = $1 AND period && $2
+            """, employee_id, slot['period'])
+            
+            # Slot is fully booked with this shift, close it
+            if assigned_count + 1 >= required:
+                await conn.execute("""
+                    UPDATE schedule_slots 
+                    SET is_open = FALSE 
+                    WHERE id = $1 AND date = $2
+                """, slot_id, slot['date'])
+
+        await self._in_transaction_retrying(assign)
+        self._free_time_changed()
+
+    async def assign_shifts_bulk(self, assignments: List[Tuple[int, date, int]]) -> int:
+        """Assign (slot_id, slot_date, employee_id) triples in one transaction, all or nothing.
+
+        Same rules as assign_shift: slots can't be overfilled, employees can't
+        get overlapping shifts, their overlapping free time is removed and
+        slots that become full are closed. Returns the number of shifts created.
+        """
+        if not assignments:
+            return 0
+        slot_ids = [slot_id for slot_id, _, _ in assignments]
+        slot_dates = [slot_date for _, slot_date, _ in assignments]
+        employee_ids = [employee_id for _, _, employee_id in assignments]
+        # Constant date bounds let the planner prune partitions; the joins on
+        # a.slot_date alone only prune at run time
+        dates = sorted(set(slot_dates))
+        self._ensure_pool()
+
+        async def assign(conn: asyncpg.Connection):
+            # Lock the slots (in id order, before the employees, like
+            # assign_shift) so concurrent assignments can't overfill them
+            await conn.execute("""
+                SELECT 1 FROM schedule_slots
+                WHERE id = ANY($1::int[]) AND date = ANY($2::date[])
+                ORDER BY id
+                FOR UPDATE
+            """, slot_ids, dates)
+            # Counted after the lock: a subquery of the locking statement would
+            # still see the shifts from before a concurrent assignment committed
+            slots = await conn.fetch("""
+                SELECT s.id, s.required_employees,
+                       (SELECT COUNT(*) FROM shifts sh
+                        WHERE sh.slot_id = s.id AND sh.date = s.date AND sh.date = ANY($2::date[])) AS assigned
+                FROM schedule_slots s
+                WHERE s.id = ANY($1::int[]) AND s.date = ANY($2::date[])
+            """, slot_ids, dates)
+            requested: Dict[int, int] = {}
+            for slot_id in slot_ids:
+                requested[slot_id] = requested.get(slot_id, 0) + 1
+            for slot in slots:
+                if slot['assigned'] + requested[slot['id']] > slot['required_employees']:
+                    raise ValueError(
+                        f"Слот {slot['id']} уже заполнен. Требуется {slot['required_employees']} "
+                        f"сотрудник(ов), уже назначено {slot['assigned']}."
+                    )
+            if len(slots) != len(requested):
+                raise ValueError("Слот не найден")
+
+            # Against existing shifts and within the batch; the exclusion
+            # constraint alone misses overlaps across a month boundary
+            await conn.execute(EMPLOYEE_LOCK_SQL, sorted(set(employee_ids)))
+            overlapping = await conn.fetchval("""
+                WITH a AS (
+                    SELECT a.n, a.employee_id, s.date, s.period
+                    FROM unnest($1::int[], $2::date[], $3::bigint[]) WITH ORDINALITY AS a(slot_id, slot_date, employee_id, n)
+                    JOIN schedule_slots s ON s.id = a.slot_id AND s.date = a.slot_date AND s.date = ANY($4::date[])
+                )
+                SELECT EXISTS (
+                    SELECT 1 FROM a
+                    JOIN shifts sh ON sh.employee_id = a.employee_id AND sh.period && a.period
+                        AND sh.date BETWEEN a.date - 1 AND a.date + 1
+                        AND sh.date BETWEEN $5::date - 1 AND $6::date + 1
+                ) OR EXISTS (
+                    SELECT 1 FROM a x
+                    JOIN a y ON y.employee_id = x.employee_id AND y.n > x.n AND y.period && x.period
+                )
+            """, slot_ids, slot_dates, employee_ids, dates, dates[0], dates[-1])
+            if overlapping:
+                raise ValueError("Employee already has a shift at this time")
+
+            try:
+                await conn.execute("""
+                    INSERT INTO shifts (slot_id, employee_id, date, start_time, end_time)
+                    SELECT s.id, a.employee_id, s.date, s.start_time, s.end_time
+                    FROM unnest($1::int[], $2::date[], $3::bigint[]) AS a(slot_id, slot_date, employee_id)
+                    JOIN schedule_slots s ON s.id = a.slot_id AND s.date = a.slot_date AND s.date = ANY($4::date[])
+                """, slot_ids, slot_dates, employee_ids, dates)
+            except asyncpg.exceptions.ExclusionViolationError:
+                raise ValueError("Employee already has a shift at this time") from None
+
+            await conn.execute("""
+                DELETE FROM free_time_slots ft
+                USING unnest($1::int[], $2::date[], $3::bigint[]) AS a(slot_id, slot_date, employee_id), schedule_slots s
+                WHERE s.id = a.slot_id AND s.date = a.slot_date AND s.date = ANY($4::date[])
+                AND ft.employee_id = a.employee_id
+                AND ft.period && s.period
+            """, slot_ids, slot_dates, employee_ids, dates)
+
+            await conn.execute("""
+                UPDATE schedule_slots s
+                SET is_open = FALSE
+                WHERE s.id = ANY($1::int[]) AND s.date = ANY($2::date[])
+                AND (SELECT COUNT(*) FROM shifts sh
+                     WHERE sh.slot_id = s.id AND sh.date = s.date AND sh.date = ANY($2::date[])) >= s.required_employees
+            """, slot_ids, dates)
+
+        await self._in_transaction_retrying(assign)
+        self._free_time_changed()
+        return len(assignments)
+
+    async def get_autoschedule_data(self, start_date: date, end_date: date) -> Tuple[List[asyncpg.Record], List[asyncpg.Record], List[asyncpg.Record]]:
+        """Get (open slots, shifts, free time) for auto-scheduling a period.
+
+        Slots are open ones with places left (id, date, start_time, end_time,
+        address, period, missing); shifts and free time are (employee_id,
+        period) rows of non-admin employees around the period. Read-only Records.
+        """
+        self._ensure_pool()
+        window = "tsrange(($1::date - 1)::timestamp, ($2::date + 2)::timestamp)"
         async with self._pool.acquire() as conn:
-            async with conn.transaction():
-                # Get slot info including required_employees
-                slot = await conn.fetchrow("""
-                    SELECT date, start_time, end_time, required_employees
-                    FROM schedule_slots 
-                    WHERE id = $1
-                """, slot_id)
-                
-                if slot:
-                    # Check if employee already has a shift at this time
-                    existing = await conn.fetchrow("""
-                        SELECT id FROM shifts
-                        WHERE employee_id = $1 AND date = $2 AND
-                        ((start_time <= $3 AND end_time > $3) OR (start_time < $4 AND end_time >= $4))
-                    """, employee_id, slot['date'], slot['start_time'], slot['end_time'])
-                    
-                    if existing:
-                        raise ValueError("Employee already has a shift at this time")
-                    
-                    # Check if slot is already fully booked
-                    assigned_count = await conn.fetchval("""
-                        SELECT COUNT(*) 
-                        FROM shifts 
-                        WHERE slot_id = $1
-                    """, slot_id)
-                    
-                    slot_info = await conn.fetchrow("""
-                        SELECT required_employees
-                        FROM schedule_slots 
-                        WHERE id = $1
-                    """, slot_id)
-                    
-                    if slot_info:
-                        required = slot_info['required_employees']
-                        if assigned_count >= required:
-                            raise ValueError(f"Слот уже полностью заполнен. Требуется {required} сотрудник(ов), уже назначено {assigned_count}.")
-                    
-                    await conn.execute("""
-                        INSERT INTO shifts (slot_id, employee_id, date, start_time, end_time)
-                        VALUES ($1, $2, $3, $4, $5)
-                    """, slot_id, employee_id, slot['date'], slot['start_time'], slot['end_time'])
-                    
-                    # Remove overlapping free time slots for this employee
-                    # Delete free time slots that overlap with the shift
-                    await conn.execute("""
-                        DELETE FROM free_time_slots
-                        WHERE employee_id = $1 
-                        AND date = $2
-                        AND start_time < $3 
-                        AND end_time > $4
-                    """, employee_id, slot['date'], slot['end_time'], slot['start_time'])
-                    
-                    # Check if slot is fully booked and close it if needed
-                    assigned_count = await conn.fetchval("""
-                        SELECT COUNT(*) 
-                        FROM shifts 
-                        WHERE slot_id = $1
-                    """, slot_id)
-                    
-                    slot_info = await conn.fetchrow("""
-                        SELECT required_employees 
-                        FROM schedule_slots 
-                        WHERE id = $1
-                    """, slot_id)
-                    
-                    if slot_info and assigned_count >= slot_info['required_employees']:
-                        # Slot is fully booked, close it
-                        await conn.execute("""
-                            UPDATE schedule_slots 
-                            SET is_open = FALSE 
-                            WHERE id = $1
-                        """, slot_id)
-
-    async def get_employee_shifts(self, employee_id: int, start_date: str, end_date: str) -> List[Dict]:
-        """Get employee shifts with slot details"""
-        self._ensure_pool()
-        # Convert strings to date objects for asyncpg
-        start_date_obj = datetime.strptime(start_date, "%Y-%m-%d").date()
-        end_date_obj = datetime.strptime(end_date, "%Y-%m-%d").date()
-        async with self._pool.acquire() as conn:
-            # Debug: check if there are any shifts for this employee
-            debug_rows = await conn.fetch("""
-                SELECT sh.id, sh.slot_id, sh.employee_id, sh.date, sh.start_time, sh.end_time
+            slots = await conn.fetch("""
+                SELECT s.id, s.date, s.start_time, s.end_time, s.address, s.period,
+                       s.required_employees - COUNT(sh.id) AS missing
+                FROM schedule_slots s
+                LEFT JOIN shifts sh ON sh.slot_id = s.id AND sh.date = s.date AND sh.date BETWEEN $1 AND $2
+                WHERE s.date BETWEEN $1 AND $2 AND s.is_open = TRUE
+                GROUP BY s.id, s.date
+                HAVING s.required_employees - COUNT(sh.id) > 0
+                ORDER BY s.date, s.start_time
+            """, start_date, end_date)
+            shifts = await conn.fetch(f"""
+                SELECT sh.employee_id, sh.period
                 FROM shifts sh
-                WHERE sh.employee_id = $1 AND sh.date BETWEEN $2 AND $3
-            """, employee_id, start_date_obj, end_date_obj)
-            import logging
-            import sys
-            logging.critical(f"DEBUG get_employee_shifts: employee_id={employee_id}, date_range={start_date}-{end_date}, raw_shifts_count={len(debug_rows)}")
-            print(f"DEBUG get_employee_shifts: employee_id={employee_id}, date_range={start_date}-{end_date}, raw_shifts_count={len(debug_rows)}", file=sys.stderr, flush=True)
-            for row in debug_rows:
-                logging.critical(f"DEBUG raw shift: {dict(row)}")
-                print(f"DEBUG raw shift: {dict(row)}", file=sys.stderr, flush=True)
-            
-            rows = await conn.fetch("""
+                JOIN users u ON u.user_id = sh.employee_id
+                WHERE u.is_admin = FALSE AND sh.period && {window}
+                AND sh.date BETWEEN $1::date - 1 AND $2::date + 1
+            """, start_date, end_date)
+            free_time = await conn.fetch(f"""
+                SELECT ft.employee_id, ft.period
+                FROM free_time_slots ft
+                JOIN users u ON u.user_id = ft.employee_id
+                WHERE u.is_admin = FALSE AND ft.period && {window}
+            """, start_date, end_date)
+            return slots, shifts, free_time
+
+    @coalesced
+    async def get_employee_shifts(self, employee_id: int, start_date: date, end_date: date, raw: bool = False,
+                                  include_archive: bool = False) -> List[Shift]:
+        """Get employee shifts with slot details; raw=True returns the asyncpg Records as-is.
+
+        include_archive=True also lists archived shifts, the same rows
+        SHIFT_HISTORY_SQL counts for payroll.
+        """
+        self._ensure_pool()
+        archived_sql = """
+            UNION ALL
+            SELECT sh.date, sh.start_time, sh.end_time,
+                   s.address, s.required_employees
+            FROM shifts_archive sh
+            LEFT JOIN schedule_slots_archive s ON sh.slot_id = s.id
+            WHERE sh.employee_id = $1 AND sh.date BETWEEN $2 AND $3
+        """ if include_archive else ""
+        async with self._pool.acquire() as conn:
+            rows = await conn.fetch(f"""
                 SELECT sh.date, sh.start_time, sh.end_time,
                        s.address, s.required_employees
                 FROM shifts sh
-                INNER JOIN schedule_slots s ON sh.slot_id = s.id
+                INNER JOIN schedule_slots s ON sh.slot_id = s.id AND s.date = sh.date AND s.date BETWEEN $2 AND $3
                 WHERE sh.employee_id = $1 AND sh.date BETWEEN $2 AND $3
-                ORDER BY sh.date, sh.start_time
-            """, employee_id, start_date_obj, end_date_obj)
-            return [dict(row) for row in rows]
+                {archived_sql}
+                ORDER BY 1, 2
+            """, employee_id, start_date, end_date)
+            if raw:
+                return rows
+            return [Shift.from_record(row) for row in rows]
 
-    async def add_free_time_slot(self, employee_id: int, date_str: str, start_time: str, end_time: str):
+    async def add_free_time_slot(self, employee_id: int, free_date: date, start_time: time, end_time: time):
+        check_time_range(start_time, end_time)
+        if end_time > start_time:
+            await self.add_free_time_slots(employee_id, free_date, [(start_time, end_time)])
+            return
+        # Overnight free time is stored as is
         self._ensure_pool()
-        # Convert strings to date and time objects for asyncpg
-        date_obj = datetime.strptime(date_str, "%Y-%m-%d").date()
-        # Parse time strings (format: HH:MM or HH:MM:SS)
-        try:
-            start_time_obj = datetime.strptime(start_time, "%H:%M").time()
-        except ValueError:
-            start_time_obj = datetime.strptime(start_time, "%H:%M:%S").time()
-        try:
-            end_time_obj = datetime.strptime(end_time, "%H:%M").time()
-        except ValueError:
-            end_time_obj = datetime.strptime(end_time, "%H:%M:%S").time()
-        
         async with self._pool.acquire() as conn:
             await conn.execute("""
                 INSERT INTO free_time_slots (employee_id, date, start_time, end_time)
                 VALUES ($1, $2, $3, $4)
-            """, employee_id, date_obj, start_time_obj, end_time_obj)
+            """, employee_id, free_date, start_time, end_time)
+            self._free_time_changed()
+
+    async def add_free_time_slots(self, employee_id: int, free_date: date, intervals: List[Tuple[time, time]]) -> List[Tuple[time, time]]:
+        """Add same-day free time intervals, merged with the employee's existing ones.
+
+        Overlapping and touching intervals of that date are coalesced into a
+        minimal set in one transaction; only rows that actually change are
+        deleted or inserted. Returns the resulting intervals of the day.
+        """
+        def minutes(value: time) -> int:
+            return value.hour * 60 + value.minute
+
+        def to_time(value: int) -> time:
+            return time(value // 60, value % 60)
+
+        for start_time, end_time in intervals:
+            check_time_range(start_time, end_time)
+        self._ensure_pool()
+        async with self._pool.acquire() as conn:
+            async with conn.transaction():
+                # Serialize free-time writes of this employee
+                await conn.execute("SELECT 1 FROM users WHERE user_id = $1 FOR UPDATE", employee_id)
+                existing = await conn.fetch("""
+                    SELECT id, start_time, end_time
+                    FROM free_time_slots
+                    WHERE employee_id = $1 AND date = $2 AND end_time > start_time
+                """, employee_id, free_date)
+
+                existing_by_interval = {
+                    (minutes(row['start_time']), minutes(row['end_time'])): row['id'] for row in existing
+                }
+                merged = merge_intervals(
+                    list(existing_by_interval) +
+                    [(minutes(start), minutes(end)) for start, end in intervals if end > start]
+                )
+                stale_ids = [row['id'] for row in existing
+                             if (minutes(row['start_time']), minutes(row['end_time'])) not in merged]
+                # Duplicate rows of one interval keep a single survivor
+                keep_ids = set(existing_by_interval.values())
+                stale_ids += [row['id'] for row in existing if row['id'] not in keep_ids]
+                new = [interval for interval in merged if interval not in existing_by_interval]
+
+                if stale_ids:
+                    await conn.execute("""
+                        DELETE FROM free_time_slots WHERE id = ANY($1::int[])
+                    """, stale_ids)
+                if new:
+                    await conn.execute("""
+                        INSERT INTO free_time_slots (employee_id, date, start_time, end_time)
+                        SELECT $1, $2, s, e
+                        FROM unnest($3::time[], $4::time[]) AS i(s, e)
+                    """, employee_id, free_date,
+                        [to_time(start) for start, _ in new], [to_time(end) for _, end in new])
+        if stale_ids or new:
+            self._free_time_changed()
+        return [(to_time(start), to_time(end)) for start, end in merged]
     
     async def delete_free_time_slot(self, free_time_id: int, employee_id: int):
         """Delete a free time slot by ID (only if it belongs to the employee)"""
@@ -643,22 +1370,29 @@ class Database:
                 DELETE FROM free_time_slots
                 WHERE id = $1 AND employee_id = $2
             """, free_time_id, employee_id)
+            self._free_time_changed()
             if result == "DELETE 0":
                 raise ValueError("Свободное время не найдено или не принадлежит вам")
     
-    async def get_employee_free_time(self, employee_id: int, start_date: str = None, end_date: str = None) -> List[Dict]:
+    @coalesced
+    async def get_employee_free_time(self, employee_id: int, start_date: Optional[date] = None, end_date: Optional[date] = None) -> List[FreeTime]:
         """Get free time slots for an employee"""
         self._ensure_pool()
         async with self._pool.acquire() as conn:
             if start_date and end_date:
-                start_date_obj = datetime.strptime(start_date, "%Y-%m-%d").date()
-                end_date_obj = datetime.strptime(end_date, "%Y-%m-%d").date()
                 rows = await conn.fetch("""
                     SELECT id, date, start_time, end_time
                     FROM free_time_slots
                     WHERE employee_id = $1 AND date BETWEEN $2 AND $3
                     ORDER BY date, start_time
-                """, employee_id, start_date_obj, end_date_obj)
+                """, employee_id, start_date, end_date)
+            elif start_date:
+                rows = await conn.fetch("""
+                    SELECT id, date, start_time, end_time
+                    FROM free_time_slots
+                    WHERE employee_id = $1 AND date >= $2
+                    ORDER BY date, start_time
+                """, employee_id, start_date)
             else:
                 # Get all free time slots for employee
                 rows = await conn.fetch("""
@@ -667,121 +1401,400 @@ class Database:
                     WHERE employee_id = $1
                     ORDER BY date, start_time
                 """, employee_id)
-            return [dict(row) for row in rows]
+            return [FreeTime.from_record(row) for row in rows]
     
-    async def remove_overlapping_free_time(self, employee_id: int, date_str: str, start_time: str, end_time: str):
+    async def _fetch_free_time_bitmaps(self, start_date: date, end_date: date) -> List[asyncpg.Record]:
+        self._ensure_pool()
+        async with self._pool.acquire() as conn:
+            return await conn.fetch("""
+                SELECT b.employee_id, b.date, b.bits, u.full_name, u.username
+                FROM free_time_bitmaps b
+                JOIN users u ON u.user_id = b.employee_id
+                WHERE u.is_admin = FALSE AND b.date BETWEEN $1 AND $2
+                ORDER BY b.date, COALESCE(NULLIF(u.full_name, ''), u.username, CAST(u.user_id AS TEXT))
+            """, start_date, end_date)
+
+    async def get_free_time_bitmaps(self, start_date: date, end_date: date) -> Dict[date, DayBitmaps]:
+        """Get free-time bitmaps of non-admin employees per day in the range"""
+        return group_by_day(await self._fetch_free_time_bitmaps(start_date, end_date))
+
+    async def get_team_availability(self, start_date: date, end_date: date) -> Tuple[Dict[date, DayBitmaps], Dict[int, str]]:
+        """Get (bitmaps per day, employee names) for the range, cached until free time changes"""
+        key = (start_date, end_date)
+        version = self._free_time_version
+        cached = self._team_availability_cache.get(key)
+        if cached and cached[0] == version:
+            return cached[1]
+
+        rows = await self._fetch_free_time_bitmaps(start_date, end_date)
+        names = {
+            row['employee_id']: row['full_name'] or row['username'] or f"User {row['employee_id']}"
+            for row in rows
+        }
+        result = (group_by_day(rows), names)
+        if len(self._team_availability_cache) >= TEAM_AVAILABILITY_CACHE_SIZE:
+            self._team_availability_cache.pop(next(iter(self._team_availability_cache)))
+        # Stored under the version read before the query, so a write that
+        # raced with it makes the entry stale right away
+        self._team_availability_cache[key] = (version, result)
+        return result
+
+    async def remove_overlapping_free_time(self, employee_id: int, shift_date: date, start_time: time, end_time: time):
         """Remove free time slots that overlap with assigned shift"""
         self._ensure_pool()
-        # Convert strings to date and time objects for asyncpg
-        date_obj = datetime.strptime(date_str, "%Y-%m-%d").date()
-        # Parse time strings
-        try:
-            start_time_obj = datetime.strptime(start_time, "%H:%M").time()
-        except ValueError:
-            start_time_obj = datetime.strptime(start_time, "%H:%M:%S").time()
-        try:
-            end_time_obj = datetime.strptime(end_time, "%H:%M").time()
-        except ValueError:
-            end_time_obj = datetime.strptime(end_time, "%H:%M:%S").time()
-        
         async with self._pool.acquire() as conn:
-            # Delete free time slots that overlap with the shift
-            # Overlap condition: free_time_start < shift_end AND free_time_end > shift_start
-            await conn.execute("""
+            await conn.execute(f"""
                 DELETE FROM free_time_slots
-                WHERE employee_id = $1 
-                AND date = $2
-                AND start_time < $3 
-                AND end_time > $4
-            """, employee_id, date_obj, end_time_obj, start_time_obj)
+                WHERE employee_id = $1
+                AND period && {period_sql('$2', '$3', '$4')}
+            """, employee_id, shift_date, start_time, end_time)
+            self._free_time_changed()
     
-    async def get_employees_with_free_time(self, date_str: str, start_time: str, end_time: str) -> List[Dict]:
-        """Get employees who have free time that overlaps with the given time slot"""
+    @coalesced
+    async def get_employees_with_free_time(self, slot_date: date, start_time: time, end_time: time) -> List[asyncpg.Record]:
+        """Get employees who have free time that overlaps with the given time slot (read-only Records)"""
         self._ensure_pool()
-        # Convert strings to date and time objects for asyncpg
-        date_obj = datetime.strptime(date_str, "%Y-%m-%d").date()
-        # Parse time strings
-        try:
-            start_time_obj = datetime.strptime(start_time, "%H:%M").time()
-        except ValueError:
-            start_time_obj = datetime.strptime(start_time, "%H:%M:%S").time()
-        try:
-            end_time_obj = datetime.strptime(end_time, "%H:%M").time()
-        except ValueError:
-            end_time_obj = datetime.strptime(end_time, "%H:%M:%S").time()
-        
         async with self._pool.acquire() as conn:
-            # Find employees with free time that overlaps with the slot
-            # Overlap condition: free_time_start < slot_end AND free_time_end > slot_start
-            rows = await conn.fetch("""
+            rows = await conn.fetch(f"""
                 SELECT DISTINCT u.user_id, u.full_name, u.username, ft.start_time as free_start, ft.end_time as free_end
                 FROM users u
                 INNER JOIN free_time_slots ft ON u.user_id = ft.employee_id
                 WHERE u.is_admin = FALSE
-                AND ft.date = $1
-                AND ft.start_time < $2 
-                AND ft.end_time > $3
+                AND ft.period && {period_sql('$1', '$2', '$3')}
+                AND ft.date BETWEEN $1::date - 1 AND $1::date + 1
                 ORDER BY u.full_name
-            """, date_obj, end_time_obj, start_time_obj)
-            return [dict(row) for row in rows]
+            """, slot_date, start_time, end_time)
+            return rows
 
-    async def get_available_employees_for_slot(self, slot_id: int) -> List[Tuple[int, str]]:
+    @coalesced
+    async def get_day_availability(self, day: date) -> Dict[int, List[Candidate]]:
+        """Rank employees for every slot of a day: slot_id -> candidates.
+
+        Loads the day's slots, the shifts and free time around them and the
+        employee list once, then computes the whole matrix in one sweep.
+        Employees with an overlapping shift are left out; the rest are ranked
+        by free-time coverage of the slot. Coverage is counted in minutes from
+        the free time rows, not the quarter-hour bitmaps, which round partial
+        quarters up to free.
+        """
         self._ensure_pool()
         async with self._pool.acquire() as conn:
-            # Get slot info
-            slot = await conn.fetchrow("""
-                SELECT date, start_time, end_time 
-                FROM schedule_slots 
-                WHERE id = $1
-            """, slot_id)
-            
-            if not slot:
-                return []
-            
-            # Get employees who don't have shifts at this time
-            rows = await conn.fetch("""
-                SELECT DISTINCT u.user_id, u.full_name
-                FROM users u
-                WHERE u.is_admin = FALSE
-                AND u.user_id NOT IN (
-                    SELECT employee_id FROM shifts
-                    WHERE date = $1 AND
-                    ((start_time <= $2 AND end_time > $2) OR (start_time < $3 AND end_time >= $3))
-                )
-                ORDER BY u.full_name
-            """, slot['date'], slot['start_time'], slot['end_time'])
-            
-            return [(row['user_id'], row['full_name'] or f"User {row['user_id']}") for row in rows]
-
-    async def calculate_salary(self, employee_id: int, start_date: str, end_date: str, rate_per_hour: float) -> Tuple[float, List[Dict]]:
-        from datetime import time as time_type
-        shifts = await self.get_employee_shifts(employee_id, start_date, end_date)
-        total_hours = 0.0
-        for shift in shifts:
-            start_time = shift['start_time']
-            end_time = shift['end_time']
-            # PostgreSQL returns time objects directly, but handle strings too
-            if isinstance(start_time, time_type):
-                start = start_time
-            elif isinstance(start_time, str):
-                try:
-                    start = datetime.strptime(start_time, "%H:%M:%S").time()
-                except ValueError:
-                    start = datetime.strptime(start_time, "%H:%M").time()
-            else:
-                start = datetime.strptime(str(start_time), "%H:%M:%S").time()
-            
-            if isinstance(end_time, time_type):
-                end = end_time
-            elif isinstance(end_time, str):
+            slot_rows = await conn.fetch("""
+                SELECT id, period FROM schedule_slots WHERE date = $1
+            """, day)
+            if not slot_rows:
+                return {}
+            # Slots of the day may run past midnight, earlier shifts may run into it
+            window = "tsrange($1::date::timestamp, ($1::date + 2)::timestamp)"
+            shift_rows = await conn.fetch(f"""
+                SELECT employee_id, period FROM shifts
+                WHERE period && {window} AND date BETWEEN $1::date - 1 AND $1::date + 1
+            """, day)
+            free_rows = await conn.fetch(f"""
+                SELECT employee_id, period FROM free_time_slots
+                WHERE period && {window} AND date BETWEEN $1::date - 1 AND $1::date + 1
+            """, day)
+            employee_rows = await conn.fetch("""
+                SELECT user_id, full_name FROM users WHERE is_admin = FALSE
+            """)
+
+        base = datetime.combine(day, time())
+        slots = {}
+        for row in slot_rows:
+            interval = range_to_interval(row['period'], base)
+            if interval:
+                slots[row['id']] = interval
+        shifts: Dict[int, list] = {}
+        for row in shift_rows:
+            interval = range_to_interval(row['period'], base)
+            if interval:
+                shifts.setdefault(row['employee_id'], []).append(interval)
+        free_time: Dict[int, list] = {}
+        for row in free_rows:
+            interval = range_to_interval(row['period'], base)
+            if interval:
+                free_time.setdefault(row['employee_id'], []).append(interval)
+        employees = {row['user_id']: row['full_name'] or f"User {row['user_id']}" for row in employee_rows}
+        return compute_availability(slots, shifts, free_time, employees)
+
+    async def get_available_employees_for_slot(self, slot_id: int, slot_date: date) -> List[Tuple[int, str]]:
+        """Employees without an overlapping shift, best free-time match first"""
+        matrix = await self.get_day_availability(slot_date)
+        return [(c.employee_id, c.name) for c in matrix.get(slot_id, [])]
+
+    # ========== MAINTENANCE ==========
+
+    async def purge_free_time_batch(self, cutoff: date, limit: int) -> int:
+        """Delete up to limit free time rows that ended before cutoff, return how many"""
+        self._ensure_pool()
+        async with self._pool.acquire() as conn:
+            async with conn.transaction():
+                # Past days' bitmaps are dropped wholesale instead of per row
+                await conn.execute("SET LOCAL bot.skip_free_time_bitmaps = 'on'")
+                result = await conn.execute("""
+                    DELETE FROM free_time_slots
+                    WHERE id IN (
+                        SELECT id FROM free_time_slots
+                        WHERE date < $1 AND upper(period) <= $1::timestamp
+                        LIMIT $2
+                        FOR UPDATE SKIP LOCKED
+                    )
+                """, cutoff, limit)
+                await conn.execute("DELETE FROM free_time_bitmaps WHERE date < $1", cutoff)
+        deleted = int(result.split()[-1])
+        if deleted:
+            self._free_time_changed()
+        return deleted
+
+    async def archive_shifts_batch(self, cutoff: date, limit: int) -> int:
+        """Move up to limit shifts dated before cutoff into shifts_archive, return how many"""
+        self._ensure_pool()
+        async with self._pool.acquire() as conn:
+            async with conn.transaction():
+                # Totals don't change (payroll reads the archive too), so keep snapshots
+                await conn.execute("SET LOCAL bot.skip_payroll_invalidation = 'on'")
+                result = await conn.execute(f"""
+                    WITH moved AS (
+                        DELETE FROM shifts
+                        WHERE id IN (
+                            SELECT id FROM shifts
+                            WHERE date < $1
+                            LIMIT $2
+                            FOR UPDATE SKIP LOCKED
+                        )
+                        RETURNING {SHIFT_COLUMNS}
+                    )
+                    INSERT INTO shifts_archive ({SHIFT_COLUMNS})
+                    SELECT * FROM moved
+                    ON CONFLICT (id) DO NOTHING
+                """, cutoff, limit)
+        return int(result.split()[-1])
+
+    async def archive_slots_batch(self, cutoff: date, limit: int) -> int:
+        """Move up to limit slots dated before cutoff without live shifts into schedule_slots_archive"""
+        self._ensure_pool()
+        async with self._pool.acquire() as conn:
+            async with conn.transaction():
+                result = await conn.execute(f"""
+                    WITH moved AS (
+                        DELETE FROM schedule_slots
+                        WHERE id IN (
+                            SELECT s.id FROM schedule_slots s
+                            WHERE s.date < $1
+                            AND NOT EXISTS (SELECT 1 FROM shifts sh WHERE sh.slot_id = s.id AND sh.date = s.date)
+                            LIMIT $2
+                            FOR UPDATE SKIP LOCKED
+                        )
+                        RETURNING {SLOT_COLUMNS}
+                    )
+                    INSERT INTO schedule_slots_archive ({SLOT_COLUMNS})
+                    SELECT * FROM moved
+                    ON CONFLICT (id) DO NOTHING
+                """, cutoff, limit)
+        return int(result.split()[-1])
+
+    async def archive_partitions_before(self, cutoff: date) -> int:
+        """Archive whole monthly partitions that end before cutoff, return how many months.
+
+        Each month is copied into the archive tables, then its shift and slot
+        partitions are detached and dropped in the same short transaction. A
+        month whose tables are busy is skipped until the next run.
+        """
+        import logging
+        logger = logging.getLogger(__name__)
+        self._ensure_pool()
+        async with self._pool.acquire() as conn:
+            names = await conn.fetch("""
+                SELECT c.relname
+                FROM pg_inherits i
+                JOIN pg_class c ON c.oid = i.inhrelid
+                WHERE i.inhparent = 'shifts'::regclass
+            """)
+            months = []
+            for row in names:
+                match = PARTITION_NAME_RE.match(row['relname'])
+                if match:
+                    month = date(int(match.group(2)), int(match.group(3)), 1)
+                    if next_month(month) <= cutoff:
+                        months.append(month)
+
+            archived = 0
+            for month in sorted(months):
+                suffix = f"p{month.year:04d}_{month.month:02d}"
                 try:
-                    end = datetime.strptime(end_time, "%H:%M:%S").time()
-                except ValueError:
-                    end = datetime.strptime(end_time, "%H:%M").time()
-            else:
-                end = datetime.strptime(str(end_time), "%H:%M:%S").time()
-            
-            hours = (datetime.combine(date.today(), end) - datetime.combine(date.today(), start)).total_seconds() / 3600
-            total_hours += hours
+                    async with conn.transaction():
+                        await conn.execute("SET LOCAL lock_timeout = '5s'")
+                        await conn.execute(f"""
+                            INSERT INTO shifts_archive ({SHIFT_COLUMNS})
+                            SELECT {SHIFT_COLUMNS} FROM "shifts_{suffix}"
+                            ON CONFLICT (id) DO NOTHING
+                        """)
+                        await conn.execute(f"""
+                            INSERT INTO schedule_slots_archive ({SLOT_COLUMNS})
+                            SELECT {SLOT_COLUMNS} FROM "schedule_slots_{suffix}"
+                            ON CONFLICT (id) DO NOTHING
+                        """)
+                        await conn.execute(f'ALTER TABLE shifts DETACH PARTITION "shifts_{suffix}"')
+                        await conn.execute(f'DROP TABLE "shifts_{suffix}"')
+                        await conn.execute(f'ALTER TABLE schedule_slots DETACH PARTITION "schedule_slots_{suffix}"')
+                        await conn.execute(f'DROP TABLE "schedule_slots_{suffix}"')
+                except asyncpg.exceptions.LockNotAvailableError:
+                    logger.warning(f"Partitions for {month:%Y-%m} are busy, archiving them later")
+                    continue
+                self._known_partitions.discard(month)
+                archived += 1
+            return archived
+
+    async def _ensure_payroll_snapshots(self, conn: asyncpg.Connection, months: List[date]):
+        """Aggregate closed months that don't have a snapshot yet"""
+        if not months:
+            return
+        missing = await conn.fetch("""
+            SELECT m::date AS period_start
+            FROM unnest($1::date[]) AS m
+            WHERE NOT EXISTS (
+                SELECT 1 FROM payroll_closed_periods p WHERE p.period_start = m
+            )
+        """, months)
+        for row in missing:
+            async with conn.transaction():
+                # A concurrent shift edit's trigger can't see our uncommitted
+                # mark; the month lock makes it wait for our commit and then
+                # remove the mark, or makes us read after its commit
+                await conn.execute("SELECT lock_payroll_month($1)", row['period_start'])
+                marked = await conn.fetchval("""
+                    INSERT INTO payroll_closed_periods (period_start) VALUES ($1)
+                    ON CONFLICT DO NOTHING
+                    RETURNING period_start
+                """, row['period_start'])
+                if marked is None:
+                    # Computed concurrently by another reader
+                    continue
+                await conn.execute(f"""
+                    INSERT INTO payroll_periods (employee_id, period_start, shift_count, seconds)
+                    SELECT sh.employee_id, $1, COUNT(*), SUM({SHIFT_SECONDS_SQL})::float8
+                    FROM {SHIFT_HISTORY_SQL} sh
+                    WHERE sh.date >= $1 AND sh.date < ($1 + INTERVAL '1 month')::date
+                    GROUP BY sh.employee_id
+                """, row['period_start'])
+
+    async def _payroll_totals_query(self, conn: asyncpg.Connection, select_sql: str, start_date: date, end_date: date, *args) -> Tuple[str, tuple]:
+        """Build select_sql over a "totals" CTE mixing snapshots and live shifts.
+
+        totals has (employee_id, shift_count, seconds) rows: one per employee
+        and closed month from payroll_periods, plus live aggregates for the
+        partial ranges around them. Extra args are bound from $6 on. Returns
+        the query and its arguments once the needed snapshots exist.
+        """
+        months, head, tail = split_period(start_date, end_date, date.today())
+        await self._ensure_payroll_snapshots(conn, months)
+        head_start, head_end = head or (None, None)
+        tail_start, tail_end = tail or (None, None)
+        return f"""
+            WITH totals AS (
+                SELECT employee_id, shift_count, seconds
+                FROM payroll_periods
+                WHERE period_start = ANY($1::date[])
+                UNION ALL
+                SELECT sh.employee_id, COUNT(*), SUM({SHIFT_SECONDS_SQL})::float8
+                FROM {SHIFT_HISTORY_SQL} sh
+                WHERE sh.date BETWEEN $2 AND $3
+                GROUP BY sh.employee_id
+                UNION ALL
+                SELECT sh.employee_id, COUNT(*), SUM({SHIFT_SECONDS_SQL})::float8
+                FROM {SHIFT_HISTORY_SQL} sh
+                WHERE sh.date BETWEEN $4 AND $5
+                GROUP BY sh.employee_id
+            )
+            {select_sql}
+        """, (months, head_start, head_end, tail_start, tail_end, *args)
+
+    async def _fetch_payroll_totals(self, conn: asyncpg.Connection, select_sql: str, start_date: date, end_date: date, *args):
+        """Run select_sql over the payroll "totals" CTE (see _payroll_totals_query)"""
+        query, query_args = await self._payroll_totals_query(conn, select_sql, start_date, end_date, *args)
+        return await conn.fetch(query, *query_args)
+
+    @coalesced
+    async def get_salary_summary(self, employee_id: int, start_date: date, end_date: date) -> Tuple[float, int]:
+        """Get (hours, shift_count) for an employee from snapshots and live shifts"""
+        self._ensure_pool()
+        async with self._pool.acquire() as conn:
+            rows = await self._fetch_payroll_totals(conn, """
+                SELECT COALESCE(SUM(seconds), 0)::float8 / 3600 AS hours,
+                       COALESCE(SUM(shift_count), 0)::bigint AS shift_count
+                FROM totals
+                WHERE employee_id = $6
+            """, start_date, end_date, employee_id)
+            return rows[0]['hours'], rows[0]['shift_count']
+
+    async def calculate_salary(self, employee_id: int, start_date: date, end_date: date, rate_per_hour: float) -> Tuple[float, List[Shift]]:
+        """Get salary for the period and the shifts it is made of"""
+        total_hours, _ = await self.get_salary_summary(employee_id, start_date, end_date)
+        # Archived shifts are paid too, so they are listed with the live ones
+        shifts = await self.get_employee_shifts(employee_id, start_date, end_date, include_archive=True)
         salary = total_hours * rate_per_hour
         return salary, shifts
+
+    async def get_payroll(self, start_date: date, end_date: date, rate_per_hour: float) -> List[asyncpg.Record]:
+        """Get hours and pay for every employee in the period in one query.
+
+        Returns read-only Records with user_id, full_name, username,
+        shift_count, hours and pay. Admins are included only if they have shifts.
+        Closed months are read from payroll snapshots.
+        """
+        self._ensure_pool()
+        async with self._pool.acquire() as conn:
+            return await self._fetch_payroll_totals(conn, PAYROLL_SELECT_SQL, start_date, end_date, rate_per_hour)
+
+    # ========== STREAMING EXPORTS ==========
+    # Each stream_* method is an async generator reading through a server-side
+    # cursor in a read-only transaction; it holds one pooled connection until
+    # the caller has consumed (or closed) it.
+
+    async def _stream(self, query: str, *args) -> AsyncIterator[asyncpg.Record]:
+        self._ensure_pool()
+        async with self._pool.acquire() as conn:
+            async with conn.transaction(readonly=True):
+                async for row in conn.cursor(query, *args, prefetch=EXPORT_PREFETCH):
+                    yield row
+
+    def stream_schedule(self, start_date: date, end_date: date) -> AsyncIterator[asyncpg.Record]:
+        """Slots in the range, one row per assigned employee (or one empty row)"""
+        return self._stream("""
+            SELECT s.id, s.date, s.start_time, s.end_time, s.address, s.required_employees, s.is_open,
+                   sh.employee_id, u.full_name
+            FROM schedule_slots s
+            LEFT JOIN shifts sh ON s.id = sh.slot_id AND sh.date = s.date
+            LEFT JOIN users u ON sh.employee_id = u.user_id
+            WHERE s.date BETWEEN $1 AND $2
+            ORDER BY s.date, s.start_time, s.id
+        """, start_date, end_date)
+
+    def stream_shifts(self, start_date: date, end_date: date, employee_id: Optional[int] = None) -> AsyncIterator[asyncpg.Record]:
+        """Shifts in the range (of one employee or everyone), archived ones included, with hours"""
+        return self._stream(f"""
+            SELECT sh.date, sh.start_time, sh.end_time, s.address, sh.employee_id, u.full_name,
+                   {SHIFT_SECONDS_SQL}::float8 / 3600 AS hours
+            FROM (
+                SELECT slot_id, employee_id, date, start_time, end_time FROM shifts
+                UNION ALL
+                SELECT slot_id, employee_id, date, start_time, end_time FROM shifts_archive
+            ) sh
+            LEFT JOIN (
+                SELECT id, date, address FROM schedule_slots
+                UNION ALL
+                SELECT id, date, address FROM schedule_slots_archive
+            ) s ON s.id = sh.slot_id AND s.date = sh.date
+            LEFT JOIN users u ON u.user_id = sh.employee_id
+            WHERE sh.date BETWEEN $1 AND $2 AND ($3::bigint IS NULL OR sh.employee_id = $3)
+            ORDER BY sh.date, sh.start_time, u.full_name
+        """, start_date, end_date, employee_id)
+
+    async def stream_payroll(self, start_date: date, end_date: date, rate_per_hour: float) -> AsyncIterator[asyncpg.Record]:
+        """get_payroll rows read through a cursor"""
+        self._ensure_pool()
+        async with self._pool.acquire() as conn:
+            query, args = await self._payroll_totals_query(conn, PAYROLL_SELECT_SQL, start_date, end_date, rate_per_hour)
+            async with conn.transaction(readonly=True):
+                async for row in conn.cursor(query, *args, prefetch=EXPORT_PREFETCH):
+                    yield row
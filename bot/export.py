@@ -0,0 +1,93 @@
+import csv
+import io
+import tempfile
+from typing import IO, AsyncIterable, Iterable, Sequence
+
+try:
+    from openpyxl import Workbook
+except ImportError:  # XLSX export is optional; CSV works without it
+    Workbook = None
+
+# Keep small exports in memory, spill bigger ones to disk
+SPOOL_MAX_SIZE = 1024 * 1024
+# CSV rows buffered before they are written to the spool
+CSV_CHUNK_ROWS = 500
+
+XLSX_AVAILABLE = Workbook is not None
+
+
+def _open_csv(header: Sequence[str]):
+    """Spooled file with a UTF-8 BOM CSV writer on top, header already written"""
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE, mode='w+b')
+    text = io.TextIOWrapper(spool, encoding='utf-8-sig', newline='')
+    writer = csv.writer(text, delimiter=';')
+    writer.writerow(header)
+    return spool, text, writer
+
+
+def _close_csv(spool, text) -> IO[bytes]:
+    text.flush()
+    text.detach()
+    spool.seek(0)
+    return spool
+
+
+def write_csv(header: Sequence[str], rows: Iterable[Sequence]) -> IO[bytes]:
+    """Write rows to a spooled temporary CSV file and return it rewound.
+
+    Uses UTF-8 with BOM so Excel opens Cyrillic text correctly. The caller
+    owns the returned file and should close it after sending. Send its
+    read() bytes: python-telegram-bot 20 can't take a file object whose
+    name is None, as it is while the spool is still in memory.
+    """
+    spool, text, writer = _open_csv(header)
+    writer.writerows(rows)
+    return _close_csv(spool, text)
+
+
+async def write_csv_stream(header: Sequence[str], rows: AsyncIterable[Sequence]) -> IO[bytes]:
+    """Like write_csv for rows arriving from a database cursor.
+
+    Rows are written in chunks of CSV_CHUNK_ROWS as they arrive, so memory
+    use does not depend on the size of the export.
+    """
+    spool, text, writer = _open_csv(header)
+    try:
+        chunk = []
+        async for row in rows:
+            chunk.append(row)
+            if len(chunk) >= CSV_CHUNK_ROWS:
+                writer.writerows(chunk)
+                chunk.clear()
+        writer.writerows(chunk)
+    except BaseException:
+        text.close()
+        raise
+    return _close_csv(spool, text)
+
+
+async def write_xlsx_stream(header: Sequence[str], rows: AsyncIterable[Sequence], title: str = "Export") -> IO[bytes]:
+    """Write rows to a spooled XLSX file using openpyxl's write-only mode.
+
+    Write-only worksheets serialize rows as they are appended instead of
+    keeping cells in memory. Requires openpyxl (see XLSX_AVAILABLE).
+    """
+    if Workbook is None:
+        raise RuntimeError("XLSX export requires openpyxl")
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(title=title[:31])
+    sheet.append(list(header))
+    async for row in rows:
+        sheet.append(list(row))
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE, mode='w+b')
+    try:
+        workbook.save(spool)
+    except BaseException:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool
+
+
+def format_hours(hours: float) -> str:
+    return f"{hours:.2f}"
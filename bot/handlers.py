@@ -1,16 +1,26 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, ConversationHandler
 from telegram.error import BadRequest
+from telegram.constants import ParseMode
+from contextlib import aclosing
 from datetime import datetime, timedelta
-from typing import Dict
+from typing import Dict, List, Optional
+import html
 import re
 from .database import Database
+from .idempotency import CallbackDeduplicator, idempotent_callback
+from .parsing import parse_date, parse_time, parse_date_range
+from .export import XLSX_AVAILABLE, write_csv, write_csv_stream, write_xlsx_stream, format_hours
+from .autoschedule import plan_from_records
+from .bitmap import DayBitmaps, minutes_mask
+from .tracing import Tracer
 from .keyboards import (
     get_main_keyboard, get_employee_selection_keyboard, get_schedule_edit_keyboard,
     get_date_selection_keyboard, get_slot_selection_keyboard, get_yes_no_keyboard,
     get_cancel_keyboard, get_worker_management_keyboard,
     get_period_selection_keyboard, get_period_start_date_keyboard, get_period_end_date_keyboard,
-    get_back_keyboard, get_employees_count_keyboard, get_free_time_slots_keyboard
+    get_back_keyboard, get_employees_count_keyboard, get_free_time_slots_keyboard,
+    get_week_selection_keyboard, get_export_kind_keyboard, get_export_format_keyboard
 )
 
 # Conversation states
@@ -26,14 +36,38 @@ from .keyboards import (
     WAITING_EVENT_ADDRESS, WAITING_EMPLOYEE_SLOT_SELECTION,
     WAITING_FREE_TIME_EMPLOYEE, WAITING_EVENT_EMPLOYEES_COUNT,
     WAITING_FREE_TIME_DELETE_DATE, WAITING_FREE_TIME_DELETE_SLOT,
-    WAITING_EDIT_NAME_EMPLOYEE, WAITING_EDIT_NAME_INPUT
-) = range(32)
+    WAITING_EDIT_NAME_EMPLOYEE, WAITING_EDIT_NAME_INPUT,
+    WAITING_AUTOSCHEDULE_PERIOD, WAITING_AUTOSCHEDULE_CONFIRM,
+    WAITING_FREE_TIME_WEEK,
+    WAITING_EXPORT_KIND, WAITING_EXPORT_EMPLOYEE, WAITING_EXPORT_PERIOD,
+    WAITING_EXPORT_RATE, WAITING_EXPORT_FORMAT
+) = range(40)
+STATE_NAMES = {value: name for name, value in globals().items() if name.startswith('WAITING_')}
+
+# Plan lines shown in the auto-scheduling preview; the full plan goes to CSV
+AUTOSCHEDULE_PREVIEW_LINES = 30
+
+# Team availability grid: name column width and message size under Telegram's 4096 limit
+TEAM_GRID_NAME_WIDTH = 10
+TEAM_GRID_MESSAGE_LIMIT = 3500
+WEEKDAYS = ["пн", "вт", "ср", "чт", "пт", "сб", "вс"]
+
+# /slowqueries: statements listed and how much of each query/plan is shown
+SLOW_QUERIES_SHOWN = 10
+SLOW_QUERY_TEXT_LENGTH = 300
+SLOW_QUERY_MESSAGE_LIMIT = 3500
+# /traces: slowest traces listed and the message size of one span tree
+TRACES_SHOWN = 10
+TRACE_MESSAGE_LIMIT = 3500
 
 
 class BotHandlers:
-    def __init__(self, db: Database, admin_ids: list):
+    def __init__(self, db: Database, admin_ids: list, tracer: Optional[Tracer] = None):
         self.db = db
         self.admin_ids = admin_ids
+        self.tracer = tracer
+        # Absorbs double taps on booking/assignment buttons
+        self.callback_dedup = CallbackDeduplicator(window=5.0)
 
     async def is_admin(self, user_id: int) -> bool:
         if user_id in self.admin_ids:
@@ -148,7 +182,7 @@ class BotHandlers:
                 # Predefined period selected (format: period_YYYY-MM-DD_YYYY-MM-DD)
                 _, start_date, end_date = query.data.split("_", 2)
                 employee_id = None  # Always show all slots
-                slots = await self.db.get_schedule_slots_by_range(start_date, end_date, employee_id)
+                slots = await self.db.get_schedule_slots_by_range(parse_date(start_date), parse_date(end_date), employee_id, raw=True)
                 
                 if not slots:
                     await query.edit_message_text("Нет слотов в этом периоде.")
@@ -217,7 +251,7 @@ class BotHandlers:
                 return ConversationHandler.END
             
             employee_id = None  # Always show all slots
-            slots = await self.db.get_schedule_slots_by_range(start_date, end_date, employee_id)
+            slots = await self.db.get_schedule_slots_by_range(parse_date(start_date), parse_date(end_date), employee_id, raw=True)
             
             if not slots:
                 await query.edit_message_text("Нет слотов в этом периоде.")
@@ -257,13 +291,10 @@ class BotHandlers:
             return ConversationHandler.END
         
         try:
-            start_date, end_date = text.split()
-            # Validate dates
-            datetime.strptime(start_date, "%Y-%m-%d")
-            datetime.strptime(end_date, "%Y-%m-%d")
+            start_date, end_date = parse_date_range(text)
             
             employee_id = context.user_data.get('schedule_employee')
-            slots = await self.db.get_schedule_slots_by_range(start_date, end_date, employee_id)
+            slots = await self.db.get_schedule_slots_by_range(start_date, end_date, employee_id, raw=True)
             
             if not slots:
                 await update.message.reply_text("Нет слотов в этом периоде.")
@@ -389,8 +420,8 @@ class BotHandlers:
             
             # Validate times
             try:
-                start_time = datetime.strptime(event_start, "%H:%M").time()
-                end_time = datetime.strptime(text, "%H:%M").time()
+                start_time = parse_time(event_start)
+                end_time = parse_time(text)
                 if end_time <= start_time:
                     await update.message.reply_text("Время окончания должно быть позже времени начала.")
                     return WAITING_EVENT_END
@@ -403,7 +434,7 @@ class BotHandlers:
             # Check if any employees have free time at this time
             event_date = context.user_data.get('event_date')
             event_start = context.user_data.get('event_start')
-            employees_with_free_time = await self.db.get_employees_with_free_time(event_date, event_start, text)
+            employees_with_free_time = await self.db.get_employees_with_free_time(parse_date(event_date), start_time, end_time)
             
             if employees_with_free_time:
                 # Store employees for later use
@@ -511,7 +542,7 @@ class BotHandlers:
         
         # Create slot (will be assigned later if needed)
         slot_id = await self.db.add_schedule_slot(
-            event_date, event_start, event_end,
+            parse_date(event_date), parse_time(event_start), parse_time(event_end),
             address=address,
             location_latitude=None,
             location_longitude=None,
@@ -634,6 +665,7 @@ class BotHandlers:
                 context.user_data.pop(key, None)
             return ConversationHandler.END
 
+    @idempotent_callback("emp_")
     async def admin_assign_employee(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         query = update.callback_query
         await query.answer()
@@ -665,7 +697,7 @@ class BotHandlers:
                 return ConversationHandler.END
             
             try:
-                await self.db.assign_shift(slot_id, emp_id)
+                await self.db.assign_shift(slot_id, parse_date(context.user_data['event_date']), emp_id)
                 # Slot will be closed automatically in assign_shift() if fully booked
                 
                 employee_name = await self.db.get_user_display_name(emp_id)
@@ -713,7 +745,7 @@ class BotHandlers:
             date_str = query.data.split("_")[1]
             context.user_data['delete_date'] = date_str
             
-            slots = await self.db.get_schedule_slots_by_date(date_str)
+            slots = await self.db.get_schedule_slots_by_date(parse_date(date_str))
             if not slots:
                 await query.edit_message_text("Нет событий на эту дату.")
                 return ConversationHandler.END
@@ -752,7 +784,7 @@ class BotHandlers:
             return WAITING_DELETE_SLOT
         elif query.data == "confirm_delete_yes":
             slot_id = context.user_data.get('delete_slot_id')
-            await self.db.delete_schedule_slot(slot_id)
+            await self.db.delete_schedule_slot(slot_id, parse_date(context.user_data['delete_date']))
             await query.edit_message_text("Событие удалено.")
             return ConversationHandler.END
         elif query.data == "confirm_delete_no":
@@ -789,8 +821,11 @@ class BotHandlers:
             return WAITING_REPORT_EMPLOYEE
         
         if query.data.startswith("emp_"):
-            emp_id = int(query.data.split("_")[1])
-            context.user_data['report_employee'] = emp_id
+            if query.data == "emp_all":
+                # Batch payroll for every employee
+                context.user_data['report_employee'] = 'all'
+            else:
+                context.user_data['report_employee'] = int(query.data.split("_")[1])
             
             keyboard = get_period_selection_keyboard(show_back=True)
             await query.edit_message_text(
@@ -911,8 +946,7 @@ class BotHandlers:
         
         try:
             start_date, end_date = text.split()
-            datetime.strptime(start_date, "%Y-%m-%d")
-            datetime.strptime(end_date, "%Y-%m-%d")
+            parse_date_range(text)
             
             context.user_data['report_start'] = start_date
             context.user_data['report_end'] = end_date
@@ -943,7 +977,15 @@ class BotHandlers:
             start_date = context.user_data.get('report_start')
             end_date = context.user_data.get('report_end')
             
-            salary, shifts = await self.db.calculate_salary(emp_id, start_date, end_date, rate)
+            if emp_id == 'all':
+                await self._send_payroll_report(update, parse_date(start_date), parse_date(end_date), rate)
+                return ConversationHandler.END
+            
+            hours, _ = await self.db.get_salary_summary(emp_id, parse_date(start_date), parse_date(end_date))
+            # Archived shifts are counted in the hours, so they are listed too
+            shifts = await self.db.get_employee_shifts(emp_id, parse_date(start_date), parse_date(end_date), raw=True,
+                                                       include_archive=True)
+            salary = hours * rate
             
             report_text = f"Отчет по сотруднику:\n\n"
             report_text += f"Период: {start_date} - {end_date}\n"
@@ -953,15 +995,56 @@ class BotHandlers:
             for shift in shifts:
                 report_text += f"  {shift['date']} {shift['start_time']}-{shift['end_time']}\n"
             
+            report_text += f"\nЧасов: {format_hours(hours)}"
             report_text += f"\nИтого: {salary:.2f} руб."
             
             await update.message.reply_text(report_text)
+            
+            employee_name = await self.db.get_user_display_name(emp_id)
+            document = write_csv(
+                ["Дата", "Начало", "Конец", "Адрес"],
+                ((shift['date'], shift['start_time'], shift['end_time'], shift['address'] or '') for shift in shifts)
+            )
+            with document:
+                await update.message.reply_document(
+                    document=document.read(),
+                    filename=f"salary_{emp_id}_{start_date}_{end_date}.csv",
+                    caption=f"{employee_name}: {format_hours(hours)} ч, {salary:.2f} руб."
+                )
             return ConversationHandler.END
             
         except ValueError:
             await update.message.reply_text("Введите число (например: 500):")
             return WAITING_REPORT_RATE
 
+    async def _send_payroll_report(self, update: Update, start_date, end_date, rate: float):
+        """Send payroll for all employees as a summary message and a CSV document"""
+        payroll = await self.db.get_payroll(start_date, end_date, rate)
+        total_hours = sum(row['hours'] for row in payroll)
+        total_pay = sum(row['pay'] for row in payroll)
+        
+        await update.message.reply_text(
+            f"Ведомость за период {start_date} - {end_date}:\n\n"
+            f"Ставка: {rate} руб/час\n"
+            f"Сотрудников: {len(payroll)}\n"
+            f"Часов: {format_hours(total_hours)}\n"
+            f"Итого: {total_pay:.2f} руб."
+        )
+        
+        document = write_csv(
+            ["ID", "Имя", "Смен", "Часов", "Ставка", "Сумма"],
+            (
+                (row['user_id'], row['full_name'] or row['username'] or '', row['shift_count'],
+                 format_hours(row['hours']), rate, f"{row['pay']:.2f}")
+                for row in payroll
+            )
+        )
+        with document:
+            await update.message.reply_document(
+                document=document.read(),
+                filename=f"payroll_{start_date}_{end_date}.csv"
+            )
+
     async def admin_set_shifts(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Admin: Set shifts"""
         keyboard = get_date_selection_keyboard(show_back=True)
@@ -977,13 +1060,14 @@ class BotHandlers:
         
         if query.data == "back":
             # Go back to main menu
+            context.user_data.pop('shift_availability', None)
             return ConversationHandler.END
         
         if query.data.startswith("date_"):
             date_str = query.data.split("_")[1]
             context.user_data['shift_date'] = date_str
             
-            slots = await self.db.get_schedule_slots_by_date(date_str)
+            slots = await self.db.get_schedule_slots_by_date(parse_date(date_str))
             if not slots:
                 keyboard = get_back_keyboard()
                 try:
@@ -1000,6 +1084,9 @@ class BotHandlers:
                     )
                 return WAITING_SHIFT_DATE
             
+            # Rank employees for all slots of the day at once
+            context.user_data['shift_availability'] = await self.db.get_day_availability(parse_date(date_str))
+            
             keyboard = get_slot_selection_keyboard(slots, show_address=True, show_back=True)
             try:
                 await query.edit_message_text(
@@ -1044,20 +1131,26 @@ class BotHandlers:
             slot_id = int(query.data.split("_")[1])
             context.user_data['shift_slot_id'] = slot_id
             
-            # Get available employees
-            employees = await self.db.get_available_employees_for_slot(slot_id)
-            if not employees:
+            # Get available employees from the day matrix
+            candidates = context.user_data.get('shift_availability', {}).get(slot_id)
+            if candidates is None:
+                matrix = await self.db.get_day_availability(parse_date(context.user_data['shift_date']))
+                candidates = matrix.get(slot_id, [])
+            if not candidates:
+                context.user_data.pop('shift_availability', None)
                 await query.edit_message_text("Нет доступных сотрудников для этого слота.")
                 return ConversationHandler.END
             
+            employees = [(c.employee_id, f"✅ {c.name}" if c.fully_free else c.name) for c in candidates]
             keyboard = get_employee_selection_keyboard(employees, show_back=True)
             await query.edit_message_text(
-                "Выберите сотрудника:",
+                "Выберите сотрудника (✅ — свободен на всё время слота):",
                 reply_markup=keyboard
             )
             return WAITING_SHIFT_EMPLOYEE
         return WAITING_SHIFT_SLOT
 
+    @idempotent_callback("emp_")
     async def admin_shift_employee_selected(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         query = update.callback_query
         await query.answer()
@@ -1065,8 +1158,10 @@ class BotHandlers:
         if query.data == "back":
             # Go back to slot selection
             date_str = context.user_data.get('shift_date', '2025-01-01')
-            slots = await self.db.get_schedule_slots_by_date(date_str)
+            slots = await self.db.get_schedule_slots_by_date(parse_date(date_str))
             if slots:
+                # Free time and shifts may have changed since the date was picked
+                context.user_data['shift_availability'] = await self.db.get_day_availability(parse_date(date_str))
                 keyboard = get_slot_selection_keyboard(slots, show_back=True)
                 await query.edit_message_text(
                     f"Дата: {date_str}\nВыберите слот:",
@@ -1074,20 +1169,326 @@ class BotHandlers:
                 )
                 return WAITING_SHIFT_SLOT
             else:
+                context.user_data.pop('shift_availability', None)
                 return ConversationHandler.END
         
         if query.data.startswith("emp_"):
             emp_id = int(query.data.split("_")[1])
             slot_id = context.user_data.get('shift_slot_id')
+            context.user_data.pop('shift_availability', None)
             
             try:
-                await self.db.assign_shift(slot_id, emp_id)
+                await self.db.assign_shift(slot_id, parse_date(context.user_data['shift_date']), emp_id)
                 await query.edit_message_text("Смена назначена сотруднику.")
             except ValueError as e:
                 await query.edit_message_text(f"Ошибка: {str(e)}")
             return ConversationHandler.END
         return WAITING_SHIFT_EMPLOYEE
 
+    # ========== AUTO-SCHEDULING ==========
+
+    async def admin_autoschedule(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Admin: Fill open slots automatically"""
+        if not await self.is_admin(update.effective_user.id):
+            await update.message.reply_text("Команда доступна только администраторам.")
+            return ConversationHandler.END
+        
+        keyboard = get_period_selection_keyboard(show_back=True)
+        await update.message.reply_text(
+            "Выберите период для автоматической расстановки смен:",
+            reply_markup=keyboard
+        )
+        return WAITING_AUTOSCHEDULE_PERIOD
+
+    async def admin_autoschedule_period_selected(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        query = update.callback_query
+        await query.answer()
+        
+        if query.data == "back":
+            await query.edit_message_text("Автоматическая расстановка отменена.")
+            return ConversationHandler.END
+        
+        if query.data == "period_custom":
+            await query.edit_message_text(
+                "Введите период в формате: ГГГГ-ММ-ДД ГГГГ-ММ-ДД\n"
+                "Например: 2025-01-01 2025-01-07"
+            )
+            return WAITING_AUTOSCHEDULE_PERIOD
+        
+        _, start_date, end_date = query.data.split("_", 2)
+        await query.edit_message_text(f"Период: {start_date} - {end_date}\nСоставляю расстановку...")
+        return await self._preview_autoschedule(query.message, context, parse_date(start_date), parse_date(end_date))
+
+    async def admin_autoschedule_period(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        text = update.message.text.strip()
+        
+        if self.is_menu_command(text):
+            await update.message.reply_text("Операция отменена. Используйте выбранную команду.")
+            return ConversationHandler.END
+        
+        try:
+            start_date, end_date = parse_date_range(text)
+        except ValueError:
+            await update.message.reply_text("Неверный формат. Используйте: ГГГГ-ММ-ДД ГГГГ-ММ-ДД")
+            return WAITING_AUTOSCHEDULE_PERIOD
+        if end_date < start_date:
+            await update.message.reply_text("Дата окончания должна быть не раньше даты начала.")
+            return WAITING_AUTOSCHEDULE_PERIOD
+        
+        return await self._preview_autoschedule(update.message, context, start_date, end_date)
+
+    async def _preview_autoschedule(self, message, context: ContextTypes.DEFAULT_TYPE, start_date, end_date):
+        """Solve the period, show the plan and ask for confirmation"""
+        slots, shifts, free_time = await self.db.get_autoschedule_data(start_date, end_date)
+        if not slots:
+            await message.reply_text(f"Нет открытых слотов со свободными местами за период {start_date} - {end_date}.")
+            return ConversationHandler.END
+        
+        plan = plan_from_records(slots, shifts, free_time, datetime.combine(start_date, datetime.min.time()))
+        places = sum(slot['missing'] for slot in slots)
+        if not plan:
+            await message.reply_text(
+                f"Открытых мест: {places}, но ни у кого из сотрудников нет свободного времени на эти слоты."
+            )
+            return ConversationHandler.END
+        
+        slot_by_id = {slot['id']: slot for slot in slots}
+        context.user_data['autoschedule_plan'] = [
+            (a.slot_id, slot_by_id[a.slot_id]['date'], a.employee_id) for a in plan
+        ]
+        names = dict(await self.db.get_all_employees())
+        rows = sorted(
+            (
+                (slot_by_id[a.slot_id], names.get(a.employee_id, f"User {a.employee_id}"))
+                for a in plan
+            ),
+            key=lambda item: (item[0]['date'], item[0]['start_time'], item[1])
+        )
+        
+        text = f"Расстановка на {start_date} - {end_date}:\n"
+        text += f"Заполнено мест: {len(plan)} из {places}\n\n"
+        for slot, name in rows[:AUTOSCHEDULE_PREVIEW_LINES]:
+            text += f"{slot['date']} {slot['start_time']}-{slot['end_time']} {slot['address'] or ''}: {name}\n"
+        if len(rows) > AUTOSCHEDULE_PREVIEW_LINES:
+            text += f"... и еще {len(rows) - AUTOSCHEDULE_PREVIEW_LINES} (полный список в файле)\n"
+            document = write_csv(
+                ["Дата", "Начало", "Конец", "Адрес", "Сотрудник"],
+                (
+                    (slot['date'], slot['start_time'], slot['end_time'], slot['address'] or '', name)
+                    for slot, name in rows
+                )
+            )
+            with document:
+                await message.reply_document(
+                    document=document.read(),
+                    filename=f"autoschedule_{start_date}_{end_date}.csv"
+                )
+        text += "\nНазначить смены?"
+        
+        await message.reply_text(text, reply_markup=get_yes_no_keyboard("autoschedule"))
+        return WAITING_AUTOSCHEDULE_CONFIRM
+
+    async def admin_autoschedule_confirm(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        query = update.callback_query
+        await query.answer()
+        
+        plan = context.user_data.pop('autoschedule_plan', None)
+        if query.data != "autoschedule_yes" or not plan:
+            await query.edit_message_text("Автоматическая расстановка отменена.")
+            return ConversationHandler.END
+        
+        try:
+            created = await self.db.assign_shifts_bulk(plan)
+        except ValueError as e:
+            await query.edit_message_text(
+                f"Ошибка: {str(e)}\n"
+                "Расписание изменилось, ничего не назначено. Запустите /autoschedule еще раз."
+            )
+            return ConversationHandler.END
+        
+        await query.edit_message_text(f"✅ Назначено смен: {created}")
+        return ConversationHandler.END
+
+    # ========== EXPORT ==========
+
+    async def admin_export(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Admin: Export schedule, shifts or payroll as a file"""
+        if not await self.is_admin(update.effective_user.id):
+            await update.message.reply_text("Команда доступна только администраторам.")
+            return ConversationHandler.END
+        
+        context.user_data.pop('export', None)
+        await update.message.reply_text(
+            "Что выгрузить?",
+            reply_markup=get_export_kind_keyboard(show_back=True)
+        )
+        return WAITING_EXPORT_KIND
+
+    async def admin_export_kind_selected(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        query = update.callback_query
+        await query.answer()
+        
+        if query.data == "back":
+            await query.edit_message_text("Выгрузка отменена.")
+            return ConversationHandler.END
+        
+        kind = query.data.split("_", 1)[1]
+        context.user_data['export'] = {'kind': kind}
+        if kind == "shifts":
+            employees = await self.db.get_all_employees()
+            await query.edit_message_text(
+                "Выберите сотрудника:",
+                reply_markup=get_employee_selection_keyboard(employees, show_back=True)
+            )
+            return WAITING_EXPORT_EMPLOYEE
+        
+        await query.edit_message_text("Выберите период:", reply_markup=get_period_selection_keyboard(show_back=True))
+        return WAITING_EXPORT_PERIOD
+
+    async def admin_export_employee_selected(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        query = update.callback_query
+        await query.answer()
+        
+        if query.data == "back":
+            await query.edit_message_text("Что выгрузить?", reply_markup=get_export_kind_keyboard(show_back=True))
+            return WAITING_EXPORT_KIND
+        
+        export = context.user_data.setdefault('export', {'kind': 'shifts'})
+        export['employee'] = None if query.data == "emp_all" else int(query.data.split("_")[1])
+        await query.edit_message_text("Выберите период:", reply_markup=get_period_selection_keyboard(show_back=True))
+        return WAITING_EXPORT_PERIOD
+
+    async def admin_export_period_selected(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        query = update.callback_query
+        await query.answer()
+        
+        if query.data == "back":
+            await query.edit_message_text("Что выгрузить?", reply_markup=get_export_kind_keyboard(show_back=True))
+            return WAITING_EXPORT_KIND
+        
+        if query.data == "period_custom":
+            await query.edit_message_text(
+                "Введите период в формате: ГГГГ-ММ-ДД ГГГГ-ММ-ДД\n"
+                "Например: 2025-01-01 2025-01-31"
+            )
+            return WAITING_EXPORT_PERIOD
+        
+        _, start_date, end_date = query.data.split("_", 2)
+        await query.edit_message_text(f"Период: {start_date} - {end_date}")
+        return await self._export_period_chosen(query.message, context, parse_date(start_date), parse_date(end_date))
+
+    async def admin_export_period(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        text = update.message.text.strip()
+        
+        if self.is_menu_command(text):
+            await update.message.reply_text("Операция отменена. Используйте выбранную команду.")
+            return ConversationHandler.END
+        
+        try:
+            start_date, end_date = parse_date_range(text)
+        except ValueError:
+            await update.message.reply_text("Неверный формат. Используйте: ГГГГ-ММ-ДД ГГГГ-ММ-ДД")
+            return WAITING_EXPORT_PERIOD
+        if end_date < start_date:
+            await update.message.reply_text("Дата окончания должна быть не раньше даты начала.")
+            return WAITING_EXPORT_PERIOD
+        
+        return await self._export_period_chosen(update.message, context, start_date, end_date)
+
+    async def _export_period_chosen(self, message, context: ContextTypes.DEFAULT_TYPE, start_date, end_date):
+        export = context.user_data.setdefault('export', {'kind': 'schedule'})
+        export['start'], export['end'] = start_date, end_date
+        if export['kind'] == "payroll":
+            await message.reply_text("Введите ставку (руб/час):")
+            return WAITING_EXPORT_RATE
+        return await self._export_ask_format(message, context)
+
+    async def admin_export_rate(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        text = update.message.text.strip()
+        
+        if self.is_menu_command(text):
+            await update.message.reply_text("Операция отменена. Используйте выбранную команду.")
+            return ConversationHandler.END
+        
+        try:
+            rate = float(text)
+        except ValueError:
+            await update.message.reply_text("Введите число (например: 500):")
+            return WAITING_EXPORT_RATE
+        context.user_data.setdefault('export', {'kind': 'payroll'})['rate'] = rate
+        return await self._export_ask_format(update.message, context)
+
+    async def _export_ask_format(self, message, context: ContextTypes.DEFAULT_TYPE):
+        if not XLSX_AVAILABLE:
+            return await self._send_export(message, context, "csv")
+        await message.reply_text("Формат файла:", reply_markup=get_export_format_keyboard())
+        return WAITING_EXPORT_FORMAT
+
+    async def admin_export_format_selected(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        query = update.callback_query
+        await query.answer()
+        
+        if query.data == "back":
+            await query.edit_message_text("Выгрузка отменена.")
+            return ConversationHandler.END
+        
+        file_format = query.data.split("_", 1)[1]
+        await query.edit_message_text(f"Готовлю файл {file_format.upper()}...")
+        return await self._send_export(query.message, context, file_format)
+
+    async def _send_export(self, message, context: ContextTypes.DEFAULT_TYPE, file_format: str):
+        """Stream the chosen export from a database cursor into a file and send it"""
+        export = context.user_data.pop('export', None)
+        if not export or 'start' not in export:
+            await message.reply_text("Выгрузка устарела. Запустите /export еще раз.")
+            return ConversationHandler.END
+        
+        kind, start_date, end_date = export['kind'], export['start'], export['end']
+        if kind == "schedule":
+            header = ["ID слота", "Дата", "Начало", "Конец", "Адрес", "Нужно", "Открыт", "ID сотрудника", "Сотрудник"]
+            records = self.db.stream_schedule(start_date, end_date)
+            
+            def row(r):
+                return (r['id'], r['date'], r['start_time'], r['end_time'], r['address'] or '',
+                        r['required_employees'], "да" if r['is_open'] else "нет",
+                        r['employee_id'] or '', r['full_name'] or '')
+            name = "schedule"
+        elif kind == "shifts":
+            header = ["Дата", "Начало", "Конец", "Адрес", "ID сотрудника", "Сотрудник", "Часов"]
+            records = self.db.stream_shifts(start_date, end_date, export.get('employee'))
+            
+            def row(r):
+                return (r['date'], r['start_time'], r['end_time'], r['address'] or '',
+                        r['employee_id'], r['full_name'] or '', round(r['hours'], 2))
+            name = f"shifts_{export['employee']}" if export.get('employee') else "shifts"
+        else:
+            rate = export['rate']
+            header = ["ID", "Имя", "Смен", "Часов", "Ставка", "Сумма"]
+            records = self.db.stream_payroll(start_date, end_date, rate)
+            
+            def row(r):
+                return (r['user_id'], r['full_name'] or r['username'] or '', r['shift_count'],
+                        round(r['hours'], 2), rate, round(r['pay'], 2))
+            name = "payroll"
+        
+        async def rows():
+            async for record in records:
+                yield row(record)
+        
+        # Close the cursor's transaction and return its connection right away
+        # if writing the file fails partway, instead of whenever it is collected
+        async with aclosing(records):
+            if file_format == "xlsx":
+                document = await write_xlsx_stream(header, rows(), title=name)
+            else:
+                document = await write_csv_stream(header, rows())
+        with document:
+            await message.reply_document(
+                document=document.read(),
+                filename=f"{name}_{start_date}_{end_date}.{file_format}"
+            )
+        return ConversationHandler.END
+
     # ========== EMPLOYEE HANDLERS ==========
     
     async def employee_salary(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1123,7 +1524,7 @@ class BotHandlers:
                 rate = 500.0
                 user_id = update.effective_user.id
                 
-                salary, shifts = await self.db.calculate_salary(user_id, start_date, end_date, rate)
+                salary, shifts = await self.db.calculate_salary(user_id, parse_date(start_date), parse_date(end_date), rate)
                 
                 salary_text = f"Ваша зарплата за период {start_date} - {end_date}:\n\n"
                 salary_text += f"Ставка: {rate} руб/час\n\n"
@@ -1190,7 +1591,7 @@ class BotHandlers:
             rate = 500.0
             user_id = update.effective_user.id
             
-            salary, shifts = await self.db.calculate_salary(user_id, start_date, end_date, rate)
+            salary, shifts = await self.db.calculate_salary(user_id, parse_date(start_date), parse_date(end_date), rate)
             
             salary_text = f"Ваша зарплата за период {start_date} - {end_date}:\n\n"
             salary_text += f"Ставка: {rate} руб/час\n\n"
@@ -1214,9 +1615,7 @@ class BotHandlers:
             return ConversationHandler.END
         
         try:
-            start_date, end_date = text.split()
-            datetime.strptime(start_date, "%Y-%m-%d")
-            datetime.strptime(end_date, "%Y-%m-%d")
+            start_date, end_date = parse_date_range(text)
             
             # For employees, use default rate of 500
             rate = 500.0
@@ -1271,7 +1670,8 @@ class BotHandlers:
                 user_id = update.effective_user.id
                 
                 # Get only shifts assigned to this employee
-                shifts = await self.db.get_employee_shifts(user_id, date_str, date_str)
+                day = parse_date(date_str)
+                shifts = await self.db.get_employee_shifts(user_id, day, day, raw=True)
                 
                 # Debug logging
                 import logging
@@ -1316,13 +1716,11 @@ class BotHandlers:
             return ConversationHandler.END
         
         try:
-            start_date, end_date = text.split()
-            datetime.strptime(start_date, "%Y-%m-%d")
-            datetime.strptime(end_date, "%Y-%m-%d")
+            start_date, end_date = parse_date_range(text)
             
             user_id = update.effective_user.id
             # Get only shifts assigned to this employee
-            shifts = await self.db.get_employee_shifts(user_id, start_date, end_date)
+            shifts = await self.db.get_employee_shifts(user_id, start_date, end_date, raw=True)
             
             if not shifts:
                 await update.message.reply_text(f"Нет смен в периоде {start_date} - {end_date}.")
@@ -1383,14 +1781,15 @@ class BotHandlers:
             print(f"DEBUG employee_slot_date_selected: user_id={user_id}, date={date_str}", file=sys.stderr, flush=True)
             
             # First, check all slots on this date to see what's available
-            all_slots = await self.db.get_schedule_slots_by_range(date_str, date_str, only_open=False)
+            day = parse_date(date_str)
+            all_slots = await self.db.get_schedule_slots_by_range(day, day, only_open=False, raw=True)
             logging.critical(f"DEBUG all_slots on {date_str}: {len(all_slots)}")
             print(f"DEBUG all_slots on {date_str}: {len(all_slots)}", file=sys.stderr, flush=True)
             for slot in all_slots:
                 logging.critical(f"DEBUG slot: id={slot.get('id')}, is_open={slot.get('is_open')}, required={slot.get('required_employees')}, employee_id={slot.get('employee_id')}")
                 print(f"DEBUG slot: id={slot.get('id')}, is_open={slot.get('is_open')}, required={slot.get('required_employees')}, employee_id={slot.get('employee_id')}", file=sys.stderr, flush=True)
             
-            slots = await self.db.get_schedule_slots_by_range(date_str, date_str, only_open=True, exclude_employee_id=user_id)
+            slots = await self.db.get_schedule_slots_by_range(day, day, only_open=True, exclude_employee_id=user_id, raw=True)
             
             logging.critical(f"DEBUG open slots (exclude employee {user_id}): {len(slots)}")
             print(f"DEBUG open slots (exclude employee {user_id}): {len(slots)}", file=sys.stderr, flush=True)
@@ -1412,7 +1811,7 @@ class BotHandlers:
                     text += f"📍 {slot['address']}\n"
                 required = slot.get('required_employees', 1)
                 # Count how many employees are already assigned
-                assigned_count = await self.db.get_slot_assigned_count(slot['id'])
+                assigned_count = await self.db.get_slot_assigned_count(slot['id'], slot['date'])
                 available = required - assigned_count
                 text += f"👥 Нужно: {required} чел. (свободно мест: {available})\n\n"
             
@@ -1424,6 +1823,7 @@ class BotHandlers:
             return WAITING_EMPLOYEE_SLOT_SELECTION
         return WAITING_EMPLOYEE_SLOT_SELECTION
     
+    @idempotent_callback("slot_")
     async def employee_slot_selected(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle slot selection for employee signup"""
         query = update.callback_query
@@ -1468,12 +1868,13 @@ class BotHandlers:
                         is_admin=False
                     )
                 
-                await self.db.assign_shift(slot_id, user_id)
+                date_str = context.user_data.get('employee_slot_date', '2025-01-01')
+                day = parse_date(date_str)
+                await self.db.assign_shift(slot_id, day, user_id)
                 # Slot will be closed automatically in assign_shift() if fully booked
                 
                 # Get slot details for confirmation
-                date_str = context.user_data.get('employee_slot_date', '2025-01-01')
-                slots = await self.db.get_schedule_slots_by_range(date_str, date_str)
+                slots = await self.db.get_schedule_slots_by_range(day, day, raw=True)
                 slot = next((s for s in slots if s['id'] == slot_id), None)
                 
                 text = "✅ Вы успешно записались на слот!\n\n"
@@ -1617,7 +2018,8 @@ class BotHandlers:
                 user_id = update.effective_user.id
                 
                 # Get free time slots for this date
-                free_time_slots = await self.db.get_employee_free_time(user_id, date_str, date_str)
+                day = parse_date(date_str)
+                free_time_slots = await self.db.get_employee_free_time(user_id, day, day)
                 
                 if not free_time_slots:
                     keyboard = get_back_keyboard()
@@ -1731,8 +2133,9 @@ class BotHandlers:
         lines = text.split('\n')
         user_id = update.effective_user.id
         date_str = context.user_data.get('free_time_date')
+        free_date = parse_date(date_str)
         
-        slots_added = []
+        intervals = []
         errors = []
         
         for line in lines:
@@ -1746,20 +2149,24 @@ class BotHandlers:
                     continue
                 
                 # Validate times
-                start = datetime.strptime(start_time, "%H:%M").time()
-                end = datetime.strptime(end_time, "%H:%M").time()
+                start = parse_time(start_time)
+                end = parse_time(end_time)
                 if end <= start:
                     errors.append(f"Неверное время: {line}")
                     continue
                 
-                await self.db.add_free_time_slot(user_id, date_str, start_time, end_time)
-                slots_added.append(f"{start_time}-{end_time}")
+                intervals.append((start, end))
             except ValueError:
                 errors.append(f"Неверный формат: {line}")
         
+        # All lines in one transaction, merged with the day's existing free time
+        day_intervals = []
+        if intervals:
+            day_intervals = await self.db.add_free_time_slots(user_id, free_date, intervals)
+        
         response = f"Свободное время на {date_str}:\n\n"
-        for slot in slots_added:
-            response += f"  {slot}\n"
+        for start, end in day_intervals:
+            response += f"  {start.strftime('%H:%M')}-{end.strftime('%H:%M')}\n"
         
         if errors:
             response += "\nОшибки:\n"
@@ -2130,6 +2537,14 @@ class BotHandlers:
                 # This callback is from a different conversation, ignore it
                 return ConversationHandler.END
             
+            if query.data == "emp_all":
+                # Team grid for a week instead of one employee
+                await query.edit_message_text(
+                    "Выберите неделю:",
+                    reply_markup=get_week_selection_keyboard(show_back=True)
+                )
+                return WAITING_FREE_TIME_WEEK
+            
             emp_id = int(query.data.split("_")[1])
             
             try:
@@ -2139,8 +2554,8 @@ class BotHandlers:
                     await query.edit_message_text("Сотрудник не найден.")
                     return ConversationHandler.END
                 
-                # Get all free time slots
-                free_time_slots = await self.db.get_employee_free_time(emp_id)
+                # Get upcoming free time slots
+                free_time_slots = await self.db.get_employee_free_time(emp_id, datetime.now().date())
                 
                 if not free_time_slots:
                     employee_name = employee.get('full_name') or employee.get('username') or f"ID: {emp_id}"
@@ -2175,6 +2590,75 @@ class BotHandlers:
         
         return WAITING_FREE_TIME_EMPLOYEE
 
+    async def admin_free_time_week_selected(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Show free time of all employees for the chosen week as per-day grids"""
+        query = update.callback_query
+        await query.answer()
+        
+        if query.data == "back":
+            employees = await self.db.get_all_employees()
+            await query.edit_message_text(
+                "Выберите сотрудника для просмотра свободного времени:",
+                reply_markup=get_employee_selection_keyboard(employees)
+            )
+            return WAITING_FREE_TIME_EMPLOYEE
+        
+        if not query.data.startswith("week_"):
+            return WAITING_FREE_TIME_WEEK
+        
+        start_date = parse_date(query.data.split("_", 1)[1])
+        end_date = start_date + timedelta(days=6)
+        bitmaps_by_day, names = await self.db.get_team_availability(start_date, end_date)
+        
+        await query.edit_message_text(
+            f"Свободное время команды {start_date} - {end_date}\n"
+            "█ свободен весь час, ▒ часть часа, · занят"
+        )
+        for i in range(7):
+            day = start_date + timedelta(days=i)
+            for text in self._format_team_grid(day, bitmaps_by_day.get(day), names):
+                await query.message.reply_text(text, parse_mode=ParseMode.HTML)
+        return ConversationHandler.END
+
+    def _format_team_grid(self, day, bitmaps: DayBitmaps, names: Dict[int, str]) -> List[str]:
+        """Render one day as <pre> hour grids, split to fit Telegram messages"""
+        title = f"📅 {day} ({WEEKDAYS[day.weekday()]})"
+        if not bitmaps:
+            return [f"{title}\nНикто не указал свободное время."]
+        
+        hour_masks = [minutes_mask(hour * 60, hour * 60 + 60) for hour in range(24)]
+        pad = " " * (TEAM_GRID_NAME_WIDTH + 1)
+        header = (
+            pad + "".join(str(hour // 10) for hour in range(24)) + "\n" +
+            pad + "".join(str(hour % 10) for hour in range(24))
+        )
+        
+        lines = []
+        for employee_id in bitmaps.employee_ids:
+            bits = bitmaps.bitmap(employee_id)
+            cells = "".join(
+                "█" if bits & mask == mask else "▒" if bits & mask else "·"
+                for mask in hour_masks
+            )
+            name = names.get(employee_id, f"User {employee_id}")[:TEAM_GRID_NAME_WIDTH]
+            lines.append(f"{html.escape(name.ljust(TEAM_GRID_NAME_WIDTH))} {cells}")
+        # Employees free for the whole hour; more than 9 is shown as +
+        counts = [len(bitmaps.free_for(mask)) for mask in hour_masks]
+        lines.append("Всего".ljust(TEAM_GRID_NAME_WIDTH) + " " + "".join(
+            str(count) if count < 10 else "+" for count in counts
+        ))
+        
+        messages, chunk = [], []
+        size = 0
+        for line in lines:
+            if chunk and size + len(line) > TEAM_GRID_MESSAGE_LIMIT:
+                messages.append(chunk)
+                chunk, size = [], 0
+            chunk.append(line)
+            size += len(line) + 1
+        messages.append(chunk)
+        return [f"{title}\n<pre>{header}\n" + "\n".join(chunk) + "</pre>" for chunk in messages]
+
     async def admin_list_workers(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Admin: List all workers"""
         import logging
@@ -2487,6 +2971,94 @@ class BotHandlers:
             await update.message.reply_text(f"Ошибка при обновлении имени: {str(e)}")
             return ConversationHandler.END
 
+    # ========== DIAGNOSTICS ==========
+
+    async def admin_slow_queries(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Admin: /slowqueries lists the slowest statements, /slowqueries N shows one with its plan"""
+        if not await self.is_admin(update.effective_user.id):
+            await update.message.reply_text("Команда доступна только администраторам.")
+            return
+        slow_log = self.db.slow_queries
+        if slow_log is None:
+            await update.message.reply_text("Журнал медленных запросов выключен (SLOW_QUERY_MS=0).")
+            return
+        statements = slow_log.top(SLOW_QUERIES_SHOWN)
+        if not statements:
+            await update.message.reply_text(f"Запросов дольше {slow_log.threshold_ms:.0f} мс пока не было.")
+            return
+
+        if context.args:
+            try:
+                entry = statements[int(context.args[0]) - 1]
+            except (ValueError, IndexError):
+                await update.message.reply_text(f"Укажите номер от 1 до {len(statements)}.")
+                return
+            text = (
+                f"{entry.count} раз, макс. {entry.max_ms:.0f} мс, всего {entry.total_ms / 1000:.1f} с\n"
+                f"Параметры: {html.escape(entry.params or '-')}\n"
+                f"<pre>{html.escape(entry.query[:SLOW_QUERY_MESSAGE_LIMIT // 2])}</pre>\n"
+            )
+            plan = entry.plan or "План еще не снят."
+            text += f"<pre>{html.escape(plan[:SLOW_QUERY_MESSAGE_LIMIT - len(text)])}</pre>"
+            await update.message.reply_text(text, parse_mode=ParseMode.HTML)
+            return
+
+        lines = [f"Медленные запросы (дольше {slow_log.threshold_ms:.0f} мс) по суммарному времени:"]
+        for n, entry in enumerate(statements, 1):
+            query = entry.query if len(entry.query) <= SLOW_QUERY_TEXT_LENGTH \
+                else entry.query[:SLOW_QUERY_TEXT_LENGTH] + "…"
+            lines.append(
+                f"\n{n}. {entry.count} раз, макс. {entry.max_ms:.0f} мс, всего {entry.total_ms / 1000:.1f} с"
+                f"{', есть план' if entry.plan else ''}\n<code>{html.escape(query)}</code>"
+            )
+        lines.append("\nПодробнее: /slowqueries N")
+        text = ""
+        for line in lines:
+            if len(text) + len(line) > SLOW_QUERY_MESSAGE_LIMIT:
+                break
+            text += line + "\n"
+        await update.message.reply_text(text, parse_mode=ParseMode.HTML)
+
+    async def admin_traces(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Admin: /traces lists the slowest recent updates, /traces N shows the spans of one"""
+        if not await self.is_admin(update.effective_user.id):
+            await update.message.reply_text("Команда доступна только администраторам.")
+            return
+        if self.tracer is None:
+            await update.message.reply_text("Трассировка выключена (TRACE_SAMPLE=0).")
+            return
+        traces = self.tracer.slowest(TRACES_SHOWN)
+        if not traces:
+            await update.message.reply_text("Трасс пока нет.")
+            return
+
+        if context.args:
+            try:
+                trace = traces[int(context.args[0]) - 1]
+            except (ValueError, IndexError):
+                await update.message.reply_text(f"Укажите номер от 1 до {len(traces)}.")
+                return
+            text = ""
+            for line in trace.format():
+                if len(text) + len(line) > TRACE_MESSAGE_LIMIT:
+                    text += "…\n"
+                    break
+                text += line + "\n"
+            await update.message.reply_text(f"<pre>{html.escape(text)}</pre>", parse_mode=ParseMode.HTML)
+            return
+
+        lines = [f"Самые медленные обновления (выборка {self.tracer.sample_rate:.0%}):"]
+        for n, trace in enumerate(traces, 1):
+            attrs = ' '.join(f"{key}={value}" for key, value in trace.root.attrs.items())
+            started = datetime.fromtimestamp(trace.started_at).strftime('%d.%m %H:%M:%S')
+            error = f", ошибка {trace.root.error}" if trace.root.error else ""
+            lines.append(
+                f"{n}. {trace.duration_ms:.0f} мс, {started}, спанов: {trace.span_count()}{error}\n"
+                f"<code>{html.escape(attrs)}</code>"
+            )
+        lines.append("\nПодробнее: /traces N")
+        await update.message.reply_text("\n".join(lines), parse_mode=ParseMode.HTML)
+
     async def cancel(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Операция отменена.")
         return ConversationHandler.END
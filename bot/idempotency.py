@@ -0,0 +1,109 @@
+import asyncio
+import functools
+import logging
+import time
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from telegram import Update
+from telegram.error import BadRequest
+
+logger = logging.getLogger(__name__)
+
+# (user_id, message_id, callback data)
+CallbackKey = Tuple[int, int, str]
+
+
+class CallbackDeduplicator:
+    """Absorb repeated taps on the same inline button within a short window.
+
+    The first callback for a key runs the handler; any identical callback that
+    arrives while it is running, or up to ``window`` seconds after it finished,
+    gets the first result instead of running the handler again.
+    """
+
+    def __init__(self, window: float = 5.0):
+        self.window = window
+        self.hits = 0
+        self.misses = 0
+        # key -> (expires_at, future with the handler result)
+        self._entries: Dict[CallbackKey, Tuple[float, asyncio.Future]] = {}
+
+    @staticmethod
+    def key_for(update: Update) -> Optional[CallbackKey]:
+        """Build dedup key for a callback update, None if it can't be keyed"""
+        query = update.callback_query
+        if query is None or query.message is None or update.effective_user is None:
+            return None
+        return (update.effective_user.id, query.message.message_id, query.data)
+
+    def _prune(self, now: float):
+        expired = [
+            key for key, (expires_at, future) in self._entries.items()
+            if future.done() and expires_at <= now
+        ]
+        for key in expired:
+            del self._entries[key]
+
+    async def run(self, key: CallbackKey, handler: Callable[[], Awaitable],
+                  on_duplicate: Callable[[], Awaitable] = None):
+        """Run handler once per key; duplicates get the first result"""
+        now = time.monotonic()
+        self._prune(now)
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            logger.info(f"Duplicate callback absorbed: {key} (dedup hits: {self.hits})")
+            if on_duplicate is not None:
+                await on_duplicate()
+            return await asyncio.shield(entry[1])
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        # Keep in-flight entries until they finish, whatever the window
+        self._entries[key] = (float('inf'), future)
+        try:
+            result = await handler()
+        except BaseException:
+            # Let the user retry after a failure; duplicates stay in the current state
+            self._entries.pop(key, None)
+            future.set_result(None)
+            raise
+        future.set_result(result)
+        self._entries[key] = (time.monotonic() + self.window, future)
+        return result
+
+    def stats(self) -> Dict[str, int]:
+        """Dedup counters for logging and monitoring"""
+        return {'hits': self.hits, 'misses': self.misses, 'tracked': len(self._entries)}
+
+
+def idempotent_callback(*prefixes: str):
+    """Decorator for BotHandlers callback methods that must not run twice per tap.
+
+    Only callbacks whose data starts with one of ``prefixes`` are deduplicated,
+    so navigation buttons like "back" keep working normally.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        async def wrapper(self, update: Update, context):
+            query = update.callback_query
+            key = None
+            if query is not None and query.data and query.data.startswith(prefixes):
+                key = self.callback_dedup.key_for(update)
+            if key is None:
+                return await method(self, update, context)
+
+            async def answer_duplicate():
+                try:
+                    await query.answer()
+                except BadRequest:
+                    pass
+
+            return await self.callback_dedup.run(
+                key,
+                lambda: method(self, update, context),
+                on_duplicate=answer_duplicate
+            )
+        return wrapper
+    return decorator
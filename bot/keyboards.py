@@ -1,6 +1,7 @@
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton
 from typing import List, Tuple, Optional, Dict
 from datetime import datetime, timedelta
+from .models import FreeTime
 
 
 def get_main_keyboard(is_admin: bool) -> ReplyKeyboardMarkup:
@@ -70,10 +71,12 @@ def get_date_selection_keyboard(days: int = 14, show_back: bool = False) -> Inli
 def get_slot_selection_keyboard(slots: List, show_address: bool = False, show_back: bool = False) -> InlineKeyboardMarkup:
     buttons = []
     for slot in slots:
-        slot_id = slot['id'] if isinstance(slot, dict) else slot[0]
-        start_time = slot['start_time'] if isinstance(slot, dict) else slot[2]
-        end_time = slot['end_time'] if isinstance(slot, dict) else slot[3]
-        if show_address and isinstance(slot, dict) and slot.get('address'):
+        # Slots may be row models / Records (mapping access) or plain tuples
+        is_tuple = isinstance(slot, (tuple, list))
+        slot_id = slot[0] if is_tuple else slot['id']
+        start_time = slot[2] if is_tuple else slot['start_time']
+        end_time = slot[3] if is_tuple else slot['end_time']
+        if show_address and not is_tuple and slot.get('address'):
             address_short = slot['address'][:20] + "..." if len(slot['address']) > 20 else slot['address']
             button_text = f"{start_time}-{end_time} ({address_short})"
         else:
@@ -208,7 +211,24 @@ def get_period_end_date_keyboard(start_date_str: str, show_back: bool = False) -
     return InlineKeyboardMarkup(buttons)
 
 
-def get_free_time_slots_keyboard(free_time_slots: List[Dict], show_back: bool = False) -> InlineKeyboardMarkup:
+def get_week_selection_keyboard(weeks: int = 4, show_back: bool = False) -> InlineKeyboardMarkup:
+    """Keyboard for selecting a week (Monday to Sunday) starting from the current one"""
+    today = datetime.now().date()
+    monday = today - timedelta(days=today.weekday())
+    buttons = []
+    for i in range(weeks):
+        start = monday + timedelta(weeks=i)
+        end = start + timedelta(days=6)
+        buttons.append([InlineKeyboardButton(
+            f"{start.strftime('%d.%m')} - {end.strftime('%d.%m')}",
+            callback_data=f"week_{start.strftime('%Y-%m-%d')}"
+        )])
+    if show_back:
+        buttons.append([InlineKeyboardButton("◀️ Назад", callback_data="back")])
+    return InlineKeyboardMarkup(buttons)
+
+
+def get_free_time_slots_keyboard(free_time_slots: List[FreeTime], show_back: bool = False) -> InlineKeyboardMarkup:
     """Keyboard for selecting free time slot to delete"""
     buttons = []
     for slot in free_time_slots:
@@ -220,3 +240,27 @@ def get_free_time_slots_keyboard(free_time_slots: List[Dict], show_back: bool =
     if show_back:
         buttons.append([InlineKeyboardButton("◀️ Назад", callback_data="back")])
     return InlineKeyboardMarkup(buttons)
+
+
+def get_export_kind_keyboard(show_back: bool = False) -> InlineKeyboardMarkup:
+    """Keyboard for selecting what to export"""
+    keyboard = [
+        [InlineKeyboardButton("Расписание", callback_data="export_schedule")],
+        [InlineKeyboardButton("Смены сотрудников", callback_data="export_shifts")],
+        [InlineKeyboardButton("Ведомость", callback_data="export_payroll")]
+    ]
+    if show_back:
+        keyboard.append([InlineKeyboardButton("◀️ Назад", callback_data="back")])
+    return InlineKeyboardMarkup(keyboard)
+
+
+def get_export_format_keyboard(show_back: bool = False) -> InlineKeyboardMarkup:
+    keyboard = [
+        [
+            InlineKeyboardButton("CSV", callback_data="format_csv"),
+            InlineKeyboardButton("Excel (XLSX)", callback_data="format_xlsx")
+        ]
+    ]
+    if show_back:
+        keyboard.append([InlineKeyboardButton("◀️ Назад", callback_data="back")])
+    return InlineKeyboardMarkup(keyboard)
@@ -0,0 +1,95 @@
+import asyncio
+import logging
+from datetime import date, timedelta
+from typing import Optional
+
+from .database import Database
+from .payroll import month_start
+
+logger = logging.getLogger(__name__)
+
+# Rows per transaction; small batches keep row locks short
+BATCH_SIZE = 1000
+# Pause between batches so bot queries get the pool in between
+BATCH_PAUSE = 0.05
+
+
+class MaintenanceJob:
+    """Periodic retention job running in the bot's event loop.
+
+    Every run creates the upcoming monthly partitions, deletes free time that
+    ended more than free_time_retention_days ago, then, if archive_after_days
+    is set, moves shifts and slots older than that (rounded down to a month
+    start) into the archive tables. Whole monthly partitions are archived and dropped at once;
+    rows left in unpartitioned tables are moved in small batches, each in its
+    own short transaction.
+    """
+
+    def __init__(self, db: Database, interval: float = 3600, free_time_retention_days: int = 0,
+                 archive_after_days: int = 0, batch_size: int = BATCH_SIZE):
+        self.db = db
+        self.interval = interval
+        self.free_time_retention_days = free_time_retention_days
+        self.archive_after_days = archive_after_days
+        self.batch_size = batch_size
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop(), name="maintenance")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Maintenance run failed: {e}", exc_info=True)
+            await asyncio.sleep(self.interval)
+
+    async def _drain(self, batch, cutoff: date) -> int:
+        """Call batch(cutoff, size) until it returns a partial batch"""
+        total = 0
+        while True:
+            count = await batch(cutoff, self.batch_size)
+            total += count
+            if count < self.batch_size:
+                return total
+            await asyncio.sleep(BATCH_PAUSE)
+
+    async def run_once(self, today: Optional[date] = None) -> dict:
+        today = today or date.today()
+        free_time_cutoff = today - timedelta(days=self.free_time_retention_days)
+
+        await self.db.ensure_partitions_ahead()
+        result = {
+            'free_time_purged': await self._drain(self.db.purge_free_time_batch, free_time_cutoff),
+            'partitions_archived': 0,
+            'shifts_archived': 0,
+            'slots_archived': 0,
+        }
+        # Archiving drops the live partitions, so it only runs when configured
+        archive_cutoff = None
+        if self.archive_after_days > 0:
+            archive_cutoff = month_start(today - timedelta(days=self.archive_after_days))
+            result['partitions_archived'] = await self.db.archive_partitions_before(archive_cutoff)
+            result['shifts_archived'] = await self._drain(self.db.archive_shifts_batch, archive_cutoff)
+            result['slots_archived'] = await self._drain(self.db.archive_slots_batch, archive_cutoff)
+        if result['free_time_purged']:
+            logger.info(f"Maintenance: purged {result['free_time_purged']} free time rows before {free_time_cutoff}")
+        if any(result[key] for key in ('partitions_archived', 'shifts_archived', 'slots_archived')):
+            logger.info(
+                f"Maintenance: archived {result['partitions_archived']} monthly partitions, "
+                f"{result['shifts_archived']} shifts and {result['slots_archived']} slots before {archive_cutoff}"
+            )
+        return result
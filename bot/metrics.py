@@ -0,0 +1,288 @@
+import asyncio
+import bisect
+import hashlib
+import logging
+import re
+import time
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from telegram.ext import Application, BaseHandler, ConversationHandler
+from telegram.request import BaseRequest, RequestData
+
+logger = logging.getLogger(__name__)
+
+# Seconds; from cache hits and single-row lookups up to reports and exports
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+TABLE_RE = re.compile(r'\b(?:FROM|INTO|UPDATE)\s+([A-Za-z_][A-Za-z0-9_]*)', re.IGNORECASE)
+MAX_REQUEST_LINE = 8192
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Tuple[str, ...], values: tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def handler_states(application: Application, state_names: Dict[object, str]) -> Iterator[Tuple[BaseHandler, str]]:
+    """Every registered handler with a callback and the conversation state it is registered for.
+
+    The state is "entry" for entry points, "fallback" for fallbacks and "-"
+    outside conversations.
+    """
+    for group in application.handlers.values():
+        for handler in group:
+            if isinstance(handler, ConversationHandler):
+                for entry in handler.entry_points:
+                    yield entry, 'entry'
+                for state, state_handlers in handler.states.items():
+                    for state_handler in state_handlers:
+                        yield state_handler, state_names.get(state, str(state))
+                for fallback in handler.fallbacks:
+                    yield fallback, 'fallback'
+            elif getattr(handler, 'callback', None) is not None:
+                yield handler, '-'
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, labels: tuple = (), amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for labels, value in self._values.items():
+            yield f"{self.name}{_format_labels(self.labels, labels)} {_format_value(value)}"
+
+
+class Histogram:
+    """Fixed-bucket histogram; observe() is a bisect and two additions"""
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = (), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts (last one is +Inf), sum]
+        self._series: Dict[tuple, list] = {}
+
+    def observe(self, labels: tuple, value: float):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, (counts, total) in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else _format_value(bound)
+                bucket_labels = _format_labels(self.labels, labels, f'le="{le}"')
+                yield f"{self.name}_bucket{bucket_labels} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labels, labels)} {_format_value(total)}"
+            yield f"{self.name}_count{_format_labels(self.labels, labels)} {cumulative}"
+
+
+class Gauge:
+    """Value read at scrape time from collect() -> {labels: value}"""
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...], collect: Callable[[], Dict[tuple, float]]):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.collect = collect
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} gauge"
+        try:
+            values = self.collect()
+        except Exception as e:
+            logger.warning(f"Gauge {self.name} failed: {e}")
+            return
+        for labels, value in values.items():
+            yield f"{self.name}{_format_labels(self.labels, labels)} {_format_value(value)}"
+
+
+class InstrumentedRequest(BaseRequest):
+    """Bot API transport timing every call by method and counting responses by status"""
+
+    def __init__(self, inner: BaseRequest, metrics: 'Metrics'):
+        self.inner = inner
+        self.metrics = metrics
+
+    @property
+    def read_timeout(self) -> Optional[float]:
+        return self.inner.read_timeout
+
+    async def initialize(self):
+        await self.inner.initialize()
+
+    async def shutdown(self):
+        await self.inner.shutdown()
+
+    async def do_request(self, url: str, method: str, request_data: Optional[RequestData] = None,
+                         read_timeout=BaseRequest.DEFAULT_NONE, write_timeout=BaseRequest.DEFAULT_NONE,
+                         connect_timeout=BaseRequest.DEFAULT_NONE,
+                         pool_timeout=BaseRequest.DEFAULT_NONE) -> Tuple[int, bytes]:
+        api_method = url.rsplit('/', 1)[-1]
+        started = time.perf_counter()
+        status = 'error'
+        try:
+            code, payload = await self.inner.do_request(
+                url, method, request_data, read_timeout=read_timeout, write_timeout=write_timeout,
+                connect_timeout=connect_timeout, pool_timeout=pool_timeout
+            )
+            status = str(code)
+            return code, payload
+        finally:
+            self.metrics.telegram_seconds.observe((api_method,), time.perf_counter() - started)
+            self.metrics.telegram_responses.inc((api_method, status))
+
+
+class Metrics:
+    """The bot's metrics and the HTTP endpoint serving them in Prometheus text format.
+
+    Hot paths only touch dicts: a histogram observation or a counter
+    increment per handler call, database statement and Bot API request.
+    Gauges are read when /metrics is scraped. GET /queries lists the SQL of
+    the query ids used as labels.
+    """
+
+    def __init__(self):
+        self.handler_seconds = Histogram(
+            'bot_handler_duration_seconds', "Time spent in BotHandlers callbacks", ('handler', 'state'))
+        self.handler_errors = Counter(
+            'bot_handler_errors_total', "BotHandlers callbacks that raised", ('handler', 'state'))
+        self.db_query_seconds = Histogram(
+            'bot_db_query_duration_seconds', "Database statement time", ('op', 'table', 'query'))
+        self.db_query_errors = Counter(
+            'bot_db_query_errors_total', "Database statements that failed", ('op', 'table', 'query'))
+        self.telegram_seconds = Histogram(
+            'bot_telegram_request_duration_seconds', "Bot API call time, getUpdates includes the long poll",
+            ('method',))
+        self.telegram_responses = Counter(
+            'bot_telegram_responses_total', "Bot API responses by HTTP status (429 = flood control)",
+            ('method', 'status'))
+        self._gauges: List[Gauge] = []
+        # SQL text -> (op, table, query id); ids -> normalized SQL for /queries
+        self._query_labels: Dict[str, Tuple[str, str, str]] = {}
+        self.queries: Dict[str, str] = {}
+        self.routes: Dict[str, Tuple[str, Callable[[], str]]] = {
+            '/metrics': (CONTENT_TYPE, self.render),
+            '/queries': ('text/plain; charset=utf-8', self.render_queries),
+        }
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    def add_gauge(self, name: str, help_text: str, labels: Tuple[str, ...], collect: Callable[[], Dict[tuple, float]]):
+        self._gauges.append(Gauge(name, help_text, labels, collect))
+
+    # ---- database ----
+
+    def _labels_for(self, query: str) -> Tuple[str, str, str]:
+        labels = self._query_labels.get(query)
+        if labels is None:
+            normalized = ' '.join(query.split())
+            query_id = hashlib.sha1(normalized.encode()).hexdigest()[:8]
+            table = TABLE_RE.search(normalized)
+            labels = (normalized.split(' ', 1)[0].upper(), table.group(1) if table else '', query_id)
+            self._query_labels[query] = labels
+            self.queries[query_id] = normalized
+        return labels
+
+    def observe_query(self, record):
+        """asyncpg query logger (see Database.add_query_logger)"""
+        labels = self._labels_for(record.query)
+        self.db_query_seconds.observe(labels, record.elapsed)
+        if record.exception is not None:
+            self.db_query_errors.inc(labels)
+
+    # ---- handlers ----
+
+    def _timed(self, callback: Callable, labels: Tuple[str, str]) -> Callable:
+        async def timed(update, context):
+            started = time.perf_counter()
+            try:
+                return await callback(update, context)
+            except Exception:
+                self.handler_errors.inc(labels)
+                raise
+            finally:
+                self.handler_seconds.observe(labels, time.perf_counter() - started)
+        timed.__name__ = getattr(callback, '__name__', 'callback')
+        return timed
+
+    def instrument_application(self, application: Application, state_names: Dict[object, str]):
+        """Time every handler callback, labelled with its name and conversation state (see handler_states)"""
+        for handler, state in handler_states(application, state_names):
+            name = getattr(handler.callback, '__name__', type(handler).__name__)
+            handler.callback = self._timed(handler.callback, (name, state))
+
+    def instrument_request(self, request: BaseRequest) -> BaseRequest:
+        return InstrumentedRequest(request, self)
+
+    # ---- exposition ----
+
+    def render(self) -> str:
+        lines = []
+        for metric in (self.handler_seconds, self.handler_errors, self.db_query_seconds, self.db_query_errors,
+                       self.telegram_seconds, self.telegram_responses, *self._gauges):
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def render_queries(self) -> str:
+        return ''.join(f"{query_id} {sql}\n" for query_id, sql in sorted(self.queries.items()))
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await reader.readline()
+            if len(request_line) > MAX_REQUEST_LINE:
+                return
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            parts = request_line.decode('latin-1').split()
+            route = self.routes.get(parts[1].split('?', 1)[0]) if len(parts) >= 2 and parts[0] == 'GET' else None
+            if route is None:
+                status, content_type, body = '404 Not Found', 'text/plain', b'Not found\n'
+            else:
+                content_type, render = route
+                status, body = '200 OK', render().encode()
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host: str, port: int):
+        self._server = await asyncio.start_server(self._handle_connection, host, port)
+        logger.info(f"Metrics on http://{host}:{port}/metrics")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
@@ -0,0 +1,115 @@
+from datetime import date, time
+from typing import Any, Dict, Optional
+
+
+class Row:
+    """Base for compact row models built from asyncpg records.
+
+    Models keep the mapping-style access handlers already use
+    (``slot['date']``, ``slot.get('address')``), but store fields in
+    ``__slots__`` instead of a per-row dict. Columns a query didn't select are
+    left unset and behave like missing dict keys.
+    """
+    __slots__ = ()
+
+    def __init__(self, **fields):
+        for key, value in fields.items():
+            setattr(self, key, value)
+
+    @classmethod
+    def from_record(cls, record):
+        """Build model from an asyncpg Record (or any mapping)"""
+        obj = cls.__new__(cls)
+        for key, value in record.items():
+            setattr(obj, key, value)
+        return obj
+
+    def __getitem__(self, key: str) -> Any:
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return getattr(self, key, default)
+
+    def __contains__(self, key: str) -> bool:
+        return hasattr(self, key)
+
+    def keys(self):
+        return [name for name in self.__slots__ if hasattr(self, name)]
+
+    def __copy__(self):
+        obj = type(self).__new__(type(self))
+        for name in self.keys():
+            setattr(obj, name, getattr(self, name))
+        return obj
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.keys()}
+
+    def __eq__(self, other):
+        if not isinstance(other, Row):
+            return NotImplemented
+        return type(self) is type(other) and self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.keys())
+        return f"{type(self).__name__}({fields})"
+
+
+class User(Row):
+    __slots__ = ('user_id', 'username', 'full_name', 'is_admin')
+
+    user_id: int
+    username: Optional[str]
+    full_name: Optional[str]
+    is_admin: Optional[bool]
+
+
+class Slot(Row):
+    """Schedule slot; employee_id/full_name are set by queries joining shifts"""
+    __slots__ = (
+        'id', 'date', 'start_time', 'end_time', 'address',
+        'location_latitude', 'location_longitude', 'required_employees', 'is_open',
+        'employee_id', 'full_name'
+    )
+
+    id: int
+    date: date
+    start_time: time
+    end_time: time
+    address: Optional[str]
+    location_latitude: Optional[float]
+    location_longitude: Optional[float]
+    required_employees: int
+    is_open: bool
+    employee_id: Optional[int]
+    full_name: Optional[str]
+
+
+class Shift(Row):
+    """Assigned shift; address/required_employees come from the joined slot"""
+    __slots__ = (
+        'id', 'slot_id', 'employee_id', 'date', 'start_time', 'end_time',
+        'address', 'required_employees'
+    )
+
+    id: int
+    slot_id: int
+    employee_id: int
+    date: date
+    start_time: time
+    end_time: time
+    address: Optional[str]
+    required_employees: int
+
+
+class FreeTime(Row):
+    __slots__ = ('id', 'employee_id', 'date', 'start_time', 'end_time')
+
+    id: int
+    employee_id: int
+    date: date
+    start_time: time
+    end_time: time
@@ -0,0 +1,33 @@
+import re
+from datetime import date, time
+from typing import Tuple
+
+# Strict formats accepted from users and callback data
+_DATE_RE = re.compile(r'^(\d{4})-(\d{2})-(\d{2})$')
+_TIME_RE = re.compile(r'^([01]\d|2[0-3]):([0-5]\d)(?::([0-5]\d))?$')
+
+
+def parse_date(value: str) -> date:
+    """Parse YYYY-MM-DD into a date, raise ValueError otherwise"""
+    match = _DATE_RE.match(value.strip())
+    if not match:
+        raise ValueError(f"Invalid date: {value!r}")
+    year, month, day = match.groups()
+    return date(int(year), int(month), int(day))
+
+
+def parse_time(value: str) -> time:
+    """Parse HH:MM or HH:MM:SS into a time, raise ValueError otherwise"""
+    match = _TIME_RE.match(value.strip())
+    if not match:
+        raise ValueError(f"Invalid time: {value!r}")
+    hour, minute, second = match.groups()
+    return time(int(hour), int(minute), int(second or 0))
+
+
+def parse_date_range(text: str) -> Tuple[date, date]:
+    """Parse "YYYY-MM-DD YYYY-MM-DD" into (start, end)"""
+    parts = text.split()
+    if len(parts) != 2:
+        raise ValueError(f"Invalid date range: {text!r}")
+    return parse_date(parts[0]), parse_date(parts[1])
@@ -0,0 +1,43 @@
+from datetime import date, timedelta
+from typing import List, Optional, Tuple
+
+DateRange = Tuple[date, date]
+
+
+def month_start(day: date) -> date:
+    return day.replace(day=1)
+
+
+def next_month(day: date) -> date:
+    """First day of the month after the one containing day"""
+    if day.month == 12:
+        return date(day.year + 1, 1, 1)
+    return date(day.year, day.month + 1, 1)
+
+
+def split_period(start_date: date, end_date: date, today: date) -> Tuple[List[date], Optional[DateRange], Optional[DateRange]]:
+    """Split a period into closed months and the live parts around them.
+
+    Returns (months, head, tail): first days of the months that lie fully
+    inside the period and are over as of ``today`` (served from payroll
+    snapshots), plus the partial ranges before and after them that must be
+    aggregated from live shifts. head/tail are None when empty. If no closed
+    month fits, the whole period is returned as head.
+    """
+    if start_date > end_date:
+        return [], None, None
+
+    current_month = month_start(today)
+    month = start_date if start_date.day == 1 else next_month(start_date)
+    months = []
+    while next_month(month) <= current_month and next_month(month) - timedelta(days=1) <= end_date:
+        months.append(month)
+        month = next_month(month)
+
+    if not months:
+        return [], (start_date, end_date), None
+
+    head = (start_date, months[0] - timedelta(days=1)) if start_date < months[0] else None
+    tail_start = next_month(months[-1])
+    tail = (tail_start, end_date) if tail_start <= end_date else None
+    return months, head, tail
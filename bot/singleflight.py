@@ -0,0 +1,93 @@
+import asyncio
+import contextvars
+import copy
+import functools
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+def private_copy(value: Any) -> Any:
+    """Copy of a shared result for one caller.
+
+    Lists and dicts are rebuilt and objects defining __copy__ (row models)
+    copied; asyncpg Records, tuples and scalars are immutable and shared.
+    """
+    if isinstance(value, list):
+        return [private_copy(item) for item in value]
+    if isinstance(value, dict):
+        return {key: private_copy(item) for key, item in value.items()}
+    if hasattr(value, '__copy__'):
+        return copy.copy(value)
+    return value
+
+
+class _Flight:
+    __slots__ = ('task', 'waiters')
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Coalesce identical concurrent calls into one in-flight awaitable.
+
+    While a call for a key is running, every other caller with the same key
+    waits for that call and receives the same result (or exception). When
+    the call was shared, each caller gets its own copy of the result (see
+    private_copy). Cancelling one caller doesn't cancel the shared call.
+    Nothing is cached once the call completes.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, _Flight] = {}
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    async def do(self, name: str, key: Hashable, fn: Callable[[], Awaitable]):
+        stats = self._stats.setdefault(name, {'calls': 0, 'executed': 0, 'coalesced': 0})
+        stats['calls'] += 1
+
+        flight = self._inflight.get(key)
+        if flight is not None:
+            stats['coalesced'] += 1
+        else:
+            stats['executed'] += 1
+            # The call runs in its own task, so cancelling the caller that
+            # started it doesn't cancel it for everyone else waiting. The
+            # empty context keeps it out of that caller's trace: its
+            # statements belong to every waiter
+            task = asyncio.get_running_loop().create_task(fn(), context=contextvars.Context())
+            flight = self._inflight[key] = _Flight(task)
+            task.add_done_callback(functools.partial(self._finished, key, flight))
+        flight.waiters += 1
+        result = await asyncio.shield(flight.task)
+        # No one can join a finished flight, so waiters is final here
+        return private_copy(result) if flight.waiters > 1 else result
+
+    def _finished(self, key: Hashable, flight: _Flight, task: asyncio.Task):
+        if self._inflight.get(key) is flight:
+            del self._inflight[key]
+        if not task.cancelled():
+            # Mark as retrieved so asyncio doesn't warn when every caller was cancelled
+            task.exception()
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Per-name counters: calls, executed queries and coalesced callers"""
+        return {name: dict(counters) for name, counters in self._stats.items()}
+
+
+def coalesced(method):
+    """Decorator for Database read methods: share one query between identical concurrent calls.
+
+    Callers that shared a query get their own copies of the result.
+    """
+    name = method.__name__
+
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        key = (name, args, tuple(sorted(kwargs.items())))
+        try:
+            hash(key)
+        except TypeError:
+            return await method(self, *args, **kwargs)
+        return await self._singleflight.do(name, key, lambda: method(self, *args, **kwargs))
+    return wrapper
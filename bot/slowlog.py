@@ -0,0 +1,125 @@
+import asyncio
+import contextvars
+import logging
+import random
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Statements kept in the per-statement statistics; the least recent slow one is dropped
+MAX_STATEMENTS = 200
+# A captured plan is refreshed by a new sample after this many seconds
+PLAN_MAX_AGE = 3600
+# Only plain reads are explained: EXPLAIN ANALYZE executes the statement
+EXPLAINABLE = ('SELECT', 'WITH')
+
+
+def redact(args) -> str:
+    """Describe query parameters by type only, e.g. "$1=int $2=str(12)" """
+    parts = []
+    for n, value in enumerate(args or (), 1):
+        if value is None:
+            kind = 'null'
+        elif isinstance(value, str):
+            kind = f"str({len(value)})"
+        elif isinstance(value, (list, tuple)):
+            kind = f"{type(value).__name__}[{len(value)}]"
+        else:
+            kind = type(value).__name__
+        parts.append(f"${n}={kind}")
+    return ' '.join(parts)
+
+
+def normalize(query: str) -> str:
+    return ' '.join(query.split())
+
+
+def is_explainable(query: str) -> bool:
+    """A single read statement; scripts such as the pool's reset query are skipped"""
+    return query.upper().startswith(EXPLAINABLE) and ';' not in query.rstrip('; ')
+
+
+class SlowStatement:
+    __slots__ = ('query', 'count', 'total_ms', 'max_ms', 'last_seen', 'params', 'plan', 'plan_at')
+
+    def __init__(self, query: str):
+        self.query = query
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.last_seen = 0.0
+        # Redacted parameters of the slowest execution
+        self.params = ''
+        self.plan: Optional[str] = None
+        self.plan_at = 0.0
+
+
+class SlowQueryLog:
+    """Log statements slower than threshold_ms and keep per-statement statistics.
+
+    An instance is an asyncpg query logger (see Database.add_query_logger).
+    Parameters are never logged, only their types. For a sample of slow
+    single-statement SELECTs, explain(query, args) is run in the background to capture an
+    EXPLAIN ANALYZE plan, at most one at a time.
+    """
+
+    def __init__(self, threshold_ms: float, explain: Optional[Callable[[str, tuple], Awaitable[str]]] = None,
+                 explain_sample: float = 0):
+        self.threshold_ms = threshold_ms
+        self.explain = explain
+        self.explain_sample = explain_sample
+        self._statements: Dict[str, SlowStatement] = {}
+        self._explaining: Optional[asyncio.Task] = None
+
+    def __call__(self, record):
+        elapsed_ms = record.elapsed * 1000
+        if elapsed_ms < self.threshold_ms or record.query.lstrip()[:7].upper() == 'EXPLAIN':
+            return
+        query = normalize(record.query)
+        params = redact(record.args)
+        logger.warning(f"Slow query {elapsed_ms:.0f} ms: {query[:500]} [{params}]")
+
+        entry = self._statements.get(query)
+        if entry is None:
+            if len(self._statements) >= MAX_STATEMENTS:
+                oldest = min(self._statements.values(), key=lambda e: e.last_seen)
+                del self._statements[oldest.query]
+            entry = self._statements[query] = SlowStatement(query)
+        entry.count += 1
+        entry.total_ms += elapsed_ms
+        entry.last_seen = time.time()
+        if elapsed_ms >= entry.max_ms:
+            entry.max_ms = elapsed_ms
+            entry.params = params
+
+        if self._should_explain(entry):
+            # A fresh context, so the EXPLAIN statements aren't recorded in the caller's trace
+            self._explaining = asyncio.get_running_loop().create_task(
+                self._capture_plan(entry, record.query, tuple(record.args or ())),
+                context=contextvars.Context()
+            )
+
+    def _should_explain(self, entry: SlowStatement) -> bool:
+        if self.explain is None or self.explain_sample <= 0 or not is_explainable(entry.query):
+            return False
+        if self._explaining is not None and not self._explaining.done():
+            return False
+        if entry.plan is not None and time.time() - entry.plan_at < PLAN_MAX_AGE:
+            return False
+        return random.random() < self.explain_sample
+
+    async def _capture_plan(self, entry: SlowStatement, query: str, args: tuple):
+        try:
+            entry.plan = await self.explain(query, args)
+            entry.plan_at = time.time()
+        except Exception as e:
+            logger.info(f"Could not capture plan of a slow query: {e}")
+
+    def top(self, limit: int = 10) -> List[SlowStatement]:
+        """Slow statements by total time spent, slowest first"""
+        return sorted(self._statements.values(), key=lambda e: e.total_ms, reverse=True)[:limit]
+
+    async def close(self):
+        if self._explaining is not None and not self._explaining.done():
+            self._explaining.cancel()
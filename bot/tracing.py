@@ -0,0 +1,274 @@
+import asyncio
+import contextvars
+import functools
+import json
+import logging
+import random
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import Application
+from telegram.request import BaseRequest, RequestData
+
+from .metrics import handler_states
+from .slowlog import normalize
+
+logger = logging.getLogger(__name__)
+
+# Children kept per span; a broadcast would otherwise record every sendMessage
+MAX_CHILDREN = 200
+SQL_TEXT_LENGTH = 200
+
+_current_span: contextvars.ContextVar[Optional['Span']] = contextvars.ContextVar('current_span', default=None)
+
+
+class Span:
+    __slots__ = ('name', 'attrs', 'started', 'duration', 'error', 'children', 'dropped')
+
+    def __init__(self, name: str, attrs: Optional[Dict] = None, started: Optional[float] = None):
+        self.name = name
+        self.attrs = attrs or {}
+        self.started = time.perf_counter() if started is None else started
+        self.duration = 0.0
+        self.error: Optional[str] = None
+        self.children: List['Span'] = []
+        # Children not recorded because of MAX_CHILDREN
+        self.dropped = 0
+
+    def add_child(self, span: 'Span') -> bool:
+        if len(self.children) >= MAX_CHILDREN:
+            self.dropped += 1
+            return False
+        self.children.append(span)
+        return True
+
+    def to_dict(self, origin: float) -> Dict:
+        """Offsets and durations in milliseconds from origin (the root's start)"""
+        data = {
+            'name': self.name,
+            'offset_ms': round((self.started - origin) * 1000, 3),
+            'duration_ms': round(self.duration * 1000, 3),
+        }
+        if self.attrs:
+            data['attrs'] = self.attrs
+        if self.error:
+            data['error'] = self.error
+        if self.children:
+            data['children'] = [child.to_dict(origin) for child in self.children]
+        if self.dropped:
+            data['dropped'] = self.dropped
+        return data
+
+
+class Trace(NamedTuple):
+    started_at: float
+    root: Span
+
+    @property
+    def duration_ms(self) -> float:
+        return self.root.duration * 1000
+
+    def span_count(self) -> int:
+        def count(span: Span) -> int:
+            return 1 + span.dropped + sum(count(child) for child in span.children)
+        return count(self.root)
+
+    def format(self) -> List[str]:
+        """One line per span, indented by depth: duration, start offset, name and attributes"""
+        lines = []
+
+        def walk(span: Span, depth: int):
+            attrs = ' '.join(f"{key}={value}" for key, value in span.attrs.items())
+            error = f" ! {span.error}" if span.error else ''
+            lines.append(
+                f"{'  ' * depth}{span.duration * 1000:.1f} ms +{(span.started - self.root.started) * 1000:.0f}"
+                f" {span.name} {attrs}".rstrip() + error
+            )
+            for child in sorted(span.children, key=lambda c: c.started):
+                walk(child, depth + 1)
+            if span.dropped:
+                lines.append(f"{'  ' * (depth + 1)}… {span.dropped} more")
+
+        walk(self.root, 0)
+        return lines
+
+
+def describe_update(update: object) -> Dict:
+    """Root span attributes; message text is not recorded, only command names"""
+    if not isinstance(update, Update):
+        return {}
+    attrs = {'update_id': update.update_id}
+    if update.effective_user is not None:
+        attrs['user'] = update.effective_user.id
+    if update.callback_query is not None:
+        attrs['callback'] = (update.callback_query.data or '')[:64]
+    elif update.message is not None and update.message.text and update.message.text.startswith('/'):
+        attrs['command'] = update.message.text.split(maxsplit=1)[0]
+    return attrs
+
+
+class TracedRequest(BaseRequest):
+    """Bot API transport recording a span per call made while an update is traced"""
+
+    def __init__(self, inner: BaseRequest, tracer: 'Tracer'):
+        self.inner = inner
+        self.tracer = tracer
+
+    @property
+    def read_timeout(self) -> Optional[float]:
+        return self.inner.read_timeout
+
+    async def initialize(self):
+        await self.inner.initialize()
+
+    async def shutdown(self):
+        await self.inner.shutdown()
+
+    async def do_request(self, url: str, method: str, request_data: Optional[RequestData] = None,
+                         read_timeout=BaseRequest.DEFAULT_NONE, write_timeout=BaseRequest.DEFAULT_NONE,
+                         connect_timeout=BaseRequest.DEFAULT_NONE,
+                         pool_timeout=BaseRequest.DEFAULT_NONE) -> Tuple[int, bytes]:
+        with self.tracer.span(f"telegram.{url.rsplit('/', 1)[-1]}") as span:
+            code, payload = await self.inner.do_request(
+                url, method, request_data, read_timeout=read_timeout, write_timeout=write_timeout,
+                connect_timeout=connect_timeout, pool_timeout=pool_timeout
+            )
+            if span is not None:
+                span.attrs['status'] = code
+            return code, payload
+
+
+class Tracer:
+    """Per-update traces: a root span per sampled update with child spans for
+    handler callbacks, Database calls with their SQL statements, and Bot API
+    requests.
+
+    The current span is kept in a context variable, so spans follow the
+    update through awaits and into tasks it starts. Finished traces go to an
+    in-memory ring buffer of the last buffer_size traces and, with path, are
+    appended to that file as JSON lines.
+    """
+
+    def __init__(self, sample_rate: float, buffer_size: int = 500, path: Optional[str] = None):
+        self.sample_rate = sample_rate
+        self.path = path
+        self._traces: deque = deque(maxlen=buffer_size)
+        self._file = None
+
+    @contextmanager
+    def trace(self, name: str, **attrs) -> Iterator[Optional[Span]]:
+        """Root span; yields None when the trace is not sampled"""
+        if _current_span.get() is not None or random.random() >= self.sample_rate:
+            yield None
+            return
+        started_at = time.time()
+        root = Span(name, attrs)
+        token = _current_span.set(root)
+        try:
+            yield root
+        except BaseException as e:
+            root.error = type(e).__name__
+            raise
+        finally:
+            root.duration = time.perf_counter() - root.started
+            _current_span.reset(token)
+            # Query loggers of the last statements are already scheduled with call_soon; export after them
+            asyncio.get_running_loop().call_soon(self._export, Trace(started_at, root))
+
+    @contextmanager
+    def span(self, name: str, **attrs) -> Iterator[Optional[Span]]:
+        """Child of the current span; yields None outside a sampled trace"""
+        parent = _current_span.get()
+        if parent is None:
+            yield None
+            return
+        span = Span(name, attrs)
+        if not parent.add_child(span):
+            yield None
+            return
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = type(e).__name__
+            raise
+        finally:
+            span.duration = time.perf_counter() - span.started
+            _current_span.reset(token)
+
+    def observe_query(self, record):
+        """asyncpg query logger (see Database.add_query_logger): a span per SQL statement.
+
+        The logger runs just after the statement finishes, so the start is
+        derived from the elapsed time.
+        """
+        parent = _current_span.get()
+        if parent is None:
+            return
+        span = Span('sql', {'query': normalize(record.query)[:SQL_TEXT_LENGTH]},
+                    started=time.perf_counter() - record.elapsed)
+        span.duration = record.elapsed
+        if record.exception is not None:
+            span.error = type(record.exception).__name__
+        parent.add_child(span)
+
+    # ---- instrumentation ----
+
+    def _traced(self, func: Callable, name: str, **attrs) -> Callable:
+        @functools.wraps(func)
+        async def traced(*args, **kwargs):
+            if _current_span.get() is None:
+                return await func(*args, **kwargs)
+            with self.span(name, **attrs):
+                return await func(*args, **kwargs)
+        return traced
+
+    def instrument_database(self, db):
+        """Record a span for every public coroutine method of db"""
+        for name, attr in vars(type(db)).items():
+            if not name.startswith('_') and asyncio.iscoroutinefunction(attr):
+                setattr(db, name, self._traced(getattr(db, name), f"db.{name}"))
+
+    def instrument_application(self, application: Application, state_names: Dict[object, str]):
+        """Open a trace per update and record a span per handler callback"""
+        for handler, state in handler_states(application, state_names):
+            name = getattr(handler.callback, '__name__', type(handler).__name__)
+            handler.callback = self._traced(handler.callback, f"handler.{name}", state=state)
+
+        process_update = application.process_update
+
+        async def traced_process_update(update: object):
+            with self.trace('update', **describe_update(update)):
+                await process_update(update)
+
+        application.process_update = traced_process_update
+
+    def instrument_request(self, request: BaseRequest) -> BaseRequest:
+        return TracedRequest(request, self)
+
+    # ---- export ----
+
+    def _export(self, trace: Trace):
+        self._traces.append(trace)
+        if self.path is None:
+            return
+        try:
+            if self._file is None:
+                self._file = open(self.path, 'a', encoding='utf-8')
+            record = {'started_at': trace.started_at, **trace.root.to_dict(trace.root.started)}
+            self._file.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+            self._file.flush()
+        except OSError as e:
+            logger.warning(f"Could not write trace to {self.path}: {e}")
+
+    def slowest(self, limit: int = 10) -> List[Trace]:
+        """Slowest traces in the buffer, slowest first"""
+        return sorted(self._traces, key=lambda trace: trace.root.duration, reverse=True)[:limit]
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
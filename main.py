@@ -1,11 +1,18 @@
 import os
 import logging
 import asyncio
+import argparse
 from dotenv import load_dotenv
+from typing import Optional
+from urllib.parse import urlsplit
 from telegram import Update
+from telegram.request import BaseRequest, HTTPXRequest
 from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, ConversationHandler, filters, ContextTypes
 from bot.database import Database
 from bot.handlers import BotHandlers
+from bot.maintenance import MaintenanceJob
+from bot.metrics import Metrics
+from bot.tracing import Tracer
 
 # Load environment variables (override=False means don't overwrite existing env vars)
 load_dotenv(override=False)
@@ -29,8 +36,33 @@ if admin_ids_str:
 else:
     ADMIN_IDS = []
 
-if not BOT_TOKEN:
-    raise ValueError("BOT_TOKEN not found in environment variables")
+# Retention: free time is kept until it has passed; archiving slots/shifts is off unless ARCHIVE_AFTER_DAYS is set
+MAINTENANCE_INTERVAL_MINUTES = int(os.getenv('MAINTENANCE_INTERVAL_MINUTES', '60'))
+FREE_TIME_RETENTION_DAYS = int(os.getenv('FREE_TIME_RETENTION_DAYS', '0'))
+ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', '0'))
+
+# Statements slower than this are logged and shown by /slowqueries (0 turns it off);
+# with SLOW_QUERY_EXPLAIN_SAMPLE set, a share of them is run again with EXPLAIN ANALYZE to capture the plan
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', '200'))
+SLOW_QUERY_EXPLAIN_SAMPLE = float(os.getenv('SLOW_QUERY_EXPLAIN_SAMPLE', '0'))
+
+# Prometheus metrics on http://METRICS_LISTEN:METRICS_PORT/metrics (0 turns them off)
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+METRICS_LISTEN = os.getenv('METRICS_LISTEN', '127.0.0.1')
+
+# Share of updates traced (0 turns tracing off); the last TRACE_BUFFER traces are kept
+# for /traces and, with TRACE_FILE, appended to that file as JSON lines
+TRACE_SAMPLE = float(os.getenv('TRACE_SAMPLE', '0'))
+TRACE_BUFFER = int(os.getenv('TRACE_BUFFER', '500'))
+TRACE_FILE = os.getenv('TRACE_FILE')
+
+# Bot API server; point at a local stand-in (benchmarks/fake_bot_api.py) for offline tests
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL')
+# Receive updates by webhook instead of long polling when WEBHOOK_URL is set
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
 
 # Database will be initialized in main()
 # Use environment variable if set (from docker-compose), otherwise use .env or default
@@ -52,33 +84,46 @@ from bot.handlers import (
     WAITING_EVENT_ADDRESS, WAITING_EMPLOYEE_SLOT_SELECTION,
     WAITING_FREE_TIME_EMPLOYEE, WAITING_EVENT_EMPLOYEES_COUNT,
     WAITING_FREE_TIME_DELETE_DATE, WAITING_FREE_TIME_DELETE_SLOT,
-    WAITING_EDIT_NAME_EMPLOYEE, WAITING_EDIT_NAME_INPUT
+    WAITING_EDIT_NAME_EMPLOYEE, WAITING_EDIT_NAME_INPUT,
+    WAITING_AUTOSCHEDULE_PERIOD, WAITING_AUTOSCHEDULE_CONFIRM,
+    WAITING_FREE_TIME_WEEK,
+    WAITING_EXPORT_KIND, WAITING_EXPORT_EMPLOYEE, WAITING_EXPORT_PERIOD,
+    WAITING_EXPORT_RATE, WAITING_EXPORT_FORMAT,
+    STATE_NAMES
 )
 
 
-async def main():
-    # Initialize database pool
-    db = Database(db_url=db_url)
-    try:
-        logger.info("Initializing database connection pool...")
-        await db.init_pool()
-        logger.info("Database connection pool initialized successfully")
-        
-        # Initialize admin users from environment variable
-        if ADMIN_IDS:
-            logger.info(f"Initializing {len(ADMIN_IDS)} admin users from ADMIN_IDS...")
-            await db.initialize_admins(ADMIN_IDS)
-        else:
-            logger.info("No ADMIN_IDS provided, skipping admin initialization")
-    except Exception as e:
-        logger.error(f"Failed to initialize database: {e}", exc_info=True)
-        raise
-    
+def build_application(db: Database, token: str, admin_ids: list, request: Optional[BaseRequest] = None,
+                      api_url: Optional[str] = None, metrics: Optional[Metrics] = None,
+                      tracer: Optional[Tracer] = None) -> Application:
+    """Create the Application with every handler registered.
+
+    request replaces the HTTP transport used for Bot API calls (the load test
+    passes an in-process stub); api_url replaces https://api.telegram.org.
+    With metrics, handler callbacks and Bot API calls are timed; with tracer,
+    updates are traced through them.
+    """
     # Initialize handlers
-    handlers = BotHandlers(db, ADMIN_IDS)
+    handlers = BotHandlers(db, admin_ids, tracer=tracer)
     
     # Create application
-    application = Application.builder().token(BOT_TOKEN).build()
+    builder = Application.builder().token(token)
+    if api_url:
+        api_url = api_url.rstrip('/')
+        builder = builder.base_url(f"{api_url}/bot").base_file_url(f"{api_url}/file/bot")
+    updates_request = request
+    if metrics is not None or tracer is not None:
+        # Same transports the builder would create, wrapped to be timed
+        updates_request = request or HTTPXRequest()
+        request = request or HTTPXRequest(connection_pool_size=256)
+        if tracer is not None:
+            request = tracer.instrument_request(request)
+        if metrics is not None:
+            updates_request = metrics.instrument_request(updates_request)
+            request = metrics.instrument_request(request)
+    if request is not None:
+        builder = builder.request(request).get_updates_request(updates_request)
+    application = builder.build()
 
     # Start command
     application.add_handler(CommandHandler("start", handlers.start))
@@ -88,6 +133,10 @@ async def main():
         await update.message.reply_text("Бот работает! Используйте /start для получения клавиатуры.")
     application.add_handler(CommandHandler("test", test_command))
 
+    # Admin: slowest database statements
+    application.add_handler(CommandHandler("slowqueries", handlers.admin_slow_queries))
+    application.add_handler(CommandHandler("traces", handlers.admin_traces))
+
     # Admin: Schedule viewing
     admin_schedule_conv = ConversationHandler(
         entry_points=[MessageHandler(filters.Regex("^1\. Расписание$"), handlers.admin_schedule)],
@@ -203,6 +252,53 @@ async def main():
     )
     application.add_handler(admin_shifts_conv)
 
+    # Admin: Auto-scheduling of open slots
+    admin_autoschedule_conv = ConversationHandler(
+        entry_points=[CommandHandler("autoschedule", handlers.admin_autoschedule)],
+        states={
+            WAITING_AUTOSCHEDULE_PERIOD: [
+                CallbackQueryHandler(handlers.admin_autoschedule_period_selected, pattern="^(period_|back)"),
+                MessageHandler(filters.TEXT & ~filters.COMMAND, handlers.admin_autoschedule_period)
+            ],
+            WAITING_AUTOSCHEDULE_CONFIRM: [
+                CallbackQueryHandler(handlers.admin_autoschedule_confirm, pattern="^autoschedule_")
+            ],
+        },
+        fallbacks=[
+            CommandHandler("cancel", handlers.cancel),
+            MessageHandler(filters.Regex("^(1\. Расписание|2\. Редактировать расписание|3\. Отчет|4\. Поставить смены|5\. Управление сотрудниками|6\. Сотрудник свободен в)$"), handlers.handle_menu_command_in_conversation)
+        ]
+    )
+    application.add_handler(admin_autoschedule_conv)
+
+    # Admin: File export of schedule, shifts and payroll
+    admin_export_conv = ConversationHandler(
+        entry_points=[CommandHandler("export", handlers.admin_export)],
+        states={
+            WAITING_EXPORT_KIND: [
+                CallbackQueryHandler(handlers.admin_export_kind_selected, pattern="^(export_|back)")
+            ],
+            WAITING_EXPORT_EMPLOYEE: [
+                CallbackQueryHandler(handlers.admin_export_employee_selected, pattern="^(emp_|back)")
+            ],
+            WAITING_EXPORT_PERIOD: [
+                CallbackQueryHandler(handlers.admin_export_period_selected, pattern="^(period_|back)"),
+                MessageHandler(filters.TEXT & ~filters.COMMAND, handlers.admin_export_period)
+            ],
+            WAITING_EXPORT_RATE: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, handlers.admin_export_rate)
+            ],
+            WAITING_EXPORT_FORMAT: [
+                CallbackQueryHandler(handlers.admin_export_format_selected, pattern="^(format_|back)")
+            ],
+        },
+        fallbacks=[
+            CommandHandler("cancel", handlers.cancel),
+            MessageHandler(filters.Regex("^(1\. Расписание|2\. Редактировать расписание|3\. Отчет|4\. Поставить смены|5\. Управление сотрудниками|6\. Сотрудник свободен в)$"), handlers.handle_menu_command_in_conversation)
+        ]
+    )
+    application.add_handler(admin_export_conv)
+
     # Employee: Salary
     employee_salary_conv = ConversationHandler(
         entry_points=[MessageHandler(filters.Regex("^1\. Моя зарплата$"), handlers.employee_salary)],
@@ -334,6 +430,9 @@ async def main():
             WAITING_FREE_TIME_EMPLOYEE: [
                 CallbackQueryHandler(handlers.admin_free_time_employee_selected, pattern="^(emp_|back)")
             ],
+            WAITING_FREE_TIME_WEEK: [
+                CallbackQueryHandler(handlers.admin_free_time_week_selected, pattern="^(week_|back)")
+            ],
         },
         fallbacks=[
             CommandHandler("cancel", handlers.cancel),
@@ -353,6 +452,108 @@ async def main():
 
     application.add_error_handler(error_handler)
 
+    if metrics is not None:
+        metrics.instrument_application(application, STATE_NAMES)
+        metrics.add_gauge('bot_update_queue_depth', "Updates received but not yet processed", (),
+                          lambda: {(): application.update_queue.qsize()})
+        metrics.add_gauge('bot_db_pool_connections', "Database pool connections", ('state',),
+                          lambda: {(state,): count for state, count in db.pool_stats().items()})
+    if tracer is not None:
+        tracer.instrument_application(application, STATE_NAMES)
+
+    return application
+
+
+async def migrate_partitions():
+    """Convert schedule_slots and shifts of an existing database to monthly partitions"""
+    db = Database(db_url=db_url)
+    try:
+        await db.init_pool()
+        if await db.migrate_to_partitions():
+            logger.info("schedule_slots and shifts are now partitioned by month")
+        else:
+            logger.info("schedule_slots and shifts are already partitioned")
+    finally:
+        await db.close_pool()
+
+
+async def backup(path: str):
+    """Dump all tables into a compressed archive"""
+    db = Database(db_url=db_url)
+    try:
+        await db.init_pool()
+        manifest = await db.backup(path)
+        rows = sum(table['rows'] for table in manifest['tables'].values())
+        logger.info(f"Backup written to {path}: {rows} rows in {len(manifest['tables'])} tables")
+    finally:
+        await db.close_pool()
+
+
+async def restore(path: str):
+    """Replace all data with the contents of a backup archive"""
+    db = Database(db_url=db_url)
+    try:
+        await db.init_pool()
+        manifest = await db.restore(path)
+        logger.info(f"Restored backup from {manifest['created_at']} ({path})")
+    finally:
+        await db.close_pool()
+
+
+async def export_parquet(out_dir: str, full: bool):
+    """Export closed months of shift history as Parquet files"""
+    db = Database(db_url=db_url)
+    try:
+        await db.init_pool()
+        written = await db.export_shift_history(out_dir, full=full)
+        if written:
+            logger.info(f"Exported {sum(written.values())} shifts for {len(written)} months to {out_dir}")
+        else:
+            logger.info(f"No new months to export to {out_dir}")
+    finally:
+        await db.close_pool()
+
+
+async def main():
+    if not BOT_TOKEN:
+        raise ValueError("BOT_TOKEN not found in environment variables")
+
+    # Initialize database pool
+    db = Database(db_url=db_url)
+    metrics = Metrics() if METRICS_PORT else None
+    if metrics is not None:
+        db.add_query_logger(metrics.observe_query)
+    tracer = Tracer(TRACE_SAMPLE, buffer_size=TRACE_BUFFER, path=TRACE_FILE) if TRACE_SAMPLE > 0 else None
+    if tracer is not None:
+        db.add_query_logger(tracer.observe_query)
+        tracer.instrument_database(db)
+    if SLOW_QUERY_MS > 0:
+        db.enable_slow_query_log(SLOW_QUERY_MS, explain_sample=SLOW_QUERY_EXPLAIN_SAMPLE)
+    try:
+        logger.info("Initializing database connection pool...")
+        await db.init_pool()
+        logger.info("Database connection pool initialized successfully")
+        
+        # Initialize admin users from environment variable
+        if ADMIN_IDS:
+            logger.info(f"Initializing {len(ADMIN_IDS)} admin users from ADMIN_IDS...")
+            await db.initialize_admins(ADMIN_IDS)
+        else:
+            logger.info("No ADMIN_IDS provided, skipping admin initialization")
+    except Exception as e:
+        logger.error(f"Failed to initialize database: {e}", exc_info=True)
+        raise
+    
+    maintenance = MaintenanceJob(
+        db,
+        interval=MAINTENANCE_INTERVAL_MINUTES * 60,
+        free_time_retention_days=FREE_TIME_RETENTION_DAYS,
+        archive_after_days=ARCHIVE_AFTER_DAYS
+    )
+    
+    application = build_application(db, BOT_TOKEN, ADMIN_IDS, api_url=TELEGRAM_API_URL, metrics=metrics,
+                                    tracer=tracer)
+
     # Run bot
     logger.info("Bot starting...")
     updater_started = False
@@ -360,8 +561,21 @@ async def main():
         # application.run_polling() handles async internally
         await application.initialize()
         await application.start()
-        await application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+        if WEBHOOK_URL:
+            await application.updater.start_webhook(
+                listen=WEBHOOK_LISTEN,
+                port=WEBHOOK_PORT,
+                url_path=urlsplit(WEBHOOK_URL).path.lstrip('/'),
+                webhook_url=WEBHOOK_URL,
+                secret_token=WEBHOOK_SECRET,
+                allowed_updates=Update.ALL_TYPES
+            )
+        else:
+            await application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
         updater_started = True
+        maintenance.start()
+        if metrics is not None:
+            await metrics.start(METRICS_LISTEN, METRICS_PORT)
         logger.info("Bot is running. Press Ctrl+C to stop.")
         # Keep the bot running until interrupted
         stop_event = asyncio.Event()
@@ -374,6 +588,14 @@ async def main():
         raise
     finally:
         # Cleanup - only stop what was started
+        try:
+            await maintenance.stop()
+        except Exception as e:
+            logger.warning(f"Error stopping maintenance job: {e}")
+        if metrics is not None:
+            await metrics.stop()
+        if tracer is not None:
+            tracer.close()
         if updater_started:
             try:
                 await application.updater.stop()
@@ -395,4 +617,25 @@ async def main():
 
 
 if __name__ == '__main__':
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(description="Scheduler bot")
+    subcommands = parser.add_subparsers(dest='command')
+    subcommands.add_parser('migrate-partitions', help="partition schedule_slots and shifts by month")
+    backup_parser = subcommands.add_parser('backup', help="dump all tables into a .tar.gz archive")
+    backup_parser.add_argument('path')
+    restore_parser = subcommands.add_parser('restore', help="replace all data with a backup archive")
+    restore_parser.add_argument('path')
+    parquet_parser = subcommands.add_parser('export-parquet', help="export shift history as monthly Parquet files")
+    parquet_parser.add_argument('out_dir')
+    parquet_parser.add_argument('--full', action='store_true', help="rewrite all months instead of appending new ones")
+    args = parser.parse_args()
+
+    if args.command == 'migrate-partitions':
+        asyncio.run(migrate_partitions())
+    elif args.command == 'backup':
+        asyncio.run(backup(args.path))
+    elif args.command == 'restore':
+        asyncio.run(restore(args.path))
+    elif args.command == 'export-parquet':
+        asyncio.run(export_parquet(args.out_dir, args.full))
+    else:
+        asyncio.run(main())
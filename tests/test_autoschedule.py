@@ -0,0 +1,157 @@
+import random
+from datetime import datetime
+
+from asyncpg import Range
+
+from bot.autoschedule import Assignment, OpenSlot, plan_from_records, solve
+from bot.availability import merge_intervals, range_to_interval
+
+H = 60
+
+
+def hours(start: float, end: float):
+    return int(start * H), int(end * H)
+
+
+def check_plan(plan, slots, free_time, busy):
+    """Invariants every plan must keep"""
+    by_id = {slot.slot_id: slot for slot in slots}
+    per_slot = {}
+    per_employee = {}
+    for a in plan:
+        slot = by_id[a.slot_id]
+        start, end = slot.interval
+        # Free for the whole slot and not on another shift
+        assert any(f_start <= start and end <= f_end for f_start, f_end in merge_intervals(free_time[a.employee_id]))
+        assert not any(s < end and start < e for s, e in busy.get(a.employee_id, ()))
+        per_slot.setdefault(a.slot_id, []).append(a.employee_id)
+        per_employee.setdefault(a.employee_id, []).append(slot.interval)
+    for slot_id, employees in per_slot.items():
+        assert len(employees) <= by_id[slot_id].missing
+        assert len(set(employees)) == len(employees)
+    for intervals in per_employee.values():
+        intervals.sort()
+        for (_, previous_end), (next_start, _) in zip(intervals, intervals[1:]):
+            assert next_start >= previous_end
+
+
+def test_merge_intervals():
+    assert merge_intervals([]) == []
+    assert merge_intervals([(5, 8), (1, 3), (2, 4)]) == [(1, 4), (5, 8)]
+    # Touching intervals are merged, contained ones absorbed
+    assert merge_intervals([(1, 3), (3, 5), (2, 4)]) == [(1, 5)]
+    assert merge_intervals([(1, 10), (2, 3)]) == [(1, 10)]
+
+
+def test_range_to_interval():
+    base = datetime(2025, 1, 1)
+    assert range_to_interval(Range(datetime(2025, 1, 1, 9), datetime(2025, 1, 1, 10, 30)), base) == (540, 630)
+    # Past midnight continues above 1440
+    assert range_to_interval(Range(datetime(2025, 1, 1, 22), datetime(2025, 1, 2, 2)), base) == (1320, 1560)
+    assert range_to_interval(Range(empty=True), base) is None
+    assert range_to_interval(None, base) is None
+
+
+def test_fills_a_slot_with_an_employee_free_for_all_of_it():
+    slots = [OpenSlot(1, hours(9, 10), 1)]
+    assert solve(slots, {7: [hours(8, 12)]}, {}) == [Assignment(1, 7)]
+
+
+def test_partial_free_time_is_not_enough():
+    slots = [OpenSlot(1, hours(9, 11), 1)]
+    assert solve(slots, {7: [hours(9, 10)]}, {}) == []
+
+
+def test_adjacent_free_time_is_merged():
+    slots = [OpenSlot(1, hours(9, 11), 1)]
+    assert solve(slots, {7: [hours(9, 10), hours(10, 12)]}, {}) == [Assignment(1, 7)]
+
+
+def test_employees_on_an_overlapping_shift_are_skipped():
+    slots = [OpenSlot(1, hours(9, 10), 1)]
+    free_time = {7: [hours(8, 12)], 8: [hours(8, 12)]}
+    assert solve(slots, free_time, {7: [hours(9.5, 11)]}) == [Assignment(1, 8)]
+
+
+def test_a_touching_shift_does_not_block():
+    slots = [OpenSlot(1, hours(9, 10), 1)]
+    assert solve(slots, {7: [hours(8, 12)]}, {7: [hours(10, 11)]}) == [Assignment(1, 7)]
+
+
+def test_missing_places_get_different_employees():
+    slots = [OpenSlot(1, hours(9, 10), 2)]
+    plan = solve(slots, {7: [hours(8, 12)], 8: [hours(8, 12)], 9: [hours(8, 12)]}, {})
+    assert len(plan) == 2
+    assert len({a.employee_id for a in plan}) == 2
+
+
+def test_no_employee_gets_overlapping_slots():
+    slots = [OpenSlot(1, hours(9, 11), 1), OpenSlot(2, hours(10, 12), 1)]
+    plan = solve(slots, {7: [hours(8, 13)]}, {})
+    assert len(plan) == 1
+
+
+def test_every_place_is_filled_when_possible():
+    # Employee 7 can take either slot, 8 only the first: 7 must go to the second
+    slots = [OpenSlot(1, hours(9, 10), 1), OpenSlot(2, hours(9, 10), 1)]
+    free_time = {7: [hours(8, 12)], 8: [hours(8, 12)]}
+    busy = {}
+    plan = solve(slots, free_time, busy)
+    assert len(plan) == 2
+    check_plan(plan, slots, free_time, busy)
+
+    slots = [OpenSlot(1, hours(9, 10), 1), OpenSlot(2, hours(14, 15), 1)]
+    free_time = {7: [hours(8, 16)], 8: [hours(8, 12)]}
+    plan = solve(slots, free_time, {})
+    assert sorted(plan) == [Assignment(1, 8), Assignment(2, 7)]
+
+
+def test_load_is_spread_evenly():
+    slots = [OpenSlot(i, hours(8 + i, 9 + i), 1) for i in range(4)]
+    free_time = {7: [hours(0, 24)], 8: [hours(0, 24)]}
+    plan = solve(slots, free_time, {})
+    assert len(plan) == 4
+    assert sorted(a.employee_id for a in plan) == [7, 7, 8, 8]
+
+
+def test_existing_load_is_taken_into_account():
+    slots = [OpenSlot(1, hours(9, 10), 1)]
+    free_time = {7: [hours(0, 24)], 8: [hours(0, 24)]}
+    assert solve(slots, free_time, {}, load={7: 3}) == [Assignment(1, 8)]
+
+
+def test_full_slots_are_ignored():
+    assert solve([OpenSlot(1, hours(9, 10), 0)], {7: [hours(0, 24)]}, {}) == []
+
+
+def test_random_plans_keep_the_rules():
+    rng = random.Random(1)
+    for _ in range(200):
+        slots = []
+        for slot_id in range(rng.randint(1, 8)):
+            start = rng.randint(0, 40) * 15
+            slots.append(OpenSlot(slot_id, (start, start + rng.choice((30, 60, 120, 240))), rng.randint(1, 3)))
+        free_time, busy = {}, {}
+        for employee_id in range(rng.randint(1, 6)):
+            free_time[employee_id] = [
+                (start, start + rng.choice((60, 180, 480)))
+                for start in (rng.randint(0, 40) * 15 for _ in range(rng.randint(1, 3)))
+            ]
+            if rng.random() < 0.3:
+                start = rng.randint(0, 40) * 15
+                busy[employee_id] = [(start, start + 60)]
+        plan = solve(slots, free_time, busy)
+        check_plan(plan, slots, free_time, busy)
+
+
+def test_plan_from_records():
+    base = datetime(2025, 1, 1)
+
+    def period(start_hour, end_hour):
+        return Range(datetime(2025, 1, 1, start_hour), datetime(2025, 1, 1, end_hour))
+
+    slot_rows = [{'id': 1, 'period': period(9, 10), 'missing': 1}, {'id': 2, 'period': period(9, 10), 'missing': 1}]
+    shift_rows = [{'employee_id': 7, 'period': period(18, 20)}]
+    free_rows = [{'employee_id': 7, 'period': period(8, 12)}, {'employee_id': 8, 'period': period(8, 12)}]
+    plan = plan_from_records(slot_rows, shift_rows, free_rows, base)
+    assert sorted(plan) == [Assignment(1, 7), Assignment(2, 8)] or sorted(plan) == [Assignment(1, 8), Assignment(2, 7)]
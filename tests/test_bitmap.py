@@ -0,0 +1,122 @@
+from datetime import time
+
+import pytest
+
+from bot import bitmap
+from bot.bitmap import FULL_DAY, QUARTERS, DayBitmaps, group_by_day, minutes_mask, popcount, quarter_bit, time_mask
+
+
+@pytest.fixture(params=['ints', 'numpy'])
+def backend(request, monkeypatch):
+    """Run DayBitmaps tests with and without NumPy"""
+    if request.param == 'numpy':
+        monkeypatch.setattr(bitmap, 'np', pytest.importorskip('numpy'))
+    else:
+        monkeypatch.setattr(bitmap, 'np', None)
+    return request.param
+
+
+def quarters(*indexes):
+    result = 0
+    for index in indexes:
+        result |= quarter_bit(index)
+    return result
+
+
+def test_first_quarter_is_the_most_significant_bit():
+    assert quarter_bit(0) == 1 << (QUARTERS - 1)
+    assert quarter_bit(QUARTERS - 1) == 1
+    assert minutes_mask(0, 15) == quarter_bit(0)
+
+
+def test_minutes_mask_covers_touched_quarters():
+    assert minutes_mask(9 * 60, 10 * 60) == quarters(36, 37, 38, 39)
+    # Partial quarters at both ends are included
+    assert minutes_mask(9 * 60 + 5, 9 * 60 + 20) == quarters(36, 37)
+
+
+def test_minutes_mask_clamps_to_the_day():
+    assert minutes_mask(-30, 15) == quarter_bit(0)
+    assert minutes_mask(23 * 60 + 45, 25 * 60) == quarter_bit(QUARTERS - 1)
+    assert minutes_mask(0, 24 * 60) == FULL_DAY
+    assert minutes_mask(600, 600) == 0
+    assert minutes_mask(600, 500) == 0
+
+
+def test_time_mask_runs_to_midnight_when_the_end_is_not_after_the_start():
+    assert time_mask(time(9), time(10)) == minutes_mask(540, 600)
+    assert time_mask(time(22), time(2)) == minutes_mask(22 * 60, 24 * 60)
+    assert time_mask(time(0), time(0)) == FULL_DAY
+
+
+def test_popcount():
+    assert popcount(0) == 0
+    assert popcount(FULL_DAY) == QUARTERS
+    assert popcount(minutes_mask(540, 600)) == 4
+
+
+def test_bitmap_lookup(backend):
+    bitmaps = DayBitmaps([5, 7], [quarters(1), quarters(2)])
+    assert len(bitmaps) == 2
+    assert bitmaps.bitmap(7) == quarters(2)
+    assert bitmaps.bitmap(99) == 0
+
+
+def test_free_for(backend):
+    morning = minutes_mask(8 * 60, 12 * 60)
+    bitmaps = DayBitmaps([1, 2, 3], [morning, minutes_mask(9 * 60, 10 * 60), FULL_DAY])
+    assert bitmaps.free_for(minutes_mask(9 * 60, 10 * 60)) == [1, 2, 3]
+    assert bitmaps.free_for(minutes_mask(9 * 60, 11 * 60)) == [1, 3]
+    assert bitmaps.free_for(minutes_mask(13 * 60, 14 * 60)) == [3]
+    assert bitmaps.free_for(0) == [1, 2, 3]
+
+
+def test_coverage(backend):
+    slot = minutes_mask(9 * 60, 10 * 60)
+    bitmaps = DayBitmaps([1, 2, 3], [slot, minutes_mask(9 * 60, 9 * 60 + 30), 0])
+    assert bitmaps.coverage(slot) == {1: 1.0, 2: 0.5, 3: 0.0}
+    assert bitmaps.coverage(0) == {1: 0.0, 2: 0.0, 3: 0.0}
+
+
+def test_common(backend):
+    bitmaps = DayBitmaps([1, 2], [minutes_mask(8 * 60, 12 * 60), minutes_mask(10 * 60, 14 * 60)])
+    assert bitmaps.common() == minutes_mask(10 * 60, 12 * 60)
+    assert bitmaps.common([1]) == minutes_mask(8 * 60, 12 * 60)
+    assert bitmaps.common([]) == 0
+
+
+def test_free_counts(backend):
+    bitmaps = DayBitmaps([1, 2], [quarters(0, 1), quarters(1)])
+    counts = bitmaps.free_counts()
+    assert len(counts) == QUARTERS
+    assert counts[:3] == [1, 2, 0]
+    assert sum(counts) == 3
+
+
+def test_empty_day(backend):
+    bitmaps = DayBitmaps([], [])
+    assert bitmaps.free_for(quarters(0)) == []
+    assert bitmaps.free_counts() == [0] * QUARTERS
+
+
+class FakeBits:
+    """Stands in for asyncpg's BitString"""
+
+    def __init__(self, value: int):
+        self.value = value
+
+    def to_int(self) -> int:
+        return self.value
+
+
+def test_group_by_day():
+    rows = [
+        {'employee_id': 1, 'date': 'mon', 'bits': FakeBits(3)},
+        {'employee_id': 2, 'date': 'tue', 'bits': FakeBits(5)},
+        {'employee_id': 3, 'date': 'mon', 'bits': FakeBits(8)},
+    ]
+    days = group_by_day(rows)
+    assert sorted(days) == ['mon', 'tue']
+    assert days['mon'].employee_ids == [1, 3]
+    assert days['mon'].bitmap(3) == 8
+    assert days['tue'].bitmap(2) == 5
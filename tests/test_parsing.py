@@ -0,0 +1,39 @@
+from datetime import date, time
+
+import pytest
+
+from bot.parsing import parse_date, parse_date_range, parse_time
+
+
+def test_parse_date():
+    assert parse_date('2025-01-31') == date(2025, 1, 31)
+    assert parse_date(' 2025-01-31\n') == date(2025, 1, 31)
+
+
+@pytest.mark.parametrize('value', ['2025-1-31', '31.01.2025', '2025-01-31T00:00', '', '2025-02-30', '2025-13-01'])
+def test_parse_date_rejects(value):
+    with pytest.raises(ValueError):
+        parse_date(value)
+
+
+def test_parse_time():
+    assert parse_time('09:30') == time(9, 30)
+    assert parse_time('23:59:59') == time(23, 59, 59)
+    assert parse_time('00:00') == time(0, 0)
+
+
+@pytest.mark.parametrize('value', ['9:30', '24:00', '12:60', '12:30:60', '12-30', '', '12:30x'])
+def test_parse_time_rejects(value):
+    with pytest.raises(ValueError):
+        parse_time(value)
+
+
+def test_parse_date_range():
+    assert parse_date_range('2025-01-01 2025-01-07') == (date(2025, 1, 1), date(2025, 1, 7))
+    assert parse_date_range('  2025-01-01   2025-01-07 ') == (date(2025, 1, 1), date(2025, 1, 7))
+
+
+@pytest.mark.parametrize('text', ['2025-01-01', '2025-01-01 - 2025-01-07', '2025-01-01 bad'])
+def test_parse_date_range_rejects(text):
+    with pytest.raises(ValueError):
+        parse_date_range(text)
@@ -0,0 +1,61 @@
+from datetime import date
+
+from bot.payroll import month_start, next_month, split_period
+
+TODAY = date(2025, 5, 15)
+
+
+def test_month_start_and_next_month():
+    assert month_start(date(2025, 5, 15)) == date(2025, 5, 1)
+    assert next_month(date(2025, 5, 15)) == date(2025, 6, 1)
+    assert next_month(date(2025, 12, 31)) == date(2026, 1, 1)
+
+
+def test_whole_closed_months_come_from_snapshots():
+    assert split_period(date(2025, 1, 1), date(2025, 3, 31), TODAY) == (
+        [date(2025, 1, 1), date(2025, 2, 1), date(2025, 3, 1)], None, None,
+    )
+
+
+def test_partial_months_around_closed_ones_are_live():
+    months, head, tail = split_period(date(2025, 1, 10), date(2025, 3, 20), TODAY)
+    assert months == [date(2025, 2, 1)]
+    assert head == (date(2025, 1, 10), date(2025, 1, 31))
+    assert tail == (date(2025, 3, 1), date(2025, 3, 20))
+
+
+def test_current_month_is_never_closed():
+    months, head, tail = split_period(date(2025, 3, 1), date(2025, 5, 31), TODAY)
+    assert months == [date(2025, 3, 1), date(2025, 4, 1)]
+    assert head is None
+    assert tail == (date(2025, 5, 1), date(2025, 5, 31))
+
+
+def test_period_without_a_full_closed_month_is_all_head():
+    assert split_period(date(2025, 1, 10), date(2025, 2, 20), TODAY) == (
+        [], (date(2025, 1, 10), date(2025, 2, 20)), None,
+    )
+    assert split_period(date(2025, 5, 1), date(2025, 5, 31), TODAY) == (
+        [], (date(2025, 5, 1), date(2025, 5, 31)), None,
+    )
+
+
+def test_year_boundary():
+    months, head, tail = split_period(date(2024, 12, 15), date(2025, 2, 10), TODAY)
+    assert months == [date(2025, 1, 1)]
+    assert head == (date(2024, 12, 15), date(2024, 12, 31))
+    assert tail == (date(2025, 2, 1), date(2025, 2, 10))
+
+
+def test_empty_period():
+    assert split_period(date(2025, 2, 1), date(2025, 1, 1), TODAY) == ([], None, None)
+
+
+def test_parts_cover_the_period_exactly():
+    start, end = date(2024, 11, 7), date(2025, 4, 3)
+    months, head, tail = split_period(start, end, TODAY)
+    ranges = [head] + [(month, date.fromordinal(next_month(month).toordinal() - 1)) for month in months] + [tail]
+    ranges = [r for r in ranges if r is not None]
+    assert ranges[0][0] == start and ranges[-1][1] == end
+    for (_, previous_end), (next_start, _) in zip(ranges, ranges[1:]):
+        assert next_start.toordinal() == previous_end.toordinal() + 1
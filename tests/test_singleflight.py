@@ -0,0 +1,189 @@
+import asyncio
+import contextvars
+
+import pytest
+
+from bot.models import Slot
+from bot.singleflight import SingleFlight, coalesced, private_copy
+
+request_id = contextvars.ContextVar('request_id', default=None)
+
+
+class Counter:
+    """Slow call that counts how often it actually ran"""
+
+    def __init__(self, result=None, error=None):
+        self.calls = 0
+        self.result = result
+        self.error = error
+        self.release = asyncio.Event()
+
+    async def __call__(self):
+        self.calls += 1
+        await self.release.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result() if callable(self.result) else self.result
+
+
+async def started(*coroutines):
+    """Start coroutines as tasks and let them reach their first await"""
+    tasks = [asyncio.ensure_future(coroutine) for coroutine in coroutines]
+    await asyncio.sleep(0)
+    return tasks
+
+
+def test_identical_calls_share_one_execution():
+    async def scenario():
+        flight = SingleFlight()
+        call = Counter(result=42)
+        tasks = await started(*(flight.do('read', 'key', call) for _ in range(3)))
+        call.release.set()
+        assert await asyncio.gather(*tasks) == [42, 42, 42]
+        assert call.calls == 1
+        assert flight.stats() == {'read': {'calls': 3, 'executed': 1, 'coalesced': 2}}
+
+    asyncio.run(scenario())
+
+
+def test_different_keys_run_separately():
+    async def scenario():
+        flight = SingleFlight()
+        call = Counter(result=1)
+        tasks = await started(flight.do('read', 'a', call), flight.do('read', 'b', call))
+        call.release.set()
+        await asyncio.gather(*tasks)
+        assert call.calls == 2
+
+    asyncio.run(scenario())
+
+
+def test_nothing_is_cached_after_completion():
+    async def scenario():
+        flight = SingleFlight()
+        call = Counter(result=1)
+        call.release.set()
+        await flight.do('read', 'key', call)
+        await flight.do('read', 'key', call)
+        assert call.calls == 2
+
+    asyncio.run(scenario())
+
+
+def test_errors_reach_every_caller():
+    async def scenario():
+        flight = SingleFlight()
+        call = Counter(error=ValueError("boom"))
+        tasks = await started(flight.do('read', 'key', call), flight.do('read', 'key', call))
+        call.release.set()
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        assert [type(result) for result in results] == [ValueError, ValueError]
+        assert call.calls == 1
+
+    asyncio.run(scenario())
+
+
+def test_cancelling_the_first_caller_does_not_cancel_the_others():
+    async def scenario():
+        flight = SingleFlight()
+        call = Counter(result='rows')
+        leader, follower = await started(flight.do('read', 'key', call), flight.do('read', 'key', call))
+        leader.cancel()
+        await asyncio.sleep(0)
+        call.release.set()
+        assert await follower == 'rows'
+        assert leader.cancelled()
+
+    asyncio.run(scenario())
+
+
+def test_shared_results_are_private_copies():
+    async def scenario():
+        flight = SingleFlight()
+        call = Counter(result=lambda: [Slot(id=2), Slot(id=1)])
+        first, second = await started(flight.do('read', 'key', call), flight.do('read', 'key', call))
+        call.release.set()
+        mine, theirs = await first, await second
+        mine.sort(key=lambda slot: slot.id)
+        mine.append(Slot(id=3))
+        mine[0].id = 99
+        assert [slot.id for slot in theirs] == [2, 1]
+
+    asyncio.run(scenario())
+
+
+def test_a_lone_caller_gets_the_original_result():
+    async def scenario():
+        flight = SingleFlight()
+        rows = [Slot(id=1)]
+        call = Counter(result=rows)
+        call.release.set()
+        assert await flight.do('read', 'key', call) is rows
+
+    asyncio.run(scenario())
+
+
+def test_shared_call_runs_outside_the_callers_context():
+    async def scenario():
+        flight = SingleFlight()
+        seen = []
+
+        async def call():
+            seen.append(request_id.get())
+            return None
+
+        request_id.set('update-1')
+        await flight.do('read', 'key', call)
+        assert seen == [None]
+
+    asyncio.run(scenario())
+
+
+def test_private_copy():
+    slot = Slot(id=1, address="A")
+    shared = {1: [slot], 2: [(1, 'name')]}
+    copied = private_copy(shared)
+    assert copied == shared
+    assert copied is not shared and copied[1] is not shared[1]
+    assert copied[1][0] is not slot and copied[1][0] == slot
+    # Tuples are immutable and shared as they are
+    assert copied[2][0] is shared[2][0]
+
+
+class FakeDatabase:
+    def __init__(self):
+        self._singleflight = SingleFlight()
+        self.queries = 0
+
+    @coalesced
+    async def get_rows(self, day, only_open=False):
+        self.queries += 1
+        await asyncio.sleep(0)
+        return [day, only_open]
+
+    @coalesced
+    async def get_by_ids(self, ids):
+        self.queries += 1
+        return list(ids)
+
+
+def test_coalesced_keys_on_arguments():
+    async def scenario():
+        db = FakeDatabase()
+        results = await asyncio.gather(
+            db.get_rows('mon'), db.get_rows('mon'), db.get_rows('mon', only_open=True), db.get_rows('tue'),
+        )
+        assert results == [['mon', False], ['mon', False], ['mon', True], ['tue', False]]
+        assert db.queries == 3
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize('ids', [[1, 2], {1, 2}])
+def test_coalesced_runs_unhashable_arguments_directly(ids):
+    async def scenario():
+        db = FakeDatabase()
+        assert sorted(await db.get_by_ids(ids)) == [1, 2]
+        assert db._singleflight.stats() == {}
+
+    asyncio.run(scenario())